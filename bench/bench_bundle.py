@@ -0,0 +1,87 @@
+################################################################################
+#   Filename:       bench_bundle.py
+#
+#   Description:    Small-file benchmark of 'put -r' and 'get -r'.
+#                   A directory of many small files is uploaded and downloaded
+#                   again with one request per file ('-B 0') and with bundles
+#                   of small files sent in one BPUT/BGET request, through a
+#                   proxy adding a fixed one-way latency, and the files per
+#                   second of each run are compared.
+#
+#                   > py bench_bundle.py
+#                   > py bench_bundle.py --count 5000 --size 2048 --delay-ms 1
+#
+################################################################################
+import os, sys, argparse, re, shutil, subprocess, tempfile
+
+from benchutil import CLIENT_PY, startServer, stopServer
+from bench_pipeline import startProxy
+
+############################## FUNCTIONS ##############################
+
+# run 'put -r' then 'get -r' of a directory in an interactive client.py
+# Arguments:
+#  - port: port to connect to, integer
+#  - dirName: directory to transfer, relative to the client's directory, string
+#  - bundle: '-B' value of the client, integer
+#  - jobs: '-j' value of the client, integer
+#  - directory: working directory of the client, string
+# Return:
+#  - (put, get): seconds taken by each transfer, as reported by the client, floats
+def runClient(port, dirName, bundle, jobs, directory):
+
+    # upload, then remove the local copy and download it again
+    commands = f'put -r {dirName}\n'
+    out = subprocess.run([sys.executable, CLIENT_PY, '127.0.0.1', str(port), '-B', str(bundle), '-j', str(jobs)],
+                         cwd=directory, input=commands + 'bye\n', capture_output=True, text=True, check=True).stdout
+    shutil.move(os.path.join(directory, dirName), os.path.join(directory, dirName + '.orig'))
+    out += subprocess.run([sys.executable, CLIENT_PY, '127.0.0.1', str(port), '-B', str(bundle), '-j', str(jobs)],
+                          cwd=directory, input=f'get -r {dirName}\nbye\n', capture_output=True, text=True, check=True).stdout
+
+    # every file must have come back unchanged
+    for name in os.listdir(os.path.join(directory, dirName + '.orig')):
+        with open(os.path.join(directory, dirName + '.orig', name), 'rb') as a, open(os.path.join(directory, dirName, name), 'rb') as b:
+            if a.read() != b.read():
+                raise RuntimeError(f'{name} differs after the round trip')
+    shutil.rmtree(os.path.join(directory, dirName))
+    shutil.move(os.path.join(directory, dirName + '.orig'), os.path.join(directory, dirName))
+
+    times = re.findall(r'(\d+) files (uploaded|downloaded), (\d+) failed, \d+ bytes in ([\d.]+) s', out)
+    if len(times) != 2 or any(int(failed) for _, _, failed, _ in times):
+        raise RuntimeError('client.py did not transfer every file:\n' + out)
+    return float(times[0][3]), float(times[1][3])
+
+############################## MAIN CODE ##############################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Small-file benchmark of 'put -r' and 'get -r', a request per file vs bundles")
+    parser.add_argument('--count', type=int, default=2000, help='Number of small files (default 2000)')
+    parser.add_argument('--size', type=int, default=1024, help='Size of each small file in bytes (default 1024)')
+    parser.add_argument('--delay-ms', type=float, default=1, help='One-way latency added by the proxy, ms, 0 connects directly (default 1)')
+    parser.add_argument('--jobs', type=int, default=4, help="'-j' of the client (default 4)")
+    parser.add_argument('--bundle', type=int, default=256, help="'-B' of the bundled run (default 256)")
+    sysArgs = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as serverDir, tempfile.TemporaryDirectory() as clientDir:
+
+        # the small files, named to fit in a plain PUT/GET
+        os.mkdir(os.path.join(clientDir, 'sm'))
+        for i in range(sysArgs.count):
+            with open(os.path.join(clientDir, 'sm', f'f{i}.bin'), 'wb') as f:
+                f.write(os.urandom(sysArgs.size))
+
+        proc, port = startServer(serverDir, '-e', 'asyncio')
+        try:
+            if sysArgs.delay_ms > 0: port = startProxy(port, sysArgs.delay_ms / 1000)
+            single = runClient(port, 'sm', 0, sysArgs.jobs, clientDir)
+            bundled = runClient(port, 'sm', sysArgs.bundle, sysArgs.jobs, clientDir)
+        finally:
+            stopServer(proc)
+
+    rtt = 2 * sysArgs.delay_ms
+    print(f'{sysArgs.count} files of {sysArgs.size} bytes, {sysArgs.jobs} connections, RTT {rtt:.1f} ms')
+    for what, i in (('put -r', 0), ('get -r', 1)):
+        print(f'  {what} -B 0:   {single[i]:8.3f} s  {sysArgs.count / single[i]:10.1f} files/s')
+        print(f'  {what} -B {sysArgs.bundle:<4d} {bundled[i]:8.3f} s  {sysArgs.count / bundled[i]:10.1f} files/s')
+        print(f'  speedup:       {single[i] / bundled[i]:8.1f}x')
@@ -0,0 +1,112 @@
+################################################################################
+#   Filename:       bench_delta.py
+#
+#   Description:    Benchmark of delta uploads ('put -d') against a full PUT.
+#                   A large file is stored on the server, then a percentage of
+#                   it is overwritten at random places in the client's copy,
+#                   and the new version is uploaded with 'put -d' (only the
+#                   changed blocks are sent) and with a plain 'put'.
+#
+#                   > py bench_delta.py
+#                   > py bench_delta.py --size-mb 256 --edit-percent 1 --edits 100
+#
+################################################################################
+import os, sys, argparse, hashlib, random, re, shutil, subprocess, tempfile, time
+
+from benchutil import CLIENT_PY, startServer, stopServer
+
+############################## FUNCTIONS ##############################
+
+# write a file of random data, 1 MB at a time
+# Arguments:
+#  - path: file to create, string
+#  - size: size of the file, in bytes
+def writeRandom(path, size):
+    with open(path, 'wb') as f:
+        for offset in range(0, size, 1024 * 1024):
+            f.write(os.urandom(min(1024 * 1024, size - offset)))
+
+# overwrite a percentage of a file with random data, spread over several edits at random places
+# Arguments:
+#  - path: file to edit, string
+#  - percent: share of the file to overwrite, float
+#  - edits: number of places edited, integer
+def editFile(path, percent, edits):
+    size = os.path.getsize(path)
+    length = max(1, int(size * percent / 100 / edits))
+    rng = random.Random(366)
+    with open(path, 'r+b') as f:
+        for _ in range(edits):
+            f.seek(rng.randrange(0, size - length))
+            f.write(os.urandom(length))
+
+# sha256 of a file
+# Arguments:
+#  - path: file to hash, string
+# Return:
+#  - hex digest, string
+def sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+# run one command with client.py and time it
+# Arguments:
+#  - port: port to connect to, integer
+#  - command: command to run, string
+#  - directory: working directory of the client, string
+# Return:
+#  - (seconds, output): time taken by the client, float, and what it printed, string
+def runClient(port, command, directory):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, CLIENT_PY, '127.0.0.1', str(port)], input=command + '\nbye\n',
+                            cwd=directory, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result.stdout
+
+############################## MAIN CODE ##############################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmark of client.py 'put -d' delta uploads against a full put")
+    parser.add_argument('--size-mb', type=int, default=1024, help='Size of the file in MB (default 1024)')
+    parser.add_argument('--edit-percent', type=float, default=1, help='Share of the file overwritten, in percent (default 1)')
+    parser.add_argument('--edits', type=int, default=100, help='Number of places the edit is spread over (default 100)')
+    sysArgs = parser.parse_args()
+
+    size = sysArgs.size_mb * 1024 * 1024
+    name = 'delta.bin'
+
+    with tempfile.TemporaryDirectory() as serverDir, tempfile.TemporaryDirectory() as clientDir:
+
+        # the old version is copied directly to the server's directory, then edited on the client
+        clientFile = os.path.join(clientDir, name)
+        writeRandom(clientFile, size)
+        shutil.copyfile(clientFile, os.path.join(serverDir, name))
+        editFile(clientFile, sysArgs.edit_percent, sysArgs.edits)
+        expected = sha256(clientFile)
+
+        proc, port = startServer(serverDir)
+        try:
+            deltaTime, output = runClient(port, 'put -d ' + name, clientDir)
+            deltaOk = sha256(os.path.join(serverDir, name)) == expected
+            fullTime, _ = runClient(port, 'put ' + name, clientDir)
+        finally:
+            stopServer(proc)
+
+    # bytes sent and signatures received, as reported by the client
+    match = re.search(r'(\d+) bytes reused, (\d+) bytes sent, (\d+) bytes of signatures', output)
+    if match is None or not deltaOk:
+        print('delta upload failed:\n' + output)
+        sys.exit(1)
+    reused, sent, signatures = map(int, match.groups())
+
+    print(f'{sysArgs.size_mb} MB file, {sysArgs.edit_percent}% overwritten in {sysArgs.edits} places')
+    print(f'  full put:   {fullTime:8.3f} s  {size:14d} bytes sent')
+    print(f'  put -d:     {deltaTime:8.3f} s  {sent:14d} bytes sent, {signatures} bytes of signatures received, {reused} bytes reused')
+    print(f'  traffic:    {(sent + signatures) / size * 100:8.2f} % of a full put')
+    print(f'  speedup:    {fullTime / deltaTime:8.1f}x (localhost)')
+    # on a slower link the full put takes size / bandwidth, the delta is faster below this bandwidth
+    breakEven = (size - sent - signatures) / deltaTime / (1024 * 1024)
+    print(f'  break-even: {breakEven:8.1f} MB/s, put -d is faster on any slower link')
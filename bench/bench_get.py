@@ -0,0 +1,124 @@
+################################################################################
+#   Filename:       bench_get.py
+#
+#   Description:    Benchmark of the server's GET response path. Compares the
+#                   original path (read whole file, join header + data, send)
+#                   with the current one (header sent alone, data sent with
+#                   socket.sendfile) over a localhost TCP connection.
+#                   - Reports wall time, throughput, server CPU time and peak
+#                     python memory allocated while serving each GET
+#                   - Default sizes are testVid.mp4 (404276 bytes), 16 MB and
+#                     256 MB, use '--sizes' to choose others
+#
+#                   > py bench_get.py
+#                   > py bench_get.py --sizes 404276 1073741824 --repeat 3
+#
+################################################################################
+from socket import socket, AF_INET, SOCK_STREAM
+import os, sys, argparse, tempfile, threading, time, tracemalloc, contextlib, io
+
+# import server.py from the server directory next to this one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+import server
+
+############################## FUNCTIONS ##############################
+
+# GET response exactly as the server built it before sendfile was used
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - empty bytes, the response has already been sent
+def oldGetResponse(byte1, clientSocket):
+
+    fNameLen = byte1 & 0x1F
+    fName = server.recvExact(clientSocket, fNameLen).decode()
+    # whole file is read into memory, then copied again into the response
+    with open(fName, 'rb') as f:
+        fBytes = f.read()
+    fSize = len(fBytes)
+    response = ((0b001 << 5) + fNameLen).to_bytes(1, 'big') + fName.encode() + fSize.to_bytes(4, 'big') + fBytes
+    clientSocket.sendall(response)
+    return b''
+
+# serve one GET request on an accepted connection and measure it
+# Arguments:
+#  - serverSocket: listening socket, socket class
+#  - handler: GET handler to call, oldGetResponse or server.getResponse
+#  - result: dict filled with the server-side measurements
+def serveOne(serverSocket, handler, result):
+
+    clientSocket, _ = serverSocket.accept()
+    with clientSocket:
+        byte1 = int.from_bytes(server.recvExact(clientSocket, 1), 'big')
+        tracemalloc.reset_peak()
+        cpuStart = time.thread_time()
+        # silence the server's per-request prints
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = handler(byte1, clientSocket)
+            if response: clientSocket.sendall(response)
+        result['cpu'] = time.thread_time() - cpuStart
+        result['peak'] = tracemalloc.get_traced_memory()[1]
+
+# run one GET of fName through the given handler
+# Arguments:
+#  - handler: GET handler to benchmark
+#  - fName: name of the file to get, string
+# Return:
+#  - dict with wall time, server cpu time and server peak memory
+def runGet(handler, fName):
+
+    serverSocket = socket(AF_INET, SOCK_STREAM)
+    serverSocket.bind(('127.0.0.1', 0))
+    serverSocket.listen(1)
+    result = {}
+    t = threading.Thread(target=serveOne, args=(serverSocket, handler, result))
+    t.start()
+
+    start = time.perf_counter()
+    clientSocket = socket(AF_INET, SOCK_STREAM)
+    clientSocket.connect(serverSocket.getsockname())
+    clientSocket.sendall(((0b001 << 5) + len(fName)).to_bytes(1, 'big') + fName.encode())
+
+    # receive header, then drain the data into a reused buffer
+    byte1 = server.recvExact(clientSocket, 1)[0]
+    server.recvExact(clientSocket, byte1 & 0x1F)
+    fSize = int.from_bytes(server.recvExact(clientSocket, 4), 'big')
+    server.recvToFile(clientSocket, None, fSize)
+    result['wall'] = time.perf_counter() - start
+
+    clientSocket.close()
+    t.join()
+    serverSocket.close()
+    return result
+
+############################## MAIN CODE ##############################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark old and sendfile GET paths of server.py')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[404276, 16 * 2**20, 256 * 2**20], help='File sizes to benchmark, in bytes')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per size and path, best run is reported')
+    sysArgs = parser.parse_args()
+
+    server.DEBUG = 0
+    tracemalloc.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        print(f'{"size":>12} {"path":>8} {"wall s":>9} {"MB/s":>9} {"cpu s":>8} {"peak MB":>9}')
+
+        for size in sysArgs.sizes:
+            # create the file once per size, filled with random data in 1 MB pieces
+            fName = f'bench{size}.bin'
+            with open(fName, 'wb') as f:
+                left = size
+                while left > 0:
+                    f.write(os.urandom(min(left, 2**20)))
+                    left -= min(left, 2**20)
+
+            for label, handler in (('old', oldGetResponse), ('sendfile', server.getResponse)):
+                best = min((runGet(handler, fName) for _ in range(sysArgs.repeat)), key=lambda r: r['wall'])
+                print(f'{size:>12} {label:>8} {best["wall"]:>9.4f} {size / best["wall"] / 2**20:>9.1f} {best["cpu"]:>8.4f} {best["peak"] / 2**20:>9.2f}')
+
+            os.remove(fName)
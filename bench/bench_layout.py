@@ -0,0 +1,112 @@
+################################################################################
+#   Filename:       bench_layout.py
+#
+#   Description:    Latency of the file operations behind PUT, GET and CHANGE
+#                   with the flat and sharded storage layouts of server.py, as
+#                   the number of stored files grows.
+#                   - Fills a directory with empty files up to each count
+#                   - Times opening existing files, creating new ones and
+#                     renaming files, with the paths of each layout
+#
+#                   > py bench_layout.py
+#                   > py bench_layout.py --counts 10000,100000,1000000 --samples 2000
+#
+################################################################################
+import os, sys, argparse, random, tempfile, time
+
+from benchutil import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'server'))
+from server import LAYOUTS
+
+############################## FUNCTIONS ##############################
+
+# create an empty file, and the directories of its path the first time they are needed
+# Arguments:
+#  - path: path of the file, string
+#  - dirs: directories already created, set
+def createFile(path, dirs):
+    parent = os.path.dirname(path)
+    if parent and parent not in dirs:
+        os.makedirs(parent, exist_ok=True)
+        dirs.add(parent)
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+
+# median and 99th percentile of latencies
+# Arguments:
+#  - samples: latencies in seconds, list of floats
+# Return:
+#  - (p50, p99) in microseconds
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1e6, samples[min(len(samples) - 1, len(samples) * 99 // 100)] * 1e6
+
+# time the operations of a layout on random files of a directory holding count files
+# Arguments:
+#  - storage: storage layout, FlatStorage class
+#  - count: number of files stored, integer
+#  - samples: number of each operation timed, integer
+#  - dirs: directories already created, set
+# Return:
+#  - {operation: (p50, p99)} in microseconds
+def timeOperations(storage, count, samples, dirs):
+
+    names = [f'f{i:08d}' for i in random.sample(range(count), min(samples, count))]
+    opened, created, renamed = [], [], []
+
+    # GET: open an existing file
+    for name in names:
+        start = time.perf_counter()
+        os.close(os.open(storage.path(name), os.O_RDONLY))
+        opened.append(time.perf_counter() - start)
+
+    # PUT of a new name: create the file
+    for i, name in enumerate(names):
+        path = storage.path(f'n{i:08d}')
+        start = time.perf_counter()
+        createFile(path, dirs)
+        created.append(time.perf_counter() - start)
+    for i in range(len(names)):
+        os.remove(storage.path(f'n{i:08d}'))
+
+    # CHANGE: rename a file to a new name as the server does, then back untimed
+    for name in names:
+        start = time.perf_counter()
+        storage.rename(name, name + 'r')
+        renamed.append(time.perf_counter() - start)
+        os.rename(storage.path(name + 'r'), storage.path(name))
+
+    return {'open': percentiles(opened), 'create': percentiles(created), 'rename': percentiles(renamed)}
+
+############################## MAIN CODE ##############################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='open/create/rename latency of the flat and sharded storage layouts as the file count grows')
+    parser.add_argument('--counts', default='1000,10000,100000', help='Comma-separated numbers of stored files to measure at (default 1000,10000,100000)')
+    parser.add_argument('--samples', type=int, default=1000, help='Operations of each kind timed at each count (default 1000)')
+    sysArgs = parser.parse_args()
+    counts = sorted(int(c) for c in sysArgs.counts.split(','))
+
+    results = {}
+    cwd = os.getcwd()
+    for layout, storage in ((name, cls()) for name, cls in LAYOUTS.items()):
+        with tempfile.TemporaryDirectory(dir=cwd) as directory:
+            # paths of the layouts are relative to the server directory
+            os.chdir(directory)
+            dirs = set()
+            stored = 0
+            for count in counts:
+                start = time.perf_counter()
+                while stored < count:
+                    createFile(storage.path(f'f{stored:08d}'), dirs)
+                    stored += 1
+                print(f'{layout}: {count} files stored ({time.perf_counter() - start:.1f} s)', file=sys.stderr)
+                results[layout, count] = timeOperations(storage, count, sysArgs.samples, dirs)
+            os.chdir(cwd)
+
+    print(f'{"files":>10}  {"layout":8}' + ''.join(f'  {op + " p50/p99 us":>22}' for op in ('open', 'create', 'rename')))
+    for count in counts:
+        for layout in LAYOUTS:
+            ops = results[layout, count]
+            print(f'{count:>10}  {layout:8}' + ''.join(f'  {ops[op][0]:10.1f} /{ops[op][1]:10.1f}' for op in ('open', 'create', 'rename')))
@@ -0,0 +1,127 @@
+################################################################################
+#   Filename:       bench_mux.py
+#
+#   Description:    Head-of-line blocking benchmark of protocol v2. One large
+#                   GET is started, then small GETs are sent on the same
+#                   connection. With v1 the small responses queue behind the
+#                   large one, with v2 each runs on its own stream and their
+#                   frames are interleaved with the large transfer.
+#
+#                   > py bench_mux.py
+#                   > py bench_mux.py --big-mb 512 --count 50
+#
+################################################################################
+from socket import create_connection, IPPROTO_TCP, TCP_NODELAY
+import os, argparse, importlib.util, statistics, tempfile, threading, time
+
+from benchutil import CLIENT_PY, startServer, stopServer
+
+# client.py is loaded as a module for its MuxConnection and recvExact()
+spec = importlib.util.spec_from_file_location('client', CLIENT_PY)
+client = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(client)
+
+############################## FUNCTIONS ##############################
+
+# GET request of the v1 framing
+# Arguments:
+#  - name: filename, string
+# Return:
+#  - request, bytes
+def getRequest(name):
+    return ((0b001 << 5) + len(name)).to_bytes(1, 'big') + name.encode()
+
+# read one GET response and drop its data
+# Arguments:
+#  - sock: socket or stream to read from
+def readGet(sock):
+    byte1 = client.recvExact(sock, 1)[0]
+    client.recvExact(sock, byte1 & 0x1F)
+    size = int.from_bytes(client.recvExact(sock, 4), 'big')
+    while size > 0:
+        size -= len(client.recvExact(sock, min(size, 1024 * 1024)))
+
+# v1: the large GET then the small ones pipelined on one connection, answered in order
+# Arguments:
+#  - port: port of the server, integer
+#  - count: number of small GETs, integer
+# Return:
+#  - (latencies, total): seconds from the start until each small response was read, list of floats,
+#    and seconds until the large one was read, float
+def runV1(port, count):
+    with create_connection(('127.0.0.1', port)) as sock:
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        start = time.perf_counter()
+        sock.sendall(getRequest('big.bin') + getRequest('small.bin') * count)
+        readGet(sock)
+        total = time.perf_counter() - start
+        latencies = []
+        for _ in range(count):
+            readGet(sock)
+            latencies.append(time.perf_counter() - start)
+        sock.sendall((0b100 << 5).to_bytes(1, 'big'))
+    return latencies, total
+
+# v2: the large GET on one stream, then each small GET on a stream of its own, one after the other
+# Arguments:
+#  - port: port of the server, integer
+#  - count: number of small GETs, integer
+# Return:
+#  - (latencies, total), as for runV1()
+def runV2(port, count):
+    sock = create_connection(('127.0.0.1', port))
+    sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+    if client.helloRequest(sock) < 2:
+        raise RuntimeError('server does not support protocol v2')
+    mux = client.MuxConnection(sock)
+
+    start = time.perf_counter()
+    done = {}
+
+    def big():
+        with mux.open() as stream:
+            stream.sendall(getRequest('big.bin'))
+            readGet(stream)
+        done['total'] = time.perf_counter() - start
+
+    bigThread = threading.Thread(target=big)
+    bigThread.start()
+    latencies = []
+    for _ in range(count):
+        with mux.open() as stream:
+            stream.sendall(getRequest('small.bin'))
+            readGet(stream)
+        latencies.append(time.perf_counter() - start)
+    bigThread.join()
+    mux.close()
+    return latencies, done['total']
+
+############################## MAIN CODE ##############################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Head-of-line blocking benchmark, protocol v1 vs v2')
+    parser.add_argument('--big-mb', type=int, default=256, help='Size of the large file in MB (default 256)')
+    parser.add_argument('--size', type=int, default=512, help='Size of the small file in bytes (default 512)')
+    parser.add_argument('--count', type=int, default=20, help='Number of small GETs (default 20)')
+    sysArgs = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as serverDir:
+
+        with open(os.path.join(serverDir, 'big.bin'), 'wb') as f:
+            for _ in range(sysArgs.big_mb):
+                f.write(os.urandom(1024 * 1024))
+        with open(os.path.join(serverDir, 'small.bin'), 'wb') as f:
+            f.write(os.urandom(sysArgs.size))
+
+        proc, port = startServer(serverDir)
+        try:
+            v1, v1Total = runV1(port, sysArgs.count)
+            v2, v2Total = runV2(port, sysArgs.count)
+        finally:
+            stopServer(proc)
+
+    print(f'{sysArgs.count} GETs of {sysArgs.size} bytes sent right after a GET of {sysArgs.big_mb} MB, one connection')
+    for name, latencies, total in (('v1', v1, v1Total), ('v2', v2, v2Total)):
+        print(f'  {name}: small GETs done after median {statistics.median(latencies) * 1000:8.1f} ms, '
+              f'last {latencies[-1] * 1000:8.1f} ms, large GET {total * 1000:8.1f} ms')
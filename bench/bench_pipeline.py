@@ -0,0 +1,147 @@
+################################################################################
+#   Filename:       bench_pipeline.py
+#
+#   Description:    Latency-injection benchmark of the client's batch mode.
+#                   A proxy between client.py and server.py delays every
+#                   segment by a fixed one-way latency, then the same batch of
+#                   small GETs is run with a window of 1 (one round trip per
+#                   command, like interactive mode) and with a larger window
+#                   (requests pipelined on the one connection).
+#
+#                   > py bench_pipeline.py
+#                   > py bench_pipeline.py --count 1000 --delay-ms 10 --window 128
+#
+################################################################################
+from socket import socket, create_connection, AF_INET, SOCK_STREAM, SHUT_WR, IPPROTO_TCP, TCP_NODELAY
+import os, sys, argparse, heapq, subprocess, tempfile, threading, time
+
+from benchutil import CLIENT_PY, startServer, stopServer
+
+############################## FUNCTIONS ##############################
+
+# copy data from src to dst, holding every segment for delay seconds before sending it
+# Arguments:
+#  - src: socket to read from, socket class
+#  - dst: socket to write to, socket class
+#  - delay: one-way latency to add, in seconds
+def delayedPump(src, dst, delay):
+
+    # (due time, sequence, data) of segments waiting to be sent, sequence keeps them in order
+    due = []
+    cond = threading.Condition()
+    done = False
+
+    def writer():
+        while True:
+            with cond:
+                while not due and not done:
+                    cond.wait()
+                if not due and done:
+                    break
+                when, _, data = due[0]
+                wait = when - time.monotonic()
+                if wait > 0:
+                    cond.wait(wait)
+                    continue
+                heapq.heappop(due)
+            dst.sendall(data)
+        # forward the end of stream once everything before it was sent
+        try:
+            dst.shutdown(SHUT_WR)
+        except OSError:
+            pass
+
+    t = threading.Thread(target=writer, daemon=True)
+    t.start()
+
+    seq = 0
+    while True:
+        try:
+            data = src.recv(65536)
+        except OSError:
+            data = b''
+        with cond:
+            if not data:
+                done = True
+                cond.notify()
+                break
+            heapq.heappush(due, (time.monotonic() + delay, seq, data))
+            seq += 1
+            cond.notify()
+    t.join()
+
+# proxy accepting connections on a free port and forwarding them to the server with added latency
+# Arguments:
+#  - serverPort: port of the server to forward to, integer
+#  - delay: one-way latency to add in each direction, in seconds
+# Return:
+#  - port the proxy listens on, integer
+def startProxy(serverPort, delay):
+
+    listener = socket(AF_INET, SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+
+    def accept():
+        while True:
+            clientSide, _ = listener.accept()
+            serverSide = create_connection(('127.0.0.1', serverPort))
+            # forward each segment as soon as it is due, the proxy must not add Nagle delays of its own
+            for s in (clientSide, serverSide):
+                s.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            threading.Thread(target=delayedPump, args=(clientSide, serverSide, delay), daemon=True).start()
+            threading.Thread(target=delayedPump, args=(serverSide, clientSide, delay), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+# run client.py in batch mode and time it
+# Arguments:
+#  - port: port to connect to, integer
+#  - batchFile: file with the commands, string
+#  - window: batch window of the client, integer
+#  - directory: working directory of the client, string
+# Return:
+#  - seconds taken by the client, float
+def runClient(port, batchFile, window, directory):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, CLIENT_PY, '127.0.0.1', str(port), '-b', batchFile, '-w', str(window)],
+                   cwd=directory, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+############################## MAIN CODE ##############################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Latency-injection benchmark of client.py batch mode')
+    parser.add_argument('--count', type=int, default=1000, help='Number of small GETs (default 1000)')
+    parser.add_argument('--files', type=int, default=10, help='Number of distinct small files fetched (default 10)')
+    parser.add_argument('--size', type=int, default=512, help='Size of each small file in bytes (default 512)')
+    parser.add_argument('--delay-ms', type=float, default=5, help='One-way latency added by the proxy, ms (default 5)')
+    parser.add_argument('--window', type=int, default=64, help='Window of the pipelined run (default 64)')
+    sysArgs = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as serverDir, tempfile.TemporaryDirectory() as clientDir:
+
+        # small files are created directly in the server's directory
+        for i in range(sysArgs.files):
+            with open(os.path.join(serverDir, f'small{i}.bin'), 'wb') as f:
+                f.write(os.urandom(sysArgs.size))
+        batchFile = os.path.join(clientDir, 'batch.txt')
+        with open(batchFile, 'w') as f:
+            for i in range(sysArgs.count):
+                f.write(f'get small{i % sysArgs.files}.bin\n')
+
+        proc, port = startServer(serverDir)
+        try:
+            proxyPort = startProxy(port, sysArgs.delay_ms / 1000)
+            serial = runClient(proxyPort, batchFile, 1, clientDir)
+            pipelined = runClient(proxyPort, batchFile, sysArgs.window, clientDir)
+        finally:
+            stopServer(proc)
+
+    rtt = 2 * sysArgs.delay_ms
+    print(f'{sysArgs.count} GETs of {sysArgs.size} bytes, RTT {rtt:.1f} ms')
+    print(f'  window 1:   {serial:8.3f} s  {sysArgs.count / serial:10.1f} req/s')
+    print(f'  window {sysArgs.window:<4d} {pipelined:8.3f} s  {sysArgs.count / pipelined:10.1f} req/s')
+    print(f'  speedup:    {serial / pipelined:8.1f}x')
@@ -0,0 +1,74 @@
+################################################################################
+#   Filename:       bench_sync.py
+#
+#   Description:    Cost of 'sync' runs of client.py against the size of the tree
+#                   and the number of changes.
+#                   - Syncs a directory of small files to a fresh server, then
+#                     syncs it again unchanged, then after editing and renaming
+#                     a few files
+#                   - Compares each run with a 'put -r' of the whole tree
+#
+#                   > py bench_sync.py
+#                   > py bench_sync.py --count 20000 --changes 50
+#
+################################################################################
+import os, sys, argparse, random, re, subprocess, tempfile, time
+
+from benchutil import CLIENT_PY, startServer, stopServer
+
+############################## FUNCTIONS ##############################
+
+# run one command in an interactive client.py
+# Arguments:
+#  - port: port to connect to, integer
+#  - command: command to run, string
+#  - directory: working directory of the client, string
+# Return:
+#  - (seconds, output): time the client took, and what it printed
+def runClient(port, command, directory):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, CLIENT_PY, '127.0.0.1', str(port)], cwd=directory,
+                         input=command + '\nbye\n', capture_output=True, text=True, check=True).stdout
+    return time.perf_counter() - start, out
+
+############################## MAIN CODE ##############################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Time 'sync' runs against a 'put -r' of the whole tree")
+    parser.add_argument('--count', type=int, default=5000, help='Number of files in the tree (default 5000)')
+    parser.add_argument('--size', type=int, default=4096, help='Size of each file in bytes (default 4096)')
+    parser.add_argument('--changes', type=int, default=10, help='Files edited, and files renamed, before the last sync (default 10)')
+    sysArgs = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as serverDir, tempfile.TemporaryDirectory() as clientDir:
+
+        # the tree, spread over sub-directories, names short enough for a PUT
+        for i in range(sysArgs.count):
+            path = os.path.join(clientDir, 'tr', f'd{i % 100}', f'f{i}')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(sysArgs.size))
+
+        proc, port = startServer(serverDir, '-e', 'asyncio')
+        try:
+            results = [('put -r, whole tree', runClient(port, 'put -r tr', clientDir))]
+            results.append(('sync, first run', runClient(port, 'sync tr', clientDir)))
+            results.append(('sync, no change', runClient(port, 'sync tr', clientDir)))
+
+            # a few files edited, a few others renamed
+            picked = random.sample(range(sysArgs.count), 2 * sysArgs.changes)
+            for i in picked[:sysArgs.changes]:
+                with open(os.path.join(clientDir, 'tr', f'd{i % 100}', f'f{i}'), 'ab') as f:
+                    f.write(b'edited')
+            for i in picked[sysArgs.changes:]:
+                os.rename(os.path.join(clientDir, 'tr', f'd{i % 100}', f'f{i}'), os.path.join(clientDir, 'tr', f'd{i % 100}', f'r{i}'))
+            results.append((f'sync, {sysArgs.changes} edited + {sysArgs.changes} renamed', runClient(port, 'sync tr', clientDir)))
+        finally:
+            stopServer(proc)
+
+    print(f'{sysArgs.count} files of {sysArgs.size} bytes')
+    for what, (seconds, out) in results:
+        uploaded = re.findall(r'(\d+) files uploaded', out)
+        renamed = len(re.findall(r' has been renamed to ', out))
+        print(f'  {what:32} {seconds:8.3f} s  {uploaded[-1] if uploaded else 0:>6} uploaded  {renamed:>4} renamed')
@@ -0,0 +1,65 @@
+################################################################################
+#   Filename:       benchutil.py
+#
+#   Description:    Helpers shared by the benchmark scripts in this directory.
+#                   - Locates server.py and client.py in the repository
+#                   - Starts server.py on a free localhost port in a given
+#                     directory and stops it again
+#
+################################################################################
+from socket import socket, create_connection, AF_INET, SOCK_STREAM
+import os, sys, subprocess, time
+
+############################## CONSTANTS ##############################
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SERVER_PY = os.path.join(ROOT, 'server', 'server.py')
+CLIENT_PY = os.path.join(ROOT, 'client', 'client.py')
+
+############################## FUNCTIONS ##############################
+
+# find a free TCP port on localhost
+# Return:
+#  - port number, integer
+def freePort():
+    with socket(AF_INET, SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# start server.py in a directory and wait until it accepts connections
+# Arguments:
+#  - directory: working directory of the server, where its files are stored, string
+#  - args: extra input arguments for server.py, strings
+#  - port: port number to listen on, a free one when None
+# Return:
+#  - (process, port): the server process, subprocess.Popen class, and its port
+def startServer(directory, *args, port=None):
+
+    port = port or freePort()
+    proc = subprocess.Popen([sys.executable, SERVER_PY, str(port), *args], cwd=directory,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # wait until the server listens, or give up after 10 seconds
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            # connect and say BYE right away, the blocking engine serves the next client after that
+            with create_connection(('127.0.0.1', port), timeout=1) as s:
+                s.sendall((0b100 << 5).to_bytes(1, 'big'))
+            return proc, port
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError('server.py did not start')
+            time.sleep(0.05)
+
+# stop a server started with startServer()
+# Arguments:
+#  - proc: server process, subprocess.Popen class
+def stopServer(proc):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
@@ -0,0 +1,102 @@
+################################################################################
+#   Filename:       cluster_demo.py
+#
+#   Description:    Cluster mode of server.py on localhost.
+#                   - Starts several server.py nodes ('--cluster', asyncio
+#                     engine), each in its own directory
+#                   - Uploads files with 'client.py --cluster' and checks each
+#                     one is stored on exactly the nodes owning its name
+#                   - Stops one node, downloads every file again through the
+#                     other replicas, and renames files across nodes
+#
+#                   > py cluster_demo.py
+#                   > py cluster_demo.py --nodes 5 --replicas 3 --files 50
+#
+################################################################################
+import os, sys, argparse, shutil, subprocess, tempfile
+
+from benchutil import ROOT, CLIENT_PY, freePort, startServer, stopServer
+
+sys.path.insert(0, os.path.join(ROOT, 'client'))
+from client import HashRing
+
+############################## FUNCTIONS ##############################
+
+# run commands in an interactive client.py with cluster routing
+# Arguments:
+#  - port: port of the node to connect to first, integer
+#  - commands: commands to run, list of strings
+#  - directory: working directory of the client, string
+# Return:
+#  - output of the client, string
+def runClient(port, commands, directory):
+    return subprocess.run([sys.executable, CLIENT_PY, '127.0.0.1', str(port), '--cluster'], cwd=directory,
+                          input='\n'.join(commands + ['bye']) + '\n', capture_output=True, text=True, check=True).stdout
+
+# nodes whose directory holds a file
+# Arguments:
+#  - dirs: {node: server directory}
+#  - name: filename, string
+# Return:
+#  - set of nodes
+def holders(dirs, name):
+    return {node for node, directory in dirs.items() if os.path.isfile(os.path.join(directory, name))}
+
+############################## MAIN CODE ##############################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Start a cluster of server.py nodes on localhost and check placement, failover and renames')
+    parser.add_argument('--nodes', type=int, default=3, help='Number of nodes (default 3)')
+    parser.add_argument('--replicas', type=int, default=2, help='Nodes storing each file (default 2)')
+    parser.add_argument('--files', type=int, default=20, help='Number of files uploaded (default 20)')
+    sysArgs = parser.parse_args()
+
+    ports = [freePort() for _ in range(sysArgs.nodes)]
+    nodes = [f'127.0.0.1:{port}' for port in ports]
+    ring = HashRing(nodes, 64)
+    names = [f'file{i}.txt' for i in range(sysArgs.files)]
+    ok = True
+
+    with tempfile.TemporaryDirectory() as clientDir:
+        dirs = {node: tempfile.mkdtemp() for node in nodes}
+        procs = {}
+        try:
+            for node, port in zip(nodes, ports):
+                procs[node], _ = startServer(dirs[node], '-e', 'asyncio', '--cluster', ','.join(nodes),
+                                             '--replicas', str(sysArgs.replicas), port=port)
+            for name in names:
+                with open(os.path.join(clientDir, name), 'w') as f:
+                    f.write(f'content of {name}\n')
+
+            # uploads go straight to the owners, which replicate to each other
+            runClient(ports[0], [f'put {name}' for name in names], clientDir)
+            misplaced = [name for name in names if holders(dirs, name) != set(ring.owners(name, sysArgs.replicas))]
+            counts = {node: sum(node in holders(dirs, name) for name in names) for node in nodes}
+            print(f'{len(names)} files put, {len(names) - len(misplaced)} stored on exactly their {sysArgs.replicas} owners')
+            print('  files per node: ' + ', '.join(f'{node} {count}' for node, count in counts.items()))
+            ok &= not misplaced
+
+            # one node down, its files are read from the other replicas
+            down = nodes[0]
+            stopServer(procs.pop(down))
+            for name in names: os.remove(os.path.join(clientDir, name))
+            runClient(ports[1], [f'get {name}' for name in names], clientDir)
+            got = [name for name in names if os.path.isfile(os.path.join(clientDir, name))]
+            print(f'node {down} stopped: {len(got)} of {len(names)} files downloaded from the other replicas')
+            ok &= len(got) == len(names) or sysArgs.replicas == 1
+
+            # renames move files to the owners of the new name, the old name is gone from the nodes still up
+            renames = [(name, 'renamed/' + name) for name in names[:5]]
+            runClient(ports[1], [f'change {old} {new}' for old, new in renames], clientDir)
+            live = {node: dirs[node] for node in nodes if node != down}
+            moved = sum(holders(live, new) == set(ring.owners(new, sysArgs.replicas)) - {down} and not holders(live, old)
+                        for old, new in renames)
+            print(f'{moved} of {len(renames)} files renamed across nodes, stored on the owners of their new name')
+            ok &= moved == len(renames)
+        finally:
+            for proc in procs.values(): stopServer(proc)
+            for directory in dirs.values(): shutil.rmtree(directory)
+
+    print('cluster demo ' + ('passed' if ok else 'FAILED'))
+    sys.exit(0 if ok else 1)
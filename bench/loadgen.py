@@ -0,0 +1,346 @@
+################################################################################
+#   Filename:       loadgen.py
+#
+#   Description:    Load generator for server.py. Starts the server locally in
+#                   a temporary directory, then for each concurrency level
+#                   runs that many client connections doing a weighted mix of
+#                   PUT/GET/CHANGE/HELP requests with file sizes drawn from a
+#                   distribution.
+#                   - Reports throughput, p50/p95/p99 latency per request type
+#                     and the server's resident memory (RSS, Linux only)
+#                   - Saves the results as JSON, '--compare' prints the change
+#                     against a JSON saved earlier, ex: on another commit
+#
+#                   > py loadgen.py
+#                   > py loadgen.py --mix get=80,put=20 --concurrency 1,16,64 --sizes 1024:90,1048576:10
+#                   > py loadgen.py --server-args="-w 4" --output new.json --compare old.json
+#
+################################################################################
+from socket import create_connection, IPPROTO_TCP, TCP_NODELAY
+import os, argparse, json, platform, random, shlex, subprocess, tempfile, threading, time
+
+from benchutil import ROOT, startServer, stopServer
+
+############################## FUNCTIONS ##############################
+
+# parse a request mix, ex: 'get=60,put=30,change=5,help=5'
+# Arguments:
+#  - text: comma separated op=weight pairs, string
+# Return:
+#  - (ops, weights): request types and their weights, lists
+def parseMix(text):
+    ops, weights = [], []
+    for part in text.split(','):
+        op, _, weight = part.partition('=')
+        if op not in ('put', 'get', 'change', 'help'):
+            raise argparse.ArgumentTypeError('unknown request type: ' + op)
+        ops.append(op)
+        weights.append(float(weight or 1))
+    return ops, weights
+
+# parse a file size distribution
+#  - 'SIZE' for a fixed size, ex: '4096'
+#  - 'MIN-MAX' for sizes uniform between MIN and MAX, ex: '1024-65536'
+#  - 'SIZE:WEIGHT,...' for weighted sizes, ex: '1024:90,1048576:10'
+# Arguments:
+#  - text: distribution, string
+# Return:
+#  - function drawing a size from a random.Random, in bytes
+def parseSizes(text):
+    if ':' in text:
+        sizes, weights = [], []
+        for part in text.split(','):
+            size, _, weight = part.partition(':')
+            sizes.append(int(size))
+            weights.append(float(weight))
+        return lambda rng: rng.choices(sizes, weights)[0]
+    if '-' in text:
+        low, high = map(int, text.split('-'))
+        return lambda rng: rng.randint(low, high)
+    size = int(text)
+    return lambda rng: size
+
+# value at percentile p of sorted values
+# Arguments:
+#  - values: sorted list of numbers
+#  - p: percentile, 0 to 100
+# Return:
+#  - value, nearest rank
+def percentile(values, p):
+    if not values: return 0.0
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+# resident memory of a process and all its children (prefork workers), Linux only
+# Arguments:
+#  - pid: process ID, integer
+# Return:
+#  - RSS in bytes, or None if /proc is not available
+def processRss(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, StopIteration):
+        return None
+    return rss + sum(processRss(child) or 0 for child in children)
+
+# connection of one load generator worker, speaking the v1 protocol of client.py
+class Connection:
+
+    # Arguments:
+    #  - port: port of the server, integer
+    def __init__(self, port):
+        self.sock = create_connection(('127.0.0.1', port), timeout=60)
+        self.sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+    # receive exactly n bytes, data is dropped when keep is False
+    def recv(self, n, keep=True):
+        chunks = []
+        while n > 0:
+            chunk = self.sock.recv(min(n, 1024 * 1024))
+            if not chunk: raise ConnectionError('connection closed by server')
+            if keep: chunks.append(chunk)
+            n -= len(chunk)
+        return b''.join(chunks)
+
+    # PUT data as name, returns True on success
+    def put(self, name, data):
+        self.sock.sendall(len(name).to_bytes(1, 'big') + name.encode() + len(data).to_bytes(4, 'big'))
+        self.sock.sendall(data)
+        return self.recv(1)[0] >> 5 == 0b000
+
+    # GET name and drop its data, returns the number of bytes received, None if not found
+    def get(self, name):
+        self.sock.sendall(((0b001 << 5) + len(name)).to_bytes(1, 'big') + name.encode())
+        byte1 = self.recv(1)[0]
+        if byte1 >> 5 != 0b001: return None
+        self.recv(byte1 & 0x1F)
+        size = int.from_bytes(self.recv(4), 'big')
+        self.recv(size, keep=False)
+        return size
+
+    # CHANGE oldName to newName, returns True on success
+    def change(self, oldName, newName):
+        self.sock.sendall(((0b010 << 5) + len(oldName)).to_bytes(1, 'big') + oldName.encode()
+                          + len(newName).to_bytes(1, 'big') + newName.encode())
+        return self.recv(1)[0] >> 5 == 0b000
+
+    # HELP, returns True when the help text was received
+    def help(self):
+        self.sock.sendall((0b011 << 5).to_bytes(1, 'big'))
+        byte1 = self.recv(1)[0]
+        self.recv(byte1 & 0x1F)
+        return byte1 >> 5 == 0b110
+
+    # BYE then close
+    def close(self):
+        try:
+            self.sock.sendall((0b100 << 5).to_bytes(1, 'big'))
+        except OSError:
+            pass
+        self.sock.close()
+
+# run one concurrency level
+# Arguments:
+#  - port: port of the server, integer
+#  - serverPid: pid of the server, for RSS, integer
+#  - concurrency: number of connections, integer
+#  - duration: seconds to run, float
+#  - mix: (ops, weights) from parseMix()
+#  - drawSize: size function from parseSizes()
+#  - seedNames: files stored before the run, GET targets, list of strings
+#  - payload: random bytes PUT data is sliced from, bytes
+# Return:
+#  - result, dict ready for JSON
+def runLevel(port, serverPid, concurrency, duration, mix, drawSize, seedNames, payload):
+
+    latencies = {op: [] for op in mix[0]}
+    counts = {'ops': 0, 'errors': 0, 'bytes': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+    rssSamples = []
+
+    # sample the server's memory while the level runs
+    def sampleRss():
+        while not stop.wait(0.1):
+            rss = processRss(serverPid)
+            if rss is not None: rssSamples.append(rss)
+
+    def worker(index):
+        rng = random.Random(index)
+        local = {op: [] for op in mix[0]}
+        ops = errors = nBytes = 0
+        # each worker renames its own file back and forth, and PUTs over its own names
+        names = [f'w{index}a', f'w{index}b']
+        try:
+            conn = Connection(port)
+            conn.put(names[0], payload[:1024])
+        except OSError:
+            with lock: counts['errors'] += 1
+            return
+        try:
+            while not stop.is_set():
+                op = rng.choices(*mix)[0]
+                start = time.perf_counter()
+                try:
+                    match op:
+                        case 'put':
+                            size = drawSize(rng)
+                            offset = rng.randrange(0, len(payload) - size + 1)
+                            ok = conn.put(f'p{index}_{rng.randrange(8)}', payload[offset:offset + size])
+                            nBytes += size
+                        case 'get':
+                            size = conn.get(rng.choice(seedNames))
+                            ok = size is not None
+                            nBytes += size or 0
+                        case 'change':
+                            ok = conn.change(names[0], names[1])
+                            names.reverse()
+                        case 'help':
+                            ok = conn.help()
+                except OSError:
+                    errors += 1
+                    break
+                local[op].append(time.perf_counter() - start)
+                ops += 1
+                if not ok: errors += 1
+        finally:
+            conn.close()
+            with lock:
+                for op, values in local.items(): latencies[op].extend(values)
+                counts['ops'] += ops
+                counts['errors'] += errors
+                counts['bytes'] += nBytes
+
+    sampler = threading.Thread(target=sampleRss, daemon=True)
+    sampler.start()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads: t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - start
+    sampler.join()
+
+    result = {
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'ops': counts['ops'],
+        'errors': counts['errors'],
+        'opsPerSec': round(counts['ops'] / elapsed, 1),
+        'mbPerSec': round(counts['bytes'] / elapsed / 1024 / 1024, 2),
+        'latencyMs': {},
+        'rssMb': {'peak': round(max(rssSamples) / 1024 / 1024, 1), 'end': round(rssSamples[-1] / 1024 / 1024, 1)} if rssSamples else None,
+    }
+    for op, values in latencies.items():
+        values.sort()
+        if not values: continue
+        result['latencyMs'][op] = {
+            'count': len(values),
+            'p50': round(percentile(values, 50) * 1000, 3),
+            'p95': round(percentile(values, 95) * 1000, 3),
+            'p99': round(percentile(values, 99) * 1000, 3),
+            'mean': round(sum(values) / len(values) * 1000, 3),
+        }
+    return result
+
+# print one level's result as a few lines
+# Arguments:
+#  - result: result of runLevel(), dict
+def printResult(result):
+    rss = f'{result["rssMb"]["peak"]} MB peak RSS' if result['rssMb'] else 'RSS n/a'
+    print(f'concurrency {result["concurrency"]:4d}: {result["opsPerSec"]:10.1f} req/s {result["mbPerSec"]:9.2f} MB/s '
+          f'{result["errors"]} errors, {rss}')
+    for op, stats in result['latencyMs'].items():
+        print(f'    {op:7s} {stats["count"]:8d} reqs   p50 {stats["p50"]:9.3f} ms   p95 {stats["p95"]:9.3f} ms   p99 {stats["p99"]:9.3f} ms')
+
+# print the change of throughput and p99 latency against results saved earlier, for the levels in both
+# Arguments:
+#  - results: results of this run, list of dicts
+#  - baseline: JSON document saved by an earlier run, dict
+def printComparison(results, baseline):
+    old = {r['concurrency']: r for r in baseline['results']}
+    print(f'compared to {baseline["meta"].get("commit") or "baseline"}:')
+    for result in results:
+        before = old.get(result['concurrency'])
+        if before is None: continue
+        change = (result['opsPerSec'] / before['opsPerSec'] - 1) * 100 if before['opsPerSec'] else 0
+        line = f'  concurrency {result["concurrency"]:4d}: throughput {change:+6.1f}%'
+        for op, stats in result['latencyMs'].items():
+            if op in before['latencyMs'] and before['latencyMs'][op]['p99']:
+                line += f'   {op} p99 {(stats["p99"] / before["latencyMs"][op]["p99"] - 1) * 100:+6.1f}%'
+        print(line)
+
+############################## MAIN CODE ##############################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Load generator for server.py')
+    parser.add_argument('--mix', type=parseMix, default='get=60,put=30,change=5,help=5', help='Weighted request types (default get=60,put=30,change=5,help=5)')
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma separated numbers of connections, one run each (default 1,8,32)')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds per concurrency level (default 5)')
+    parser.add_argument('--sizes', default='1024:70,65536:25,1048576:5', help="File sizes: 'SIZE', 'MIN-MAX' or 'SIZE:WEIGHT,...' (default 1024:70,65536:25,1048576:5)")
+    parser.add_argument('--files', type=int, default=100, help='Number of files stored before the run for GETs (default 100)')
+    parser.add_argument('--server-args', default='-e asyncio', help="Input arguments for server.py (default '-e asyncio', the blocking engine serves one connection at a time)")
+    parser.add_argument('--output', help='Save the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON file saved by an earlier run, prints the change against it')
+    sysArgs = parser.parse_args()
+
+    levels = [int(c) for c in sysArgs.concurrency.split(',')]
+    drawSize = parseSizes(sysArgs.sizes)
+    rng = random.Random(366)
+    maxSize = max(drawSize(rng) for _ in range(1000))
+    # PUT data is sliced from one random buffer, at least as big as the largest size drawn
+    payload = os.urandom(max(maxSize, 1024) * 2)
+
+    results = []
+    with tempfile.TemporaryDirectory() as serverDir:
+
+        # files fetched by GETs are created directly in the server's directory
+        seedNames = []
+        for i in range(sysArgs.files):
+            seedNames.append(f'seed{i}')
+            with open(os.path.join(serverDir, seedNames[-1]), 'wb') as f:
+                f.write(payload[:drawSize(rng)])
+
+        proc, port = startServer(serverDir, *shlex.split(sysArgs.server_args))
+        try:
+            mix = ','.join(f'{op}={weight:g}' for op, weight in zip(*sysArgs.mix))
+            print(f'server.py {sysArgs.server_args}, mix {mix}, sizes {sysArgs.sizes}, {sysArgs.duration} s per level')
+            for concurrency in levels:
+                results.append(runLevel(port, proc.pid, concurrency, sysArgs.duration, sysArgs.mix, drawSize, seedNames, payload))
+                printResult(results[-1])
+        finally:
+            stopServer(proc)
+
+    # commit the results were measured on, to compare runs between commits
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    document = {
+        'meta': {
+            'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'serverArgs': sysArgs.server_args,
+            'mix': dict(zip(*sysArgs.mix)),
+            'sizes': sysArgs.sizes,
+            'files': sysArgs.files,
+            'duration': sysArgs.duration,
+        },
+        'results': results,
+    }
+
+    if sysArgs.output:
+        with open(sysArgs.output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print('results saved to ' + sysArgs.output)
+
+    if sysArgs.compare:
+        with open(sysArgs.compare) as f:
+            printComparison(results, json.load(f))
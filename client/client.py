@@ -15,11 +15,221 @@
 #                     printing of messages sent/received
 #
 ################################################################################
-from socket import socket, AF_INET, SOCK_STREAM
-import argparse
+from socket import socket, create_connection, AF_INET, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY
+from collections import OrderedDict
+from bisect import bisect_right
+import os, sys, argparse, queue, threading, time, hashlib, mmap, zlib, asyncio, inspect, errno, json
+
+# TCP_NOTSENT_LOWAT is not available on every system, v2 connections then keep the default send buffer
+try:
+    from socket import TCP_NOTSENT_LOWAT
+except ImportError:
+    TCP_NOTSENT_LOWAT = None
+
+# lzma is an optional part of the standard library, without it only zlib compression is offered
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# crc32c and xxhash are optional packages, without them put/get digests are crc32 or sha256
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+############################## GLOBALS ##############################
+
+# defaults used when this script is imported as a module, overwritten by input arguments in MAIN CODE
+DEBUG = 0
+WINDOW = 32     # batch mode: max requests sent ahead of their responses
+JOBS = 4        # put -r / get -r: number of parallel connections
+CHUNK_SIZE = 64 * 1024      # size of reusable receive buffer for streaming file data, in bytes
+MIN_SEGMENT = 1024 * 1024   # put -n / get -n: smallest range sent over its own connection, in bytes
+DEDUPE = False  # ask the server if it has a file's content before uploading it
+TIMEOUT = 30    # seconds a parallel connection waits for the server
+PROBE_TIMEOUT = 2   # seconds a first parallel connection waits for an answer, a server serving one client at a time never answers
+COMPRESS = 0    # put/get: codec id to compress transfers with, 0 for plain PUT/GET
+DIGEST = 0      # put/get: digest id checking the data of transfers, 0 for none
+LIST_PAGE = 1000    # ls: files listed per LIST PAGE request
+MAP_WINDOW = 16 * 1024 * 1024   # get: bytes of the file being downloaded mapped in memory at a time
+BUNDLE_FILES = 256  # put -r / get -r: max small files sent in one BPUT/BGET request, 0 sends each file with its own request
+BUNDLE_MAX_FILE = 64 * 1024     # put -r / get -r: files up to this size are bundled, larger ones get a request each
+BUNDLE_BYTES = 1024 * 1024      # put -r / get -r: max bytes of file data in one bundle
+BUNDLE_CAP = 7      # bit of the CAPS mask set by servers supporting BPUT/BGET
+SYNC_INDEX = '.sfts.sync'   # sync: file in the synced directory recording what was uploaded
+SYNC_INTERVAL = 2   # sync -w: seconds between two scans of the directory
+DIGEST_CAP = 3      # bit of the CAPS mask of digest 1, digest n is bit DIGEST_CAP + n - 1
+CLUSTER = None  # ClusterRouter when run with '--cluster', put/get/change/stat then go to the nodes owning the name
+MUX = None      # v2 connection when the protocol was negotiated with '--mux', parallel transfers then run on its streams
+FRAME_SIZE = 16 * 1024  # v2: max payload of a frame, transfers on different streams interleave every FRAME_SIZE bytes
+STREAM_BUFFER = 1024 * 1024     # v2: max bytes received ahead on a stream, reading stops until it is read
+COMPRESS_THRESHOLD = 0.9    # a put is compressed only if its first chunk shrinks to this share of its size
+
+# compression codecs of PUTX/GETX chunk streams, by the id sent in the codec byte
+CODECS = {0: 'none', 1: 'zlib'}
+if lzma is not None: CODECS[2] = 'lzma'
+
+# integrity digests of PUTX/GETX chunk streams, by the id sent in the top 4 bits of the codec byte
+DIGESTS = {0: 'none', 1: 'crc32', 2: 'sha256'}
+if crc32c is not None: DIGESTS[3] = 'crc32c'
+if xxhash is not None: DIGESTS[4] = 'xxh64'
 
 ############################## FUNCTIONS ##############################
 
+# receive exactly size bytes from a socket into a file at offset, with positional writes
+# the same buffer is reused for every chunk, several connections can fill different ranges of one file
+# Arguments:
+#  - sock: socket to receive data from, socket class
+#  - fd: file descriptor opened for writing, integer, None to discard the data
+#  - offset: position in the file of the first byte, integer
+#  - size: number of bytes to receive, integer
+# Raises:
+#  - ConnectionError if the server closes the connection before size bytes are received
+#  - OSError if writing to the file failed, raised only after all size bytes were received
+def recvToFd(sock, fd, offset, size):
+
+    buf = bytearray(min(CHUNK_SIZE, size) or 1)
+    view = memoryview(buf)
+    # first error raised while writing, the rest of the data is still drained so the connection stays in sync
+    writeErr = None
+    while size > 0:
+        n = sock.recv_into(view, min(len(buf), size))
+        if n == 0:
+            raise ConnectionError('connection closed by server')
+        # write the chunk at its place, os.pwrite doesn't move a shared file position
+        written = 0
+        while fd is not None and writeErr is None and written < n:
+            try:
+                if hasattr(os, 'pwrite'):
+                    written += os.pwrite(fd, view[written:n], offset + written)
+                else:
+                    with _seekLock:
+                        os.lseek(fd, offset + written, os.SEEK_SET)
+                        written += os.write(fd, view[written:n])
+            except OSError as e:
+                writeErr = e
+        offset += n
+        size -= n
+
+    if writeErr is not None:
+        raise writeErr
+
+# lock around seek and write on systems without os.pwrite
+_seekLock = threading.Lock()
+
+# receive exactly size bytes from a socket into the file fName, through 'fName.part' renamed once complete,
+# the file replaced is left as it was if the download fails
+# the space of the file is reserved up front with fallocate, then the data is received straight into
+# the file mapped in memory, MAP_WINDOW bytes at a time, so memory used stays the same whatever the
+# size of the file. Without fallocate, it goes through a reused buffer and positional writes
+# Arguments:
+#  - sock: socket to receive data from, socket class
+#  - fName: file to store the data in, string
+#  - size: number of bytes to receive, integer
+# Return:
+#  - '' if the file was stored, else an error message, the data is still received to keep the connection in sync
+# Raises:
+#  - ConnectionError if the server closes the connection before size bytes are received, the part file
+#    then holds the bytes received
+def recvToFile(sock, fName, size):
+
+    partName = fName + '.part'
+    err = 'Error: Could not save download file "' + fName + '"'
+    try:
+        if os.path.dirname(fName): os.makedirs(os.path.dirname(fName), exist_ok=True)
+        fd = os.open(partName, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+    except OSError:
+        recvToFd(sock, None, 0, size)
+        return err
+
+    received = 0
+    # True once space was reserved, the file is then cut back to what was received unless the download completes
+    reserved = False
+    complete = False
+    try:
+        # reserve the space, a mapped file running out of disk space would crash the client instead of failing a write
+        mapped = False
+        if size > 0 and hasattr(os, 'posix_fallocate'):
+            reserved = True
+            try:
+                os.posix_fallocate(fd, 0, size)
+                mapped = True
+            except OSError as e:
+                # no space left: drain the data, any other error: the filesystem can't reserve space
+                if e.errno == errno.ENOSPC:
+                    recvToFd(sock, None, 0, size)
+                    return err
+
+        if mapped:
+            while received < size:
+                with mmap.mmap(fd, min(MAP_WINDOW, size - received), offset=received) as mm, memoryview(mm) as view:
+                    filled = 0
+                    while filled < len(view):
+                        n = sock.recv_into(view[filled:])
+                        if n == 0:
+                            raise ConnectionError('connection closed by server')
+                        filled += n
+                        received += n
+        else:
+            try:
+                recvToFd(sock, fd, 0, size)
+            except (ConnectionError, TimeoutError):
+                raise
+            except OSError:
+                return err
+            received = size
+
+        # the file must hold exactly the bytes the server announced
+        if received != size:
+            return err
+        complete = True
+    except OSError as e:
+        # connection lost, the part file keeps what was received
+        if isinstance(e, (ConnectionError, TimeoutError)): raise
+        # the file could not be mapped, the rest of the data is drained
+        recvToFd(sock, None, 0, size - received)
+        return err
+    finally:
+        # on every other outcome, Ctrl+C included, the reserved space after the data received is dropped,
+        # the part file only holds what was received
+        try:
+            if reserved and not complete: os.ftruncate(fd, received)
+        finally:
+            os.close(fd)
+
+    try:
+        os.replace(partName, fName)
+    except OSError:
+        return err
+    return ''
+
+# receive exactly n bytes from a socket, looping over short reads
+# Arguments:
+#  - sock: socket to receive data from, socket class
+#  - n: number of bytes to receive, integer
+# Return:
+#  - bytes received, always of length n
+# Raises:
+#  - ConnectionError if the server closes the connection before n bytes are received
+def recvExact(sock, n):
+
+    # collect chunks in a list, joined once at the end
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(n)
+        # empty chunk means the server closed the connection
+        if not chunk:
+            raise ConnectionError('connection closed by server')
+        chunks.append(chunk)
+        n -= len(chunk)
+
+    return b''.join(chunks)
+
 # check for errors in input arguments for put/get/change commands
 # Arguments:
 #  - args: list of arguments (strings), command name is index=0
@@ -32,12 +242,48 @@ def inputErrors(args):
     # leaving 1 char for end-of-string character: '\0'
     # * NOTE: python does not actually use the NULL byte to terminate strings *
 
-    if args[0] == 'bye' or args[0] == 'help':
+    if args[0] == 'bye' or args[0] == 'help' or args[0] == 'stats':
         # check for bad number of arguments to command (doesn't take any)
         if len(args) != 1:
             print("ERROR: Command takes no arguments, ex: '" + args[0] + "'")
             return True
  
+    elif (args[0] == 'put' or args[0] == 'get') and len(args) > 1 and args[1] == '-r':
+        # check for bad number of arguments to recursive command
+        if len(args) != 3:
+            print("ERROR: Command takes 1 directory, ex: '" + args[0] + " -r exampleDir'")
+            return True
+
+    elif (args[0] == 'put' or args[0] == 'get') and len(args) > 1 and args[1] == '-c':
+        # check for bad number of arguments to resume command
+        if len(args) != 3:
+            print("ERROR: Command takes 1 argument, ex: '" + args[0] + " -c example.mp4'")
+            return True
+        # check for filename too long error
+        if len(args[2]) > 30:
+            print('ERROR: Command filename must not exceed 30 characters.')
+            return True
+
+    elif args[0] == 'put' and len(args) > 1 and args[1] == '-d':
+        # check for bad number of arguments to delta command
+        if len(args) != 3:
+            print("ERROR: Command takes 1 argument, ex: 'put -d example.mp4'")
+            return True
+        # check for filename too long error
+        if len(args[2]) > 30:
+            print('ERROR: Command filename must not exceed 30 characters.')
+            return True
+
+    elif (args[0] == 'put' or args[0] == 'get') and len(args) > 1 and args[1] == '-n':
+        # check for bad number of arguments to multi-stream command
+        if len(args) != 4 or not args[2].isdigit() or int(args[2]) < 1:
+            print("ERROR: Command takes a number of streams and 1 argument, ex: '" + args[0] + " -n 4 example.mp4'")
+            return True
+        # check for filename too long error
+        if len(args[3]) > 30:
+            print('ERROR: Command filename must not exceed 30 characters.')
+            return True
+
     elif args[0] == 'put' or args[0] == 'get':
         # check for bad number of arguments to command
         if len(args) != 2:
@@ -48,6 +294,28 @@ def inputErrors(args):
             print('ERROR: Command filename must not exceed 30 characters.')
             return True
 
+    elif args[0] == 'sync':
+        # check for bad number of arguments to command, '-w' keeps watching the directory
+        if len(args) != 2 and (len(args) != 3 or args[1] != '-w'):
+            print("ERROR: Command takes 1 directory, ex: 'sync exampleDir' or 'sync -w exampleDir'")
+            return True
+
+    elif args[0] == 'ls':
+        # check for bad number of arguments to command, the prefix is optional
+        if len(args) > 2:
+            print("ERROR: Command takes at most 1 argument, ex: 'ls' or 'ls testDir/'")
+            return True
+
+    elif args[0] == 'stat':
+        # check for bad number of arguments to command
+        if len(args) != 2:
+            print("ERROR: Command takes 1 argument, ex: 'stat example.txt'")
+            return True
+        # check for filename too long error
+        if len(args[1]) > 30:
+            print('ERROR: Command filename must not exceed 30 characters.')
+            return True
+
     elif args[0] == 'change':
         # check for bad number of arguments to command
         if len(args) != 3:
@@ -110,6 +378,48 @@ def putRequest(fName):
     # build full request to send and return it
     return ((opCode << 5) + fNameLen).to_bytes(1, 'big') + fName.encode() + fSize.to_bytes(4, 'big') + fData
 
+# client calls sendPut() to send a PUT request with its data straight from the file, with sendfile,
+# so files of any size are uploaded without being read into memory, the response is not read
+# Arguments:
+#  - fName: filename for PUT request, string
+#  - sock: connected socket, socket class
+# Return:
+#  - True if the request was sent, False if the file could not be read, nothing was sent then
+# Raises:
+#  - OSError if the connection failed, or the file got shorter while it was sent, the connection is then
+#    out of sync and must be closed
+def sendPut(fName, sock):
+
+    # store opCode for PUT
+    opCode = 0b000
+    # get filename length
+    fNameLen = len(fName)
+
+    try:
+        f = open(fName, 'rb')
+    except OSError:
+        print('ERROR: Could not read file "' + fName + '"')
+        return False
+
+    with f:
+        fSize = os.fstat(f.fileno()).st_size
+        if fSize > 0xFFFFFFFF:
+            print(f'ERROR: File too big, size = 0x{fSize:x}')
+            return False
+
+        # print request data when debug enabled, the data is not printed
+        if DEBUG == 1:
+            print('***** PUT REQUEST *****')
+            print(f'  opCode:  0b{opCode:03b}-----')
+            print(f'  FL:      0b---{fNameLen:05b}')
+            print( '  fName:   ' + fName)
+            print(f'  FS:      0x{fSize:08X}')
+
+        sock.sendall(((opCode << 5) + fNameLen).to_bytes(1, 'big') + fName.encode() + fSize.to_bytes(4, 'big'))
+        if fSize and sock.sendfile(f, 0, fSize) != fSize:
+            raise OSError('"' + fName + '" got shorter while it was sent')
+    return True
+
 # client calls getRequest() to create a GET request to get file from server, does not send yet
 # Arguments:
 #  - fName: filename for GET request, string
@@ -163,30 +473,21 @@ def changeRequest(oldName, newName):
 # Arguments:
 #  - byte1: first byte received from server, integer value
 #  - clientSocket: client socket to receive data, socket class
-def getResponse(byte1, clientSocket):
+#  - quiet: don't print the success msg, the caller reports progress itself
+# Return:
+#  - True if the file was stored, False if it could not be saved
+def getResponse(byte1, clientSocket, quiet=False):
 
     # store response code
     resCode = byte1 >> 5
     # store Filename Length
     fNameLen = byte1 & 0x1F
     # use Filename Length to read the next bytes from client for Filename, decode to string
-    fName = clientSocket.recv(fNameLen).decode()
+    fName = recvExact(clientSocket, fNameLen).decode()
     # read next 4 bytes from client for File Size, convert the 4 bytes into 1 integer, using big-endian notation
-    fSize = int.from_bytes(clientSocket.recv(4), 'big')
-    # use File Size to receive the whole file from client in bytes
-    fData = clientSocket.recv(fSize)
-
-    # now try to store the file, overwrites any existing file with same name
-    try:
-        # open in WRITE and BINARY mode for any type of file
-        with open(fName, 'wb') as f:
-            # write downloaded data to file
-            f.write(fData)
-        # no error msg when successful
-        err = ''
-    except:
-        # error msg for write failure
-        err = 'Error: Could not save download file "' + fName + '"'
+    fSize = int.from_bytes(recvExact(clientSocket, 4), 'big')
+    # use File Size to receive the file straight into its place on disk, overwrites any existing file with same name
+    err = recvToFile(clientSocket, fName, fSize)
 
     # print response data when debug enabled
     if DEBUG == 1:
@@ -194,17 +495,16 @@ def getResponse(byte1, clientSocket):
         print(f'  resCode: 0b{resCode:03b}-----')
         print(f'  FL:      0b---{fNameLen:05b}')
         print( '  fName:   ' + fName)
-        print( '  Data:    ', end='')
-        print(fData)
+        print(f'  FS:      0x{fSize:08X}')
 
     # print err if not empty, and return
     if err != '':
         print(err)
-        return
+        return False
 
     # print filename and success msg
-    print(fName + ' has been downloaded successfully.')
-    return
+    if not quiet: print(fName + ' has been downloaded successfully.')
+    return True
 
 # client calls helpResponse() to handle a HELP response from server, prints commands from server
 # Arguments:
@@ -217,7 +517,7 @@ def helpResponse(byte1, clientSocket):
     # store help data Length
     helpLen = byte1 & 0x1F
     # use help data Length to read the next bytes from client for help data, decode to string
-    helpData = clientSocket.recv(helpLen).decode()
+    helpData = recvExact(clientSocket, helpLen).decode()
 
     # print response data when debug enabled
     if DEBUG == 1:
@@ -226,109 +526,2816 @@ def helpResponse(byte1, clientSocket):
         print(f'  Length:  0b---{helpLen:05b}')
         print( '  Data:    ' + helpData)
 
-    # print the commands received and return
+    # print the commands received, then the commands and variants of this client, legacy clients keep
+    # getting the same list from the server
     print('Commands are: ' + helpData)
+    print("Client commands: 'ls [PREFIX]', 'stat FILE', 'stats', 'sync [-w] DIR', "
+          "'put/get -r DIR', 'put/get -n N FILE', 'put/get -c FILE', 'put -d FILE', batch mode with '-b FILE'")
     return
 
-############################## MAIN CODE ##############################
+# client calls listRequest() to create a LIST request for the files stored on the server, does not send yet
+# Arguments:
+#  - prefix: only files whose name starts with prefix are listed, string
+# Return:
+#  - list request: byte1 = opCode 0b101 & sub-opcode 0b00000, then prefix length (1 byte), then prefix
+def listRequest(prefix):
 
-# if this script was called directly, and not as module by another script
-if __name__ == '__main__':
+    # store opCode for extended requests, and the LIST sub-opcode
+    opCode = 0b101
+    subCode = 0b00000
+    prefixLen = len(prefix.encode())
 
-    # input argument parser
-    parser = argparse.ArgumentParser(description='Client for FTP socket server', epilog='Requires Python 3.10 or higher to run')
-    parser.add_argument('host', type=str, help='IP address of the server')
-    parser.add_argument('port', type=int, help='Port number on which the server is listening')
-    parser.add_argument('-d', '--debug', action='store_const', const=1, default=0, help='Debug: print everything sent/received by client')
-    sysArgs = parser.parse_args()
+    # print request data when debug enabled
+    if DEBUG == 1:
+        print('***** LIST REQUEST *****')
+        print(f'  opCode:  0b{opCode:03b}{subCode:05b}')
+        print( '  prefix:  ' + prefix)
 
-    # get input arguments
-    SERVER_HOST = sysArgs.host
-    SERVER_PORT = sysArgs.port
-    DEBUG = sysArgs.debug
+    # build full request to send and return it
+    return ((opCode << 5) + subCode).to_bytes(1, 'big') + prefixLen.to_bytes(1, 'big') + prefix.encode()
 
-    # create client TCP socket and connect to server
-    clientSocket = socket(AF_INET, SOCK_STREAM)
-    clientSocket.connect((SERVER_HOST, SERVER_PORT))
-    print('Session has been established!')
+# client calls listResponse() to receive the server's response to a LIST request
+# Arguments:
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - list of (name, size) of the files listed, None if the server did not support the request
+def listResponse(clientSocket):
 
-    # loop until exit
+    byte1 = int.from_bytes(recvExact(clientSocket, 1), 'big')
+    # server too old to know extended requests
+    if byte1 >> 5 != 0b000:
+        return None
+
+    entries = []
+    count = int.from_bytes(recvExact(clientSocket, 4), 'big')
+    for _ in range(count):
+        nameLen = recvExact(clientSocket, 1)[0]
+        name = recvExact(clientSocket, nameLen).decode()
+        entries.append((name, int.from_bytes(recvExact(clientSocket, 8), 'big')))
+
+    # print response data when debug enabled
+    if DEBUG == 1:
+        print('***** LIST RESPONSE *****')
+        print(f'  resCode: 0b{(byte1 >> 5):03b}-----')
+        print(f'  count:   {count}')
+
+    return entries
+
+# client calls listPageRequest() to create a LIST PAGE request, one page of the files stored on the server
+# Arguments:
+#  - prefix: only files whose name starts with prefix are listed, string
+#  - after: the page starts after this name, '' for the first page, string
+#  - limit: max files in the page, integer
+# Return:
+#  - request: byte1 = opCode 0b101 & sub-opcode 0b01100, then prefix and after as length (1 byte) and
+#    name, then limit (4 bytes)
+def listPageRequest(prefix, after, limit):
+    return (((0b101 << 5) + 0b01100).to_bytes(1, 'big') + len(prefix.encode()).to_bytes(1, 'big') + prefix.encode()
+            + len(after.encode()).to_bytes(1, 'big') + after.encode() + limit.to_bytes(4, 'big'))
+
+# client calls listFiles() to list the files stored on the server under a prefix, one page at a time
+# Arguments:
+#  - clientSocket: connected client socket, socket class
+#  - prefix: only files whose name starts with prefix are listed, string
+# Return:
+#  - generator of (name, size, mtime in ns), None is yielded first if the server can't list files
+def listFiles(clientSocket, prefix):
+
+    after = ''
     while True:
-        command = input('>> ')   # get command and arguments from user
-        args = command.split(' ')  # split input line by space char ' '
+        clientSocket.sendall(listPageRequest(prefix, after, LIST_PAGE))
+        # server too old to know the request
+        if recvExact(clientSocket, 1)[0] >> 5 != 0b000:
+            yield None
+            return
 
-        request = '' # create empty request
+        count = int.from_bytes(recvExact(clientSocket, 4), 'big')
+        more = recvExact(clientSocket, 1)[0]
+        for _ in range(count):
+            after = recvExact(clientSocket, recvExact(clientSocket, 1)[0]).decode()
+            size = int.from_bytes(recvExact(clientSocket, 8), 'big')
+            yield after, size, int.from_bytes(recvExact(clientSocket, 8), 'big')
+        if not more: return
 
-        # do input validation here, keeps match cases cleaner
-        # checks number of arguments, and if filenames > 31 chars
-        if inputErrors(args):
-            # restart loop from beginning
+# client calls listCommand() to print the files stored on the server, for the 'ls' command
+# Arguments:
+#  - prefix: only files whose name starts with prefix are listed, string
+#  - clientSocket: connected client socket, socket class
+def listCommand(prefix, clientSocket):
+    count = 0
+    # in a cluster, the files of every node
+    entries = listFiles(clientSocket, prefix) if CLUSTER is None else ((name, size, mtime) for name, (size, mtime, _) in sorted(clusterFiles(prefix).items()))
+    for entry in entries:
+        if entry is None:
+            print('SERVER ERROR: Server does not support listing files...')
+            return
+        name, size, mtime = entry
+        print(f'{size:14d}  {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime / 1e9))}  {name}')
+        count += 1
+    print(f'{count} files')
+
+# client calls statQuery() to get the size, modification time and sha256 of a file on the server
+# Arguments:
+#  - fName: file on the server, string
+#  - clientSocket: connected client socket, socket class
+# Return:
+#  - (resCode, size, mtime, sha): size and mtime in ns are None unless resCode is 0b000, sha is a hex
+#    string or None when the server doesn't know it yet
+def statQuery(fName, clientSocket):
+
+    # store opCode for extended requests, and the STAT sub-opcode
+    opCode = 0b101
+    subCode = 0b01101
+    clientSocket.sendall(((opCode << 5) + subCode).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big') + fName.encode())
+
+    byte1 = recvExact(clientSocket, 1)[0]
+    resCode = byte1 >> 5
+    size = mtime = sha = None
+    if resCode == 0b000:
+        size = int.from_bytes(recvExact(clientSocket, 8), 'big')
+        mtime = int.from_bytes(recvExact(clientSocket, 8), 'big')
+        sha = recvExact(clientSocket, 32).hex() if recvExact(clientSocket, 1)[0] else None
+
+    # print request and response data when debug enabled
+    if DEBUG == 1:
+        print('***** STAT REQUEST *****')
+        print(f'  opCode:  0b{opCode:03b}{subCode:05b}')
+        print( '  fName:   ' + fName)
+        print('***** STAT RESPONSE *****')
+        print(f'  resCode: 0b{resCode:03b}-----')
+
+    return resCode, size, mtime, sha
+
+# client calls statRequest() to get and print the size, modification time and sha256 of a file on the server
+# Arguments:
+#  - fName: file on the server, string
+#  - clientSocket: connected client socket, socket class
+def statRequest(fName, clientSocket):
+
+    resCode, size, mtime, sha = statQuery(fName, clientSocket)
+    match resCode:
+        case 0b000:
+            print(f'{fName}: {size} bytes, modified {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime / 1e9))}, '
+                  f'sha256 {sha or "unknown"}')
+        case 0b010: print('SERVER ERROR: File not found...')
+        case _: print('SERVER ERROR: Server does not support STAT...')
+
+# run one request per file, or per bundle of small files, over several parallel connections, each taking the next from a shared queue
+# Arguments:
+#  - address: (host, port) of the server, tuple
+#  - files: list of (name, size) to transfer
+#  - makeRequest: putRequest or getRequest, the kind of transfer, the data of puts is sent by sendPut()
+#  - jobs: number of parallel connections, integer
+#  - bundle: max small files sent in one BPUT/BGET request, 0 for a request per file
+#  - stored: set the names of the files transferred are added to, optional
+#  - main: connected client socket, the files are transferred over it instead when the server serves one
+#    client at a time, optional
+# Return:
+#  - (done, failed, nBytes): number of files transferred, files that failed, total bytes transferred
+def runParallel(address, files, makeRequest, jobs, bundle=0, stored=None, main=None):
+
+    work = queue.Queue()
+    for unit in bundleFiles(files, bundle): work.put(unit)
+    printLock = threading.Lock()
+    totals = {'done': 0, 'failed': 0, 'bytes': 0}
+    start = time.perf_counter()
+
+    # progress, and aggregate throughput so far
+    def report(name, size, ok):
+        with printLock:
+            totals['done' if ok else 'failed'] += 1
+            if ok: totals['bytes'] += size
+            if ok and stored is not None: stored.add(name)
+            elapsed = time.perf_counter() - start
+            n = totals['done'] + totals['failed']
+            status = 'ok' if ok else 'FAILED'
+            print(f'[{n}/{len(files)}] {name} {status} ({formatRate(totals["bytes"], elapsed)} total)')
+
+    # transfer the next unit of work over a connection, until the queue is empty
+    def transfer(sock):
+        while True:
+            try:
+                unit = work.get_nowait()
+            except queue.Empty:
+                break
+
+            # small files go in one request for the whole bundle
+            if len(unit) > 1:
+                results = putBundle(sock, unit) if makeRequest is putRequest else getBundle(sock, unit)
+                for (name, size), ok in zip(unit, results): report(name, size, ok)
+                continue
+
+            name, size = unit[0]
+            ok = False
+            # in dedupe mode, puts of content the server already has are done without sending it
+            if makeRequest is putRequest and DEDUPE and skipUpload(name, sock):
+                ok = True
+            # the data of a put is sent straight from the file, only fails if the file cannot be read
+            elif makeRequest is putRequest:
+                if sendPut(name, sock): ok = recvExact(sock, 1)[0] >> 5 == 0b000
+            else:
+                sock.sendall(makeRequest(name))
+                byte1 = int.from_bytes(recvExact(sock, 1), 'big')
+                # get response with data, stored by getResponse()
+                if byte1 >> 5 == 0b001: ok = getResponse(byte1, sock, quiet=True)
+            report(name, size, ok)
+
+    # one worker per connection
+    def worker():
+        try:
+            with openConnection(address) as sock:
+                transfer(sock)
+                # close the connection with BYE
+                sock.sendall((0b100 << 5).to_bytes(1, 'big'))
+        # the connection failed, its current files are not transferred
+        except OSError as e:
+            with printLock: print(f'ERROR: Connection failed: {e}')
+
+    # a server serving one client at a time would only answer the other connections after this one is closed
+    if main is not None and not concurrentServer(address):
+        print('Server serves one client at a time, transferring over this connection.')
+        try:
+            transfer(main)
+        except OSError as e:
+            print(f'ERROR: Connection failed: {e}')
+        return totals['done'], totals['failed'], totals['bytes']
+
+    threads = [threading.Thread(target=worker) for _ in range(min(jobs, work.qsize()))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return totals['done'], totals['failed'], totals['bytes']
+
+# group the files of runParallel() into units of work, files up to BUNDLE_MAX_FILE bytes are gathered into
+# bundles of at most bundle files and BUNDLE_BYTES bytes, larger files are a unit of their own
+# Arguments:
+#  - files: list of (name, size)
+#  - bundle: max files in a bundle, integer, below 2 every file is a unit of its own
+# Return:
+#  - list of units, each a list of (name, size)
+def bundleFiles(files, bundle):
+
+    units = []
+    current = []
+    nBytes = 0
+    for name, size in files:
+        if bundle < 2 or size > BUNDLE_MAX_FILE:
+            units.append([(name, size)])
             continue
+        # the bundle is full, start the next one
+        if current and (len(current) >= bundle or nBytes + size > BUNDLE_BYTES):
+            units.append(current)
+            current = []
+            nBytes = 0
+        current.append((name, size))
+        nBytes += size
+    if current: units.append(current)
+    return units
 
-        # try to match command in args[0] and make request with error-free inputs
-        match args[0]:
+# client calls bundleLimit() to find how many files 'put -r' and 'get -r' may send in one request
+# Arguments:
+#  - clientSocket: connected client socket, socket class
+# Return:
+#  - BUNDLE_FILES if the server supports BPUT/BGET, else 0
+def bundleLimit(clientSocket):
+    if BUNDLE_FILES < 2: return 0
+    # a server older than CAPS answers it as an unknown request, with nothing else to read
+    return BUNDLE_FILES if BUNDLE_CAP in capsRequest(clientSocket) else 0
 
-            # found bye command, send opcode 0b100
-            ### NOT SPECIFIED, chose unused '0b100' code for 'bye' command ###
-            case 'bye': request = (0b100 << 5).to_bytes(1, 'big')
-        
-            # found help command, send opcode 0b011
-            case 'help': request = (0b011 << 5).to_bytes(1, 'big')
-        
-            # found put command, create request with the validated input arguments
-            case 'put': request = putRequest(args[1])
-    
-            # found get command, create request with the validated input arguments
-            case 'get': request = getRequest(args[1])
-            
-            # found change command, create request with the validated input arguments
-            case 'change': request = changeRequest(args[1], args[2])
-
-            # command not recognized
-            case _: request = (0b111 << 5).to_bytes(1, 'big')
+# client calls putBundle() to upload many small files with one BPUT request, instead of one PUT each
+# all entries are sent before the server answers with the resCode of each of them. At most BUNDLE_MAX_FILE
+# bytes of a file are read, a file grown bigger since it was listed is sent with a PUT of its own after it
+# Arguments:
+#  - sock: connected socket, socket class
+#  - entries: list of (name, size) of the files to upload
+# Return:
+#  - list of booleans, True for each file stored by the server
+def putBundle(sock, entries):
 
-        # only PUT command may fail at this point, if the file cannot be read
-        # continue loop from beginning
-        if request == '': continue
+    # request: byte1 = opCode & sub-opcode, then for each file FL (1 byte), Filename, FS (8 bytes) and data, then FL 0
+    parts = [((0b101 << 5) + 0b01110).to_bytes(1, 'big')]
+    sent = []
+    grown = []
+    for i, (name, _) in enumerate(entries):
+        try:
+            with open(name, 'rb') as f:
+                data = f.read(BUNDLE_MAX_FILE + 1)
+        except OSError:
+            print('ERROR: Could not read file "' + name + '"')
+            sent.append(False)
+            continue
+        if len(data) > BUNDLE_MAX_FILE:
+            grown.append(i)
+            sent.append(False)
+            continue
+        parts += [len(name.encode()).to_bytes(1, 'big'), name.encode(), len(data).to_bytes(8, 'big'), data]
+        sent.append(True)
+    parts.append((0).to_bytes(1, 'big'))
+    sock.sendall(b''.join(parts))
 
-        # send request
-        clientSocket.send(request)
+    # response: resCode, count (4 bytes), then one resCode per entry received
+    if recvExact(sock, 1)[0] >> 5 != 0b000:
+        return [False] * len(entries)
+    count = int.from_bytes(recvExact(sock, 4), 'big')
+    codes = iter(recvExact(sock, count))
+    results = [ok and next(codes) >> 5 == 0b000 for ok in sent]
 
-        if args[0] == 'bye':
-            # close client socket and end script
-            clientSocket.close()
-            print('client exit')
-            break
+    # the files too big for the bundle now
+    for i in grown:
+        if sendPut(entries[i][0], sock): results[i] = recvExact(sock, 1)[0] >> 5 == 0b000
+
+    # print request and response data when debug enabled
+    if DEBUG == 1:
+        print('***** BPUT REQUEST *****')
+        print(f'  opCode:  0b{0b101:03b}{0b01110:05b}')
+        print(f'  count:   {sum(sent)}')
+        print('***** BPUT RESPONSE *****')
+        for (name, _), ok in zip(entries, results):
+            print(f'  entry:   {name} ' + ('stored' if ok else 'FAILED'))
+
+    return results
+
+# client calls getBundle() to download many small files with one BGET request, instead of one GET each
+# files are stored under the names asked for, files larger than BUNDLE_MAX_FILE are received as by a GET
+# Arguments:
+#  - sock: connected socket, socket class
+#  - entries: list of (name, size) of the files to download
+# Return:
+#  - list of booleans, True for each file stored
+def getBundle(sock, entries):
+
+    # request: byte1 = opCode & sub-opcode, then for each file FL (1 byte) and Filename, then FL 0
+    names = [name.encode() for name, _ in entries]
+    sock.sendall(((0b101 << 5) + 0b01111).to_bytes(1, 'big') + b''.join(len(n).to_bytes(1, 'big') + n for n in names) + (0).to_bytes(1, 'big'))
+
+    # response: resCode, count (4 bytes), then for each entry resCode 0b001, FS (8 bytes) and data, or 0b010
+    if recvExact(sock, 1)[0] >> 5 != 0b000:
+        return [False] * len(entries)
+    recvExact(sock, 4)
+    results = []
+    for name, _ in entries:
+        if recvExact(sock, 1)[0] >> 5 != 0b001:
+            results.append(False)
+            continue
+        fSize = int.from_bytes(recvExact(sock, 8), 'big')
+        if fSize > BUNDLE_MAX_FILE:
+            err = recvToFile(sock, name, fSize)
+        else:
+            data = recvExact(sock, fSize)
+            err = ''
+            try:
+                if os.path.dirname(name): os.makedirs(os.path.dirname(name), exist_ok=True)
+                with open(name, 'wb') as f:
+                    f.write(data)
+            except OSError:
+                err = 'Error: Could not save download file "' + name + '"'
+        if err != '': print(err)
+        results.append(err == '')
+
+    # print request and response data when debug enabled
+    if DEBUG == 1:
+        print('***** BGET REQUEST *****')
+        print(f'  opCode:  0b{0b101:03b}{0b01111:05b}')
+        print(f'  count:   {len(entries)}')
+        print('***** BGET RESPONSE *****')
+        for (name, _), ok in zip(entries, results):
+            print(f'  entry:   {name} ' + ('stored' if ok else 'FAILED'))
+
+    return results
+
+# client calls putTree() to upload every file under a directory, over parallel connections
+# files keep their path relative to the current directory as name on the server, ex: 'dir/sub/file.txt'
+# Arguments:
+#  - dirName: directory to upload, string
+#  - clientSocket: connected client socket, used to ask if the server supports bundles, socket class
+#  - address: (host, port) of the server, tuple
+#  - jobs: number of parallel connections, integer
+def putTree(dirName, clientSocket, address, jobs):
+
+    # collect the files to upload, names use '/' between directories on any OS
+    files = []
+    for dirPath, _, fileNames in os.walk(dirName):
+        for fileName in fileNames:
+            path = os.path.join(dirPath, fileName)
+            name = os.path.relpath(path).replace(os.sep, '/')
+            # same limit as a single put, the filename length is only 5 bits
+            if len(name.encode()) > 30:
+                print('ERROR: Skipping ' + name + ', filename must not exceed 30 characters.')
+                continue
+            files.append((name, os.path.getsize(path)))
+
+    if not files:
+        print('ERROR: No files to upload in "' + dirName + '"')
+        return
+
+    # small files are sent in bundles, except in dedupe mode where each is first checked with the server
+    bundle = 0 if DEDUPE else bundleLimit(clientSocket)
+    start = time.perf_counter()
+    done, failed, nBytes = runParallel(address, files, putRequest, jobs, bundle, main=clientSocket)
+    elapsed = time.perf_counter() - start
+    print(f'{done} files uploaded, {failed} failed, {nBytes} bytes in {elapsed:.3f} s ({formatRate(nBytes, elapsed)})')
+
+# client calls getTree() to download every file stored on the server under a directory, over parallel connections
+# Arguments:
+#  - dirName: directory to download, string
+#  - clientSocket: connected client socket, used to list the files, socket class
+#  - address: (host, port) of the server, tuple
+#  - jobs: number of parallel connections, integer
+def getTree(dirName, clientSocket, address, jobs):
 
-        # get 1-byte response from server, convert byte to integer
-        byte1 = int.from_bytes(clientSocket.recv(1), 'big')
+    # ask the server for the files under the directory, in a cluster every node
+    prefix = dirName.replace(os.sep, '/').rstrip('/') + '/'
+    if CLUSTER is not None:
+        found = clusterFiles(prefix)
+        entries = [(name, size) for name, (size, _, _) in sorted(found.items())]
+    else:
+        clientSocket.sendall(listRequest(prefix))
+        entries = listResponse(clientSocket)
+    if entries is None:
+        print('SERVER ERROR: Server does not support listing files...')
+        return
+
+    # only download names that stay inside the directory and fit in a GET request
+    files = []
+    for name, size in entries:
+        if not name.startswith(prefix) or '..' in name.split('/'):
+            continue
+        if len(name.encode()) > 30:
+            print('ERROR: Skipping ' + name + ', filename must not exceed 30 characters.')
+            continue
+        files.append((name, size))
+
+    if not files:
+        print('SERVER ERROR: No files found under "' + dirName + '"')
+        return
+
+    start = time.perf_counter()
+    if CLUSTER is None:
+        done, failed, nBytes = runParallel(address, files, getRequest, jobs, bundleLimit(clientSocket), main=clientSocket)
+    # each file is downloaded from the node that listed it
+    else:
+        done = failed = nBytes = 0
+        for node in CLUSTER.ring.nodes:
+            nodeFiles = [(name, size) for name, size in files if found[name][2] == node]
+            if not nodeFiles: continue
+            host, _, port = node.rpartition(':')
+            totals = runParallel((host, int(port)), nodeFiles, getRequest, jobs, bundleLimit(CLUSTER.connection(node)))
+            done, failed, nBytes = done + totals[0], failed + totals[1], nBytes + totals[2]
+    elapsed = time.perf_counter() - start
+    print(f'{done} files downloaded, {failed} failed, {nBytes} bytes in {elapsed:.3f} s ({formatRate(nBytes, elapsed)})')
+
+# sha256 of a file's content
+# Arguments:
+#  - fName: file to hash, string
+# Return:
+#  - hex digest, string
+def hashFile(fName):
+    hasher = hashlib.sha256()
+    with open(fName, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+# read the index of a synced directory, what was uploaded from it by the last sync to a server
+# Arguments:
+#  - dirName: synced directory, string
+#  - server: 'host:port' of the server, string
+# Return:
+#  - (files, scanned): dict of name -> [size, mtime in ns, sha256], and the time of the scan it was made
+#    from in ns, empty for a directory not synced yet or synced to another server
+def loadSyncIndex(dirName, server):
+    try:
+        with open(os.path.join(dirName, SYNC_INDEX)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}, 0
+    if index.get('server') != server:
+        return {}, 0
+    return index['files'], index['scanned']
+
+# write the index of a synced directory, replacing the old one at once so an interrupted sync keeps it whole
+# Arguments:
+#  - dirName: synced directory, string
+#  - server: 'host:port' of the server, string
+#  - files, scanned: as returned by loadSyncIndex()
+def saveSyncIndex(dirName, server, files, scanned):
+    path = os.path.join(dirName, SYNC_INDEX)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'server': server, 'scanned': scanned, 'files': files}, f)
+    os.replace(path + '.tmp', path)
+
+# client calls syncTree() to bring the server up to date with a directory, from the index of its last sync
+# only the files whose size or mtime changed are read, a new file with the content of a file gone since
+# the last sync is renamed on the server with a CHANGE instead of being uploaded again, the others are
+# uploaded as by 'put -r'. Files deleted from the directory stay on the server, the protocol can't delete
+# Arguments:
+#  - dirName: directory to sync, string
+#  - clientSocket: connected client socket, socket class
+#  - address: (host, port) of the server, tuple
+#  - jobs: number of parallel connections, integer
+# Return:
+#  - number of changes found: files renamed, uploaded or failing to upload, and deleted
+def syncTree(dirName, clientSocket, address, jobs):
+
+    server = f'{address[0]}:{address[1]}'
+    files, lastScan = loadSyncIndex(dirName, server)
+    scanned = time.time_ns()
+
+    # stat every file, names use '/' between directories on any OS, as with 'put -r'
+    current = {}
+    for dirPath, _, fileNames in os.walk(dirName):
+        for fileName in fileNames:
+            path = os.path.join(dirPath, fileName)
+            name = os.path.relpath(path).replace(os.sep, '/')
+            if path == os.path.join(dirName, SYNC_INDEX) or path == os.path.join(dirName, SYNC_INDEX + '.tmp'):
+                continue
+            if len(name.encode()) > 30:
+                if name not in files: print('ERROR: Skipping ' + name + ', filename must not exceed 30 characters.')
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            current[name] = (st.st_size, st.st_mtime_ns)
+
+    # files new or changed since the last sync, a file changed within a second of the last scan may have
+    # changed again after it was read without its mtime moving, it is read again to be sure
+    changed = {}
+    for name, (size, mtime) in current.items():
+        entry = files.get(name)
+        if entry is not None and entry[:2] == [size, mtime] and mtime < lastScan - 1000000000:
+            continue
+        try:
+            sha = hashFile(name)
+        except OSError:
+            continue
+        if entry is not None and entry[2] == sha:
+            # touched, or read again, but the server already has this content
+            files[name] = [size, mtime, sha]
+            continue
+        changed[name] = [size, mtime, sha]
+
+    # files gone since the last sync, by content, the ones found again under a new name are renamed
+    gone = {}
+    for name in [name for name in files if name not in current]:
+        gone.setdefault(files[name][2], []).append(name)
+        del files[name]
+    renamed = 0
+    for name, entry in list(changed.items()):
+        if name in files or not gone.get(entry[2]):
+            continue
+        old = gone[entry[2]].pop()
+        try:
+            sock = clientSocket
+            # in a cluster, the rename goes to the first node owning the old name, it moves the file between nodes
+            if CLUSTER is not None: sock = CLUSTER.connection(CLUSTER.owners(old)[0])
+            sock.sendall(changeRequest(old, name))
+            ok = recvExact(sock, 1)[0] >> 5 == 0b000
+        except OSError as e:
+            if CLUSTER is not None: CLUSTER.drop(CLUSTER.owners(old)[0])
+            print(f'ERROR: Connection failed: {e}')
+            ok = False
+        # a rename that failed is uploaded instead
+        if ok:
+            print(f'{old} has been renamed to {name}.')
+            files[name] = changed.pop(name)
+            renamed += 1
+    deleted = sum(len(names) for names in gone.values())
+
+    # then the uploads, small files in bundles as with 'put -r'
+    done = failed = nBytes = 0
+    if changed:
+        stored = set()
+        bundle = 0 if DEDUPE else bundleLimit(clientSocket)
+        start = time.perf_counter()
+        done, failed, nBytes = runParallel(address, sorted((name, entry[0]) for name, entry in changed.items()),
+                                           putRequest, jobs, bundle, stored, clientSocket if CLUSTER is None else None)
+        elapsed = time.perf_counter() - start
+        for name in stored:
+            files[name] = changed[name]
+        print(f'{done} files uploaded, {failed} failed, {nBytes} bytes in {elapsed:.3f} s ({formatRate(nBytes, elapsed)})')
+
+    # files that failed are not in the index, the next sync uploads them again
+    saveSyncIndex(dirName, server, files, scanned)
+    if renamed or changed or deleted:
+        print(f'{dirName} synced: {done} uploaded, {renamed} renamed, {failed} failed, '
+              f'{deleted} deleted locally (kept on the server), {len(current) - done - renamed - failed} unchanged.')
+    return renamed + len(changed) + deleted
+
+# client calls watchTree() to keep a directory synced, it is scanned every SYNC_INTERVAL seconds until Ctrl+C
+# Arguments:
+#  - dirName, clientSocket, address, jobs: as for syncTree()
+def watchTree(dirName, clientSocket, address, jobs):
+    print(f'Watching {dirName}, Ctrl+C to stop.')
+    try:
+        while True:
+            syncTree(dirName, clientSocket, address, jobs)
+            time.sleep(SYNC_INTERVAL)
+    except KeyboardInterrupt:
+        print(f'Stopped watching {dirName}.')
 
-        # print if debug enabled
-        if DEBUG:
-            print('***** SERVER RESPONSE *****')
-            print(f'  resCode: 0b{(byte1 >> 5):03b}')
+# consistent hash ring of the nodes of a cluster, the same as the servers build, see server.py
+# each node is placed at vnodes points given by the sha256 of its address, a name is owned by the first
+# nodes found going around the ring from the hash of the name
+class HashRing:
 
-        # get byte1 opcode in top 3 bits and match
-        match byte1 >> 5:
+    # Arguments:
+    #  - nodes: 'host:port' of every node, list of strings
+    #  - vnodes: points of each node on the ring, integer
+    def __init__(self, nodes, vnodes):
+        self.nodes = list(nodes)
+        self.vnodes = vnodes
+        self.points = sorted((self._hash(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes))
+        self.keys = [key for key, _ in self.points]
 
-            # successfull put and change commands server response
-            case 0b000:
-                # if this was put command, print the uploaded filename
-                if args[0] == 'put': print(args[1] + ' has been uploaded successfully.')
-                # if this was change command, print old name and new name
-                elif args[0] == 'change': print(args[1] + ' has been renamed to ' + args[2] + ' successfully.')
+    @staticmethod
+    def _hash(text):
+        return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], 'big')
 
-            # get response from server, need to further receive data in getResponse()
-            case 0b001: getResponse(byte1, clientSocket)
+    # nodes storing a name, in the order they are asked
+    # Arguments:
+    #  - name: filename, '/' between directories, string
+    #  - r: number of owners, integer
+    # Return:
+    #  - list of 'host:port', at most r and at most the number of nodes
+    def owners(self, name, r):
+        owners = []
+        start = bisect_right(self.keys, self._hash(name))
+        for i in range(len(self.points)):
+            node = self.points[(start + i) % len(self.points)][1]
+            if node not in owners:
+                owners.append(node)
+                if len(owners) == r: break
+        return owners
+
+# connections of the client to the nodes of a cluster, opened when a name owned by the node is first used
+class ClusterRouter:
+
+    # Arguments:
+    #  - ring: HashRing of the nodes
+    #  - replicas: number of nodes storing each file, integer
+    #  - seed: ('host:port', socket) of the server the client connected to
+    def __init__(self, ring, replicas, seed):
+        self.ring = ring
+        self.replicas = replicas
+        self.seed = seed[0]
+        self.conns = {seed[0]: seed[1]}     # node -> connected socket
+
+    # nodes storing a name, the first one is asked first
+    def owners(self, name):
+        return self.ring.owners(name, self.replicas)
+
+    # connection to a node
+    # Arguments:
+    #  - node: 'host:port', string
+    # Return:
+    #  - connected socket
+    # Raises:
+    #  - OSError if the node can't be reached
+    def connection(self, node):
+        sock = self.conns.get(node)
+        if sock is None:
+            host, _, port = node.rpartition(':')
+            sock = create_connection((host, int(port)), timeout=TIMEOUT)
+            sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            self.conns[node] = sock
+        return sock
+
+    # forget the connection to a node that failed, a new one is opened the next time it is used
+    def drop(self, node):
+        sock = self.conns.pop(node, None)
+        if sock is not None: sock.close()
+
+    # close the connections with BYE, except the one to the seed server, closed by the caller
+    def close(self):
+        for node, sock in self.conns.items():
+            if node == self.seed: continue
+            try:
+                sock.sendall((0b100 << 5).to_bytes(1, 'big'))
+            except OSError:
+                pass
+            sock.close()
+
+# client calls ringRequest() to get the nodes of the cluster the server is part of
+# Arguments:
+#  - clientSocket: connected client socket, socket class
+# Return:
+#  - (replicas, HashRing), None if the server is not part of a cluster
+def ringRequest(clientSocket):
+    clientSocket.sendall(((0b101 << 5) + 0b10001).to_bytes(1, 'big'))
+    # a server outside a cluster answers 0b010, an older one 0b011, neither with a body
+    if recvExact(clientSocket, 1)[0] >> 5 != 0b000:
+        return None
+    replicas = recvExact(clientSocket, 1)[0]
+    vnodes = int.from_bytes(recvExact(clientSocket, 2), 'big')
+    count = int.from_bytes(recvExact(clientSocket, 2), 'big')
+    nodes = [recvExact(clientSocket, recvExact(clientSocket, 1)[0]).decode() for _ in range(count)]
+    return replicas, HashRing(nodes, vnodes)
+
+# client calls clusterCommand() to run a put, get, change or stat on the nodes owning its name, in ring
+# order: a node that doesn't answer is skipped, and a get or change the node can't do because it missed
+# the file while it was down is passed to the next owner
+# Arguments:
+#  - args: list of arguments (strings) of the command, already checked by inputErrors()
+def clusterCommand(args):
+
+    name = args[1]
+    request = None
+    owners = CLUSTER.owners(name)
+    for i, node in enumerate(owners):
+        last = i == len(owners) - 1
+        try:
+            sock = CLUSTER.connection(node)
+            if DEBUG == 1: print(f'Cluster: {args[0]} {name} sent to {node}')
+
+            if args[0] == 'stat':
+                statRequest(name, sock)
+                return
+            # in dedupe mode, the owner may already have the content of the file to put
+            if args[0] == 'put' and DEDUPE and skipUpload(name, sock):
+                print(name + ' has been uploaded successfully (content already on server, data not sent).')
+                return
+            if args[0] in ('put', 'get') and (COMPRESS or DIGEST):
+                if args[0] == 'put': putCompressed(name, sock, COMPRESS, DIGEST)
+                else: getCompressed(name, sock, COMPRESS, DIGEST)
+                return
+
+            # built once, a put reads its file only for the first node
+            if request is None:
+                request = buildRequest(args)
+                if request == '': return
+            sock.sendall(request)
+            byte1 = recvExact(sock, 1)[0]
+            if not last and (args[0], byte1 >> 5) in (('get', 0b010), ('change', 0b101)):
+                continue
+            handleResponse(args, sock, byte1)
+            return
+        except OSError as e:
+            CLUSTER.drop(node)
+            print(f'Cluster: node {node} is not answering ({e})' + ('' if last else ', trying the next replica'))
+
+# client calls clusterFiles() to list the files stored under a prefix on every node of the cluster
+# Arguments:
+#  - prefix: only files whose name starts with prefix are listed, string
+# Return:
+#  - dict of name -> (size, mtime in ns, node), the node with the most recent copy of the file
+def clusterFiles(prefix):
+    files = {}
+    for node in CLUSTER.ring.nodes:
+        try:
+            for entry in listFiles(CLUSTER.connection(node), prefix):
+                if entry is None: break
+                name, size, mtime = entry
+                if name not in files or mtime > files[name][1]: files[name] = (size, mtime, node)
+        except OSError as e:
+            CLUSTER.drop(node)
+            print(f'Cluster: node {node} is not answering ({e}), its files are not listed')
+    return files
+
+# split a file of total bytes into at most n ranges, none smaller than MIN_SEGMENT except the last
+# Arguments:
+#  - total: size of the file, integer
+#  - n: max number of ranges, integer
+# Return:
+#  - list of (offset, length), covering the whole file, at least one range
+def splitRanges(total, n):
+    n = max(1, min(n, total // MIN_SEGMENT))
+    step = -(-total // n) if total else 0
+    return [(offset, min(step, total - offset)) for offset in range(0, total, step)] if total else [(0, 0)]
+
+# client calls rangeGetRequest() to create a RANGE GET request, does not send yet
+# Arguments:
+#  - fName: filename, string
+#  - offset: position of the first byte to get, integer
+#  - length: number of bytes to get, 0 only asks for the file size, integer
+# Return:
+#  - range get request: byte1 = opCode 0b101 & sub-opcode 0b00001, FL (1 byte), Filename, offset and length (8 bytes each)
+def rangeGetRequest(fName, offset, length):
+    return ((0b101 << 5) + 0b00001).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big') + fName.encode() \
+        + offset.to_bytes(8, 'big') + length.to_bytes(8, 'big')
+
+# client calls rangePutRequest() to create the header of a RANGE PUT request, the data is sent after it
+# Arguments:
+#  - fName: filename, string
+#  - total: size of the whole file, integer
+#  - offset: position of the first byte of the range, integer
+#  - length: number of bytes in the range, integer
+# Return:
+#  - range put header: byte1 = opCode 0b101 & sub-opcode 0b00010, FL (1 byte), Filename, total, offset and length (8 bytes each)
+def rangePutRequest(fName, total, offset, length):
+    return ((0b101 << 5) + 0b00010).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big') + fName.encode() \
+        + total.to_bytes(8, 'big') + offset.to_bytes(8, 'big') + length.to_bytes(8, 'big')
+
+# client calls commitRequest() to create a COMMIT request, once all ranges of a file were put
+# Arguments:
+#  - fName: filename, string
+#  - total: size of the whole file, integer
+# Return:
+#  - commit request: byte1 = opCode 0b101 & sub-opcode 0b00011, FL (1 byte), Filename, total (8 bytes)
+def commitRequest(fName, total):
+    return ((0b101 << 5) + 0b00011).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big') + fName.encode() \
+        + total.to_bytes(8, 'big')
+
+# run one function per range, each over its own connection to the server
+# Arguments:
+#  - address: (host, port) of the server, tuple
+#  - ranges: list of (offset, length)
+#  - transfer: function(sock, offset, length) returning True when its range was transferred
+#  - main: connected client socket, the ranges are transferred over it one after the other instead when
+#    the server serves one client at a time, optional
+# Return:
+#  - True if every range was transferred
+def runRanges(address, ranges, transfer, main=None):
 
-            # server GET error response, file not found
-            case 0b010: print('SERVER ERROR: File not found...')
+    # a server serving one client at a time would only answer the other connections after this one is closed
+    if main is not None and not concurrentServer(address):
+        print('Server serves one client at a time, transferring over this connection.')
+        try:
+            return all([transfer(main, *r) for r in ranges])
+        except OSError as e:
+            print(f'ERROR: Connection failed: {e}')
+            return False
 
-            # server unknown request ERROR
-            case 0b011: print("SERVER ERROR: Unknown request... Try 'help' to see commands supported by server.")
-    
-            # server CHANGE/PUT error response, unsuccessfull change
-            case 0b101: print('SERVER ERROR: Command was unsuccessful...')
+    results = [False] * len(ranges)
+
+    def worker(i):
+        try:
+            with openConnection(address) as sock:
+                results[i] = transfer(sock, *ranges[i])
+                # close the connection with BYE
+                sock.sendall((0b100 << 5).to_bytes(1, 'big'))
+        except OSError as e:
+            print(f'ERROR: Range {ranges[i][0]}+{ranges[i][1]} failed: {e}')
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(ranges))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return all(results)
+
+# client calls putMulti() to upload one file as several ranges over parallel connections,
+# then commits it on the main connection so it replaces the server's file all at once
+# Arguments:
+#  - fName: file to upload, string
+#  - clientSocket: connected client socket, socket class
+#  - address: (host, port) of the server, tuple
+#  - streams: number of parallel connections, integer
+def putMulti(fName, clientSocket, address, streams):
+
+    try:
+        f = open(fName, 'rb')
+    except OSError:
+        print('ERROR: Could not read file "' + fName + '"')
+        return
+
+    with f:
+        total = os.fstat(f.fileno()).st_size
+        ranges = splitRanges(total, streams)
+
+        # send the header of the range, then its data straight from the file
+        def transfer(sock, offset, length):
+            sock.sendall(rangePutRequest(fName, total, offset, length))
+            if length: sock.sendfile(f, offset, length)
+            return recvExact(sock, 1)[0] >> 5 == 0b000
+
+        start = time.perf_counter()
+        ok = runRanges(address, ranges, transfer, clientSocket)
+
+    # all ranges are on the server, replace the file with them
+    if ok:
+        clientSocket.sendall(commitRequest(fName, total))
+        ok = recvExact(clientSocket, 1)[0] >> 5 == 0b000
+    elapsed = time.perf_counter() - start
+
+    if ok: print(f'{fName} has been uploaded successfully over {len(ranges)} stream(s) ({formatRate(total, elapsed)}).')
+    else: print('SERVER ERROR: Command was unsuccessful...')
+
+# client calls getMulti() to download one file as several ranges over parallel connections,
+# each range is written in place into 'fName.part' with positional writes, renamed once every range arrived
+# so the file replaced is left as it was if a range fails
+# Arguments:
+#  - fName: file to download, string
+#  - clientSocket: connected client socket, socket class
+#  - address: (host, port) of the server, tuple
+#  - streams: number of parallel connections, integer
+def getMulti(fName, clientSocket, address, streams):
+
+    # a range of length 0 only asks for the size of the file
+    clientSocket.sendall(rangeGetRequest(fName, 0, 0))
+    byte1 = recvExact(clientSocket, 1)[0]
+    if byte1 >> 5 != 0b001:
+        print('SERVER ERROR: File not found...')
+        return
+    total = int.from_bytes(recvExact(clientSocket, 8), 'big')
+    recvExact(clientSocket, 8)
+    ranges = splitRanges(total, streams)
+
+    # receive the header of the range, then write its data at its place in the file
+    # a range of a file that changed size on the server since the first request is not kept
+    def transfer(sock, offset, length):
+        sock.sendall(rangeGetRequest(fName, offset, length))
+        if recvExact(sock, 1)[0] >> 5 != 0b001:
+            return False
+        size = int.from_bytes(recvExact(sock, 8), 'big')
+        received = int.from_bytes(recvExact(sock, 8), 'big')
+        recvToFd(sock, fd, offset, received)
+        return size == total and received == length
+
+    partName = fName + '.part'
+    try:
+        if os.path.dirname(fName): os.makedirs(os.path.dirname(fName), exist_ok=True)
+        fd = os.open(partName, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+    except OSError:
+        print('Error: Could not save download file "' + fName + '"')
+        return
+
+    ok = False
+    try:
+        # size the file first, every range then writes into its own part of it
+        os.ftruncate(fd, total)
+        start = time.perf_counter()
+        ok = runRanges(address, ranges, transfer, clientSocket)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.close(fd)
+        # the ranges that failed are holes, 'get -c' can't continue after them
+        if not ok: os.remove(partName)
+
+    if ok:
+        try:
+            os.replace(partName, fName)
+        except OSError:
+            os.remove(partName)
+            print('Error: Could not save download file "' + fName + '"')
+            return
+        print(f'{fName} has been downloaded successfully over {len(ranges)} stream(s) ({formatRate(total, elapsed)}).')
+    else: print('SERVER ERROR: Command was unsuccessful...')
+
+# client calls resumeRequest() to create a RESUME request, asking which ranges of an upload the server has
+# Arguments:
+#  - fName: filename, string
+#  - total: size of the whole file, integer
+# Return:
+#  - resume request: byte1 = opCode 0b101 & sub-opcode 0b00100, FL (1 byte), Filename, total (8 bytes)
+def resumeRequest(fName, total):
+    return ((0b101 << 5) + 0b00100).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big') + fName.encode() \
+        + total.to_bytes(8, 'big')
+
+# client calls putResume() to finish an interrupted upload, only the ranges the server is missing are sent
+# Arguments:
+#  - fName: file to upload, string
+#  - clientSocket: connected client socket, socket class
+def putResume(fName, clientSocket):
+
+    try:
+        f = open(fName, 'rb')
+    except OSError:
+        print('ERROR: Could not read file "' + fName + '"')
+        return
+
+    with f:
+        total = os.fstat(f.fileno()).st_size
+
+        # ask the server which ranges it already received
+        clientSocket.sendall(resumeRequest(fName, total))
+        if recvExact(clientSocket, 1)[0] >> 5 != 0b000:
+            print('SERVER ERROR: Server does not support resuming uploads...')
+            return
+        count = int.from_bytes(recvExact(clientSocket, 4), 'big')
+        received = [(int.from_bytes(recvExact(clientSocket, 8), 'big'), int.from_bytes(recvExact(clientSocket, 8), 'big')) for _ in range(count)]
+        digest = recvExact(clientSocket, 32)
+
+        # the ranges are only kept if they hold the same bytes as the file now, it may have been
+        # edited since the interrupted upload without changing its size
+        if received and rangesDigest(f, received) != digest:
+            print(f'{fName} changed since the interrupted upload, sending all of it.')
+            received = []
+
+        # the ranges in between are missing, an empty file still needs one empty range to create it
+        missing = []
+        position = 0
+        for start, end in received:
+            if start > position: missing.append((position, start - position))
+            position = max(position, end)
+        if position < total or total == 0: missing.append((position, total - position))
+
+        # send every missing range on this connection, straight from the file
+        for offset, length in missing:
+            clientSocket.sendall(rangePutRequest(fName, total, offset, length))
+            if length: clientSocket.sendfile(f, offset, length)
+            if recvExact(clientSocket, 1)[0] >> 5 != 0b000:
+                print('SERVER ERROR: Command was unsuccessful...')
+                return
+
+    # all ranges are on the server, replace the file with them
+    clientSocket.sendall(commitRequest(fName, total))
+    if recvExact(clientSocket, 1)[0] >> 5 != 0b000:
+        print('SERVER ERROR: Command was unsuccessful...')
+        return
+
+    sent = sum(length for _, length in missing)
+    print(f'{fName} has been uploaded successfully ({total - sent} bytes resumed, {sent} bytes sent).')
+
+# sha256 of the bytes of a file in some ranges, one after the other, compared with the RESUME response
+# Arguments:
+#  - f: file opened for reading in binary mode, file object
+#  - ranges: sorted list of (start, end) ranges
+# Return:
+#  - sha256 digest, 32 bytes
+def rangesDigest(f, ranges):
+    hasher = hashlib.sha256()
+    for start, end in ranges:
+        f.seek(start)
+        while start < end:
+            chunk = f.read(min(CHUNK_SIZE, end - start))
+            if not chunk: break
+            hasher.update(chunk)
+            start += len(chunk)
+    return hasher.digest()
+
+# client calls getResume() to continue an interrupted download, kept in 'fName.part' until it is complete
+# only the bytes after those already in the part file are requested. The size and modification time of
+# the server's file are kept in 'fName.part.meta' next to it, a part file of another version of the
+# file, or without them, is downloaded again from the start
+# Arguments:
+#  - fName: file to download, string
+#  - clientSocket: connected client socket, socket class
+def getResume(fName, clientSocket):
+
+    partName = fName + '.part'
+    metaName = partName + '.meta'
+
+    # the version of the file on the server now
+    resCode, size, mtime, _ = statQuery(fName, clientSocket)
+    if resCode != 0b000:
+        print('SERVER ERROR: File not found...' if resCode == 0b010 else 'SERVER ERROR: Server does not support resuming downloads...')
+        return
+    version = {'size': size, 'mtime': mtime}
+
+    # continue after the bytes of the part file only if they come from the same version
+    offset = 0
+    if os.path.exists(partName):
+        try:
+            with open(metaName) as f:
+                kept = json.load(f)
+        except (OSError, ValueError):
+            kept = None
+        if kept == version and os.path.getsize(partName) <= size:
+            offset = os.path.getsize(partName)
+        else:
+            print(f'"{partName}" may not hold the version of {fName} on the server, downloading it again.')
+
+    # record the version before any byte of it is written
+    if os.path.dirname(fName): os.makedirs(os.path.dirname(fName), exist_ok=True)
+    with open(metaName + '.tmp', 'w') as f:
+        json.dump(version, f)
+    os.replace(metaName + '.tmp', metaName)
+
+    # ask for everything from offset to the end of the file
+    clientSocket.sendall(rangeGetRequest(fName, offset, 2**64 - 1 - offset))
+    if recvExact(clientSocket, 1)[0] >> 5 != 0b001:
+        print('SERVER ERROR: File not found...')
+        return
+    total = int.from_bytes(recvExact(clientSocket, 8), 'big')
+    length = int.from_bytes(recvExact(clientSocket, 8), 'big')
+
+    # append to the part file, if the connection drops it holds every byte received so far
+    fd = os.open(partName, os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if offset == 0 else 0) | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        recvToFd(clientSocket, fd, offset, length)
+    finally:
+        os.close(fd)
+
+    # the file was replaced between the STAT and the RANGE GET, the next 'get -c' starts over
+    if total != size:
+        os.remove(metaName)
+        print(f'ERROR: {fName} changed on the server while it was downloaded, try again')
+        return
+
+    # complete, move it into place
+    os.replace(partName, fName)
+    os.remove(metaName)
+    print(f'{fName} has been downloaded successfully ({offset} bytes resumed, {length} bytes received).')
+
+# format a transfer rate for printing
+# Arguments:
+#  - nBytes: number of bytes transferred, integer
+#  - seconds: duration of the transfer, float
+# Return:
+#  - string with bytes/sec in the most readable unit
+def formatRate(nBytes, seconds):
+    rate = nBytes / seconds if seconds > 0 else 0.0
+    for unit in ('B/s', 'KB/s', 'MB/s'):
+        if rate < 1024:
+            return f'{rate:.1f} {unit}'
+        rate /= 1024
+    return f'{rate:.1f} GB/s'
+
+# client calls hasRequest() to create a HAS request, asking the server to store fName from content it
+# already has, so the file doesn't need to be sent, does not send yet
+# Arguments:
+#  - fName: filename, string
+# Return:
+#  - '': empty request if there was an error reading the file
+#  - has request: byte1 = opCode 0b101 & sub-opcode 0b00101, sha256 (32 bytes), FL (1 byte), Filename, FS (8 bytes)
+def hasRequest(fName):
+
+    # hash the file in chunks, it is never fully in memory
+    try:
+        hasher = hashlib.sha256()
+        with open(fName, 'rb') as f:
+            while chunk := f.read(CHUNK_SIZE):
+                hasher.update(chunk)
+            fSize = f.tell()
+    except OSError:
+        return ''
+
+    # print request data when debug enabled
+    if DEBUG == 1:
+        print('***** HAS REQUEST *****')
+        print(f'  opCode:  0b101{0b00101:05b}')
+        print( '  sha256:  ' + hasher.hexdigest())
+        print( '  fName:   ' + fName)
+        print(f'  FS:      0x{fSize:016X}')
+
+    return ((0b101 << 5) + 0b00101).to_bytes(1, 'big') + hasher.digest() + len(fName.encode()).to_bytes(1, 'big') \
+        + fName.encode() + fSize.to_bytes(8, 'big')
+
+# client calls skipUpload() before a PUT in dedupe mode, to find out if the upload is needed
+# Arguments:
+#  - fName: file to upload, string
+#  - clientSocket: connected client socket, socket class
+# Return:
+#  - True if the server stored the file from content it already had, the PUT must not be sent
+def skipUpload(fName, clientSocket):
+
+    request = hasRequest(fName)
+    # file can't be read, the PUT reports the error
+    if request == '':
+        return False
+    clientSocket.sendall(request)
+    return recvExact(clientSocket, 1)[0] >> 5 == 0b000
+
+# client calls sigsRequest() to create a SIGS request, asking for the block signatures of a stored file
+# Arguments:
+#  - fName: filename, string
+# Return:
+#  - sigs request: byte1 = opCode 0b101 & sub-opcode 0b00110, FL (1 byte), Filename
+def sigsRequest(fName):
+    return ((0b101 << 5) + 0b00110).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big') + fName.encode()
+
+# find the blocks of the stored file in the new content, rsync style: a weak checksum of the window at
+# every offset is rolled one byte at a time, and a strong digest confirms the windows it matches
+# Arguments:
+#  - data: new content, bytes-like object
+#  - blockSize: size of the blocks, integer
+#  - table: strong digest to block index, for each weak checksum of the stored file, dict of dicts
+# Return:
+#  - generator of ops, ('copy', index, 1) for a block of the stored file, ('data', start, end) for new data
+def deltaOps(data, blockSize, table):
+
+    size = len(data)
+    pos = 0
+    literal = 0     # start of the new data not sent yet
+    weak = None     # adler32 of the window at pos, None when it must be computed again
+
+    while table and pos + blockSize <= size:
+        # a fresh window, right after a match, is checksummed in one go
+        if weak is None: weak = zlib.adler32(data[pos:pos + blockSize])
+
+        strongs = table.get(weak)
+        if strongs is not None:
+            index = strongs.get(hashlib.blake2b(data[pos:pos + blockSize], digest_size=16).digest())
+            if index is not None:
+                if literal < pos: yield ('data', literal, pos)
+                yield ('copy', index, 1)
+                pos += blockSize
+                literal = pos
+                weak = None
+                continue
+
+        # no match, roll the window one byte at a time (drop data[pos], add data[pos + blockSize]) until its
+        # weak checksum is in the table, this loop is where the time goes for changed data
+        a = weak & 0xFFFF
+        b = weak >> 16
+        last = size - blockSize     # position of the last full window
+        while pos < last:
+            out = data[pos]
+            a = (a - out + data[pos + blockSize]) % 65521
+            b = (b - blockSize * out - 1 + a) % 65521
+            pos += 1
+            if ((b << 16) | a) in table: break
+        else:
+            # no window left to try
+            break
+        weak = (b << 16) | a
+
+    # the end of the file that no block matched
+    if literal < size: yield ('data', literal, size)
+
+# client calls putDelta() to upload a file already on the server by sending only what changed,
+# the server rebuilds the new version from the blocks it already has and the data sent,
+# a file not yet on the server is sent whole
+# Arguments:
+#  - fName: file to upload, string
+#  - clientSocket: connected client socket, socket class
+def putDelta(fName, clientSocket):
+
+    try:
+        f = open(fName, 'rb')
+    except OSError:
+        print('ERROR: Could not read file "' + fName + '"')
+        return
+
+    start = time.perf_counter()
+    with f:
+        fSize = os.fstat(f.fileno()).st_size
+
+        # get the signatures of the stored file, index them by weak checksum
+        clientSocket.sendall(sigsRequest(fName))
+        table = {}
+        blockSize = 0
+        count = 0
+        if recvExact(clientSocket, 1)[0] >> 5 == 0b000:
+            recvExact(clientSocket, 8)
+            blockSize = int.from_bytes(recvExact(clientSocket, 4), 'big')
+            count = int.from_bytes(recvExact(clientSocket, 4), 'big')
+            signatures = recvExact(clientSocket, 20 * count)
+            for index in range(count):
+                signature = signatures[20 * index:20 * index + 20]
+                table.setdefault(int.from_bytes(signature[:4], 'big'), {}).setdefault(signature[4:], index)
+
+        # delta request: byte1 = opCode 0b101 & sub-opcode 0b00111, FL (1 byte), Filename, FS (8 bytes), block size (4 bytes)
+        clientSocket.sendall(((0b101 << 5) + 0b00111).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big')
+                             + fName.encode() + fSize.to_bytes(8, 'big') + blockSize.to_bytes(4, 'big'))
+
+        # the file is mapped rather than read, only the pages looked at are loaded
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if fSize else b''
+        ops = bytearray()   # COPY ops waiting to be sent together
+        run = None          # [first index, count] of consecutive blocks, sent as one COPY
+        copied = 0
+        sent = 0
+        try:
+            for op in deltaOps(data, blockSize, table):
+                # consecutive blocks of the stored file are merged into one COPY
+                if op[0] == 'copy':
+                    copied += blockSize
+                    if run is not None and op[1] == run[0] + run[1]:
+                        run[1] += 1
+                        continue
+                    if run is not None: ops += b'\x01' + run[0].to_bytes(4, 'big') + run[1].to_bytes(4, 'big')
+                    run = [op[1], 1]
+                    if len(ops) >= CHUNK_SIZE:
+                        clientSocket.sendall(ops)
+                        ops = bytearray()
+                    continue
+
+                if run is not None: ops += b'\x01' + run[0].to_bytes(4, 'big') + run[1].to_bytes(4, 'big')
+                run = None
+                # new data as DATA ops of at most 1 MB, straight from the mapped file
+                for piece in range(op[1], op[2], 1024 * 1024):
+                    end = min(piece + 1024 * 1024, op[2])
+                    clientSocket.sendall(ops + b'\x02' + (end - piece).to_bytes(4, 'big'))
+                    clientSocket.sendall(data[piece:end])
+                    ops = bytearray()
+                    sent += end - piece
+
+            # END with the sha256 of the whole file, the server checks what it rebuilt against it
+            if run is not None: ops += b'\x01' + run[0].to_bytes(4, 'big') + run[1].to_bytes(4, 'big')
+            clientSocket.sendall(ops + b'\x00' + hashlib.sha256(data).digest())
+        finally:
+            if fSize: data.close()
+
+    if recvExact(clientSocket, 1)[0] >> 5 != 0b000:
+        print('SERVER ERROR: Command was unsuccessful...')
+        return
+
+    elapsed = time.perf_counter() - start
+    print(f'{fName} has been uploaded successfully ({copied} bytes reused, {sent} bytes sent, '
+          f'{20 * count} bytes of signatures, {elapsed:.2f} s).')
+
+# streaming compressor of a codec, data compressed chunk by chunk is one compressed stream
+# Arguments:
+#  - codec: codec id, integer
+# Return:
+#  - object with compress() and flush(), None for codec 0
+def compressor(codec):
+    match codec:
+        case 0: return None
+        case 1: return zlib.compressobj(6)
+        # lowest preset, higher ones cost far more CPU for a few percent
+        case 2: return lzma.LZMACompressor(preset=1)
+
+# streaming decompressor of a codec
+# Arguments:
+#  - codec: codec id, integer
+# Return:
+#  - object with decompress(data, max_length), None for codec 0
+def decompressor(codec):
+    match codec:
+        case 0: return None
+        case 1: return zlib.decompressobj()
+        case 2: return lzma.LZMADecompressor()
+
+# decompress one chunk of a stream without letting it expand to more than CHUNK_SIZE bytes at a time
+# Arguments:
+#  - decomp: decompressor(), zlib or lzma
+#  - data: compressed chunk, bytes
+# Return:
+#  - generator of decompressed pieces, bytes
+def inflate(decomp, data):
+    while True:
+        out = decomp.decompress(data, CHUNK_SIZE)
+        if out: yield out
+        # zlib keeps the input past max_length in unconsumed_tail, lzma keeps it inside
+        if hasattr(decomp, 'unconsumed_tail'):
+            data = decomp.unconsumed_tail
+            if not data and len(out) < CHUNK_SIZE: return
+        else:
+            data = b''
+            if decomp.needs_input or decomp.eof: return
+
+# running crc of a stream, with the update() and digest() of hashlib objects
+class Crc:
+
+    # Arguments:
+    #  - fn: crc function taking the data and the crc so far, zlib.crc32 or crc32c.crc32c
+    def __init__(self, fn):
+        self.fn = fn
+        self.value = 0
+
+    def update(self, data):
+        self.value = self.fn(data, self.value)
+
+    def digest(self):
+        return self.value.to_bytes(4, 'big')
+
+# streaming digest of a PUTX/GETX chunk stream, updated with the uncompressed data of each chunk
+# Arguments:
+#  - digest: digest id, integer
+# Return:
+#  - object with update() and digest(), None for digest 0
+def digester(digest):
+    match digest:
+        case 0: return None
+        case 1: return Crc(zlib.crc32)
+        case 2: return hashlib.sha256()
+        case 3: return Crc(crc32c.crc32c)
+        case 4: return xxhash.xxh64()
+
+# client calls capsRequest() to find out which compression codecs and digests the server supports
+# Arguments:
+#  - clientSocket: connected client socket, socket class
+# Return:
+#  - set of bits set in the CAPS mask, codec ids, DIGEST_CAP + digest id - 1 and BUNDLE_CAP, empty if the
+#    server doesn't support compressed transfers
+def capsRequest(clientSocket):
+    clientSocket.sendall(((0b101 << 5) + 0b01000).to_bytes(1, 'big'))
+    if recvExact(clientSocket, 1)[0] >> 5 != 0b000:
+        return set()
+    mask = recvExact(clientSocket, 1)[0]
+    return {codec for codec in range(8) if mask & (1 << codec)}
+
+# client calls statsRequest() to get and print the server's metrics, request counts, bytes, latency
+# histograms by request type, connections and cache counters, in Prometheus text format
+# Arguments:
+#  - clientSocket: connected client socket, socket class
+def statsRequest(clientSocket):
+
+    # store opCode for extended requests, and the STATS sub-opcode
+    opCode = 0b101
+    subCode = 0b01011
+    clientSocket.sendall(((opCode << 5) + subCode).to_bytes(1, 'big'))
+
+    byte1 = recvExact(clientSocket, 1)[0]
+    # server too old to know the request
+    if byte1 >> 5 != 0b000:
+        print('SERVER ERROR: Server does not support metrics...')
+        return
+    length = int.from_bytes(recvExact(clientSocket, 4), 'big')
+    text = recvExact(clientSocket, length).decode()
+
+    # print request and response data when debug enabled
+    if DEBUG == 1:
+        print('***** STATS REQUEST *****')
+        print(f'  opCode:  0b{opCode:03b}{subCode:05b}')
+        print('***** STATS RESPONSE *****')
+        print(f'  resCode: 0b{(byte1 >> 5):03b}-----')
+        print(f'  length:  0x{length:08X}')
+
+    print(text, end='')
+
+# client calls putCompressed() to upload a file as a PUTX chunk stream, compressed with codec unless
+# a sample of its first chunk shows it doesn't compress (videos, pictures, archives), and followed by
+# a digest of the file computed while it is read, checked by the server before the file is stored
+# Arguments:
+#  - fName: file to upload, string
+#  - clientSocket: connected client socket, socket class
+#  - codec: codec id, integer
+#  - digest: digest id, integer, 0 for none
+def putCompressed(fName, clientSocket, codec, digest):
+
+    try:
+        f = open(fName, 'rb')
+    except OSError:
+        print('ERROR: Could not read file "' + fName + '"')
+        return
+
+    start = time.perf_counter()
+    with f:
+        fSize = os.fstat(f.fileno()).st_size
+        # fast zlib level 1 estimates how compressible the data is for every codec
+        sample = f.read(CHUNK_SIZE)
+        if not sample or len(zlib.compress(sample, 1)) > len(sample) * COMPRESS_THRESHOLD: codec = 0
+        f.seek(0)
+
+        # putx request: byte1 = opCode 0b101 & sub-opcode 0b01001, FL (1 byte), Filename, FS (8 bytes),
+        # codec (1 byte) with the digest in its top 4 bits
+        clientSocket.sendall(((0b101 << 5) + 0b01001).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big')
+                             + fName.encode() + fSize.to_bytes(8, 'big') + ((digest << 4) + codec).to_bytes(1, 'big'))
+
+        # then the chunk stream, each chunk hashed and compressed as it is read
+        comp = compressor(codec)
+        hasher = digester(digest)
+        wire = 0
+        while chunk := f.read(CHUNK_SIZE):
+            if hasher is not None: hasher.update(chunk)
+            data = comp.compress(chunk) if comp else chunk
+            # a compressor keeps small inputs until it has enough for a block
+            if data:
+                clientSocket.sendall(len(data).to_bytes(4, 'big') + data)
+                wire += 4 + len(data)
+        if comp and (data := comp.flush()):
+            clientSocket.sendall(len(data).to_bytes(4, 'big') + data)
+            wire += 4 + len(data)
+        clientSocket.sendall(b'\x00\x00\x00\x00' + (hasher.digest() if hasher is not None else b''))
+        wire += 4
+
+    match recvExact(clientSocket, 1)[0] >> 5:
+        case 0b000: pass
+        # the data stored would not have been the file read, the server kept its old copy
+        case 0b100:
+            print(f'SERVER ERROR: {DIGESTS[digest]} digest of {fName} does not match, the upload was discarded...')
+            return
+        case _:
+            print('SERVER ERROR: Command was unsuccessful...')
+            return
+
+    elapsed = time.perf_counter() - start
+    print(f'{fName} has been uploaded successfully ({CODECS[codec]}, {fSize} bytes, {wire} on the wire, '
+          f'ratio {fSize / wire:.2f}, {formatRate(fSize, elapsed)}' + (f', {DIGESTS[digest]} checked).' if digest else ').'))
+
+# client calls getCompressed() to download a file as a GETX chunk stream, the server compresses it
+# with codec unless a sample of the file shows it doesn't compress, and sends the digest asked for after
+# the stream, checked against the one computed while the data is received
+# the data goes to 'fName.part', renamed to fName once complete and checked
+# Arguments:
+#  - fName: file to download, string
+#  - clientSocket: connected client socket, socket class
+#  - codec: codec id, integer
+#  - digest: digest id, integer, 0 for none
+def getCompressed(fName, clientSocket, codec, digest):
+
+    start = time.perf_counter()
+    # getx request: byte1 = opCode 0b101 & sub-opcode 0b01010, FL (1 byte), Filename, codec (1 byte)
+    # with the digest in its top 4 bits
+    clientSocket.sendall(((0b101 << 5) + 0b01010).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big')
+                         + fName.encode() + ((digest << 4) + codec).to_bytes(1, 'big'))
+    if recvExact(clientSocket, 1)[0] >> 5 != 0b001:
+        print('SERVER ERROR: File not found...')
+        return
+    recvExact(clientSocket, 8)
+    codec = recvExact(clientSocket, 1)[0]
+    # the digest the server sends, 0 if it doesn't support the one asked for
+    digest = codec >> 4
+    codec &= 0x0F
+
+    # open the part file, if it can't be written the stream is still received to keep the connection in sync
+    partName = fName + '.part'
+    try:
+        if os.path.dirname(fName): os.makedirs(os.path.dirname(fName), exist_ok=True)
+        f = open(partName, 'wb')
+    except OSError:
+        f = None
+
+    decomp = decompressor(codec)
+    hasher = digester(digest)
+    raw = 0
+    wire = 0
+    err = '' if f is not None else 'Error: Could not save download file "' + fName + '"'
+    while (length := int.from_bytes(recvExact(clientSocket, 4), 'big')) > 0:
+        data = recvExact(clientSocket, length)
+        wire += 4 + length
+        if err != '': continue
+        try:
+            for piece in (inflate(decomp, data) if decomp else [data]):
+                raw += len(piece)
+                if hasher is not None: hasher.update(piece)
+                f.write(piece)
+        except Exception:
+            err = 'Error: Could not decompress download file "' + fName + '"'
+    wire += 4
+    if err == '' and decomp is not None and not decomp.eof:
+        err = 'Error: Could not decompress download file "' + fName + '"'
+    # then the digest of the data
+    if hasher is not None and recvExact(clientSocket, len(hasher.digest())) != hasher.digest() and err == '':
+        err = f'ERROR: {DIGESTS[digest]} digest of {fName} does not match, the download was discarded'
+    if f is not None:
+        f.close()
+        try:
+            if err == '': os.replace(partName, fName)
+            else: os.remove(partName)
+        except OSError:
+            err = err or 'Error: Could not save download file "' + fName + '"'
+
+    if err != '':
+        print(err)
+        return
+
+    elapsed = time.perf_counter() - start
+    print(f'{fName} has been downloaded successfully ({CODECS.get(codec, codec)}, {raw} bytes, {wire} on the wire, '
+          f'ratio {raw / wire:.2f}, {formatRate(raw, elapsed)}' + (f', {DIGESTS[digest]} checked).' if digest else ').'))
+
+# one stream of a v2 connection, a socket-like object the request functions use as if it was a connection of its own
+class MuxStream:
+
+    # Arguments:
+    #  - mux: connection the stream belongs to, MuxConnection class
+    #  - streamId: ID of the stream, integer
+    def __init__(self, mux, streamId):
+        self.mux = mux
+        self.streamId = streamId
+        self.buffer = bytearray()   # data received and not read yet
+        self.eof = False            # the server ended the stream, or the connection closed
+        self.closed = False         # this side ended the stream
+        self.cond = threading.Condition()
+
+    # add data received for the stream, called by the connection's reader thread
+    # waits while the stream is STREAM_BUFFER bytes ahead of its reader, so a slow download can't fill memory
+    def feed(self, data):
+        with self.cond:
+            while len(self.buffer) >= STREAM_BUFFER and not self.closed:
+                self.cond.wait()
+            if not self.closed: self.buffer += data
+            self.cond.notify_all()
+
+    # mark the end of the data of the stream, recv() returns empty bytes once the buffer is read
+    def finish(self):
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+
+    # receive up to n bytes, empty bytes when the stream ended
+    def recv(self, n):
+        with self.cond:
+            while not self.buffer and not self.eof:
+                self.cond.wait()
+            data = bytes(self.buffer[:n])
+            del self.buffer[:n]
+            self.cond.notify_all()
+            return data
+
+    # receive up to nbytes bytes into buf, returns the number of bytes received
+    def recv_into(self, buf, nbytes=0):
+        data = self.recv(nbytes or len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    # send all data, as frames of at most FRAME_SIZE bytes so other streams can send in between
+    def sendall(self, data):
+        view = memoryview(data)
+        for start in range(0, len(view), FRAME_SIZE):
+            self.mux.sendFrame(self.streamId, 0, view[start:start + FRAME_SIZE])
+
+    # send count bytes of file f starting at offset, read with positional reads since several
+    # streams may send ranges of the same file at the same time
+    def sendfile(self, f, offset=0, count=None):
+        sent = 0
+        while count is None or sent < count:
+            n = FRAME_SIZE if count is None else min(FRAME_SIZE, count - sent)
+            if hasattr(os, 'pread'):
+                data = os.pread(f.fileno(), n, offset + sent)
+            else:
+                with self.mux.lock:
+                    f.seek(offset + sent)
+                    data = f.read(n)
+            if not data: break
+            self.sendall(data)
+            sent += len(data)
+        return sent
+
+    # end this side of the stream
+    def close(self):
+        if self.closed: return
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.mux.sendFrame(self.streamId, 0x01, b'')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# v2 connection, streams are opened on it for each transfer, a reader thread hands received frames to their
+# stream, and a writer thread sends the frames queued by the streams, taking one frame of each stream in turn
+class MuxConnection:
+
+    # Arguments:
+    #  - sock: connected client socket, after the v2 hello, socket class
+    def __init__(self, sock):
+        self.sock = sock
+        self.streams = {}   # stream ID -> MuxStream
+        self.nextId = 1     # stream IDs are never reused, 0 is the connection itself
+        self.lock = threading.Lock()
+        self.queues = OrderedDict()     # stream ID -> frames waiting to be sent, in the order streams take turns
+        self.cond = threading.Condition()
+        self.error = None   # error that stopped the writer, raised to the streams sending after it
+        self.stopped = False
+        # keep little unsent data in the kernel, so frames of a new stream aren't queued behind megabytes of a large upload
+        if TCP_NOTSENT_LOWAT is not None: sock.setsockopt(IPPROTO_TCP, TCP_NOTSENT_LOWAT, 128 * 1024)
+        self.reader = threading.Thread(target=self.readFrames, daemon=True)
+        self.reader.start()
+        self.writer = threading.Thread(target=self.writeFrames, daemon=True)
+        self.writer.start()
+
+    # open a new stream
+    # Return:
+    #  - stream, MuxStream class
+    def open(self):
+        with self.lock:
+            stream = MuxStream(self, self.nextId)
+            self.streams[self.nextId] = stream
+            self.nextId += 1
+        return stream
+
+    # queue one frame: stream ID (4 bytes), flags (1 byte), length (4 bytes), then payload
+    # waits while the stream already has 4 frames queued, a stream is never far ahead of the writer
+    def sendFrame(self, streamId, flags, payload):
+        frame = streamId.to_bytes(4, 'big') + flags.to_bytes(1, 'big') + len(payload).to_bytes(4, 'big') + bytes(payload)
+        with self.cond:
+            while len(self.queues.get(streamId, ())) >= 4 and self.error is None:
+                self.cond.wait()
+            if self.error is not None: raise self.error
+            self.queues.setdefault(streamId, []).append(frame)
+            self.cond.notify_all()
+
+    # writer thread, sends the first frame of the stream whose turn it is, until close() and the queues are empty
+    def writeFrames(self):
+        while True:
+            with self.cond:
+                while not self.queues and not self.stopped:
+                    self.cond.wait()
+                if not self.queues: return
+                streamId, frames = self.queues.popitem(last=False)
+                frame = frames.pop(0)
+                # the stream goes to the back of the line if it has more to send
+                if frames: self.queues[streamId] = frames
+                self.cond.notify_all()
+            try:
+                self.sock.sendall(frame)
+            except OSError as e:
+                with self.cond:
+                    self.error = e
+                    self.queues.clear()
+                    self.cond.notify_all()
+                return
+
+    # reader thread, hands each frame to its stream until the connection closes
+    def readFrames(self):
+        try:
+            while True:
+                header = recvExact(self.sock, 9)
+                streamId = int.from_bytes(header[:4], 'big')
+                flags = header[4]
+                length = int.from_bytes(header[5:], 'big')
+                payload = recvExact(self.sock, length) if length else b''
+
+                # FIN on stream 0, the server is shutting down
+                if streamId == 0: break
+
+                stream = self.streams.get(streamId)
+                if stream is None: continue
+                if payload: stream.feed(payload)
+                # the server ended the stream, it is done once this side ended it too
+                if flags & 0x01:
+                    stream.finish()
+                    with self.lock:
+                        del self.streams[streamId]
+        except OSError:
+            pass
+        # every stream still open sees the end of its data
+        for stream in list(self.streams.values()):
+            stream.finish()
+
+    # close the connection, once the streams are done
+    def close(self):
+        try:
+            self.sendFrame(0, 0x01, b'')
+        except OSError:
+            pass
+        # send what is queued, then wait for the server to close its side
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.writer.join(TIMEOUT)
+        self.reader.join(TIMEOUT)
+        self.sock.close()
+
+# client calls helloRequest() to ask the server for protocol v2, servers that only know v1 answer
+# with 'Unknown Request' and the connection stays on v1
+# Arguments:
+#  - clientSocket: connected client socket, socket class
+# Return:
+#  - protocol version used by the server, integer
+def helloRequest(clientSocket):
+    clientSocket.sendall(((0b110 << 5) + 2).to_bytes(1, 'big'))
+    byte1 = recvExact(clientSocket, 1)[0]
+    return byte1 & 0x1F if byte1 >> 5 == 0b110 else 1
+
+# client calls openConnection() to get a connection for a parallel transfer, a new stream of the
+# v2 connection if there is one, else a new TCP connection
+# Arguments:
+#  - address: (host, port) of the server, tuple
+# Return:
+#  - socket-like object to send requests on, to be closed when done
+def openConnection(address):
+    if MUX is not None:
+        return MUX.open()
+    return create_connection(address, timeout=TIMEOUT)
+
+# client calls concurrentServer() to find if the server answers other connections while this one is open,
+# a server serving one client at a time ('-e blocking', the default) only accepts them once this client says
+# bye, parallel transfers would wait TIMEOUT seconds and fail. The answer is kept for the session
+# Arguments:
+#  - address: (host, port) of the server, tuple
+# Return:
+#  - True if a HELP request on a new connection was answered within PROBE_TIMEOUT seconds, or with protocol v2
+def concurrentServer(address):
+    if MUX is not None:
+        return True
+    if address not in _concurrent:
+        try:
+            with create_connection(address, timeout=PROBE_TIMEOUT) as sock:
+                sock.sendall((0b011 << 5).to_bytes(1, 'big'))
+                recvExact(sock, recvExact(sock, 1)[0] & 0x1F)
+                sock.sendall((0b100 << 5).to_bytes(1, 'big'))
+            _concurrent[address] = True
+        except OSError:
+            _concurrent[address] = False
+    return _concurrent[address]
+
+# answers of concurrentServer(), by address
+_concurrent = {}
+
+# client calls buildRequest() to create the request for a command, does not send yet
+# Arguments:
+#  - args: list of arguments (strings) already checked by inputErrors(), command name is index=0
+# Return:
+#  - '': empty request if there was an error, nothing to send
+#  - request bytes to send to the server
+def buildRequest(args):
+
+    # try to match command in args[0] and make request with error-free inputs
+    match args[0]:
+
+        # found bye command, send opcode 0b100
+        ### NOT SPECIFIED, chose unused '0b100' code for 'bye' command ###
+        case 'bye': return (0b100 << 5).to_bytes(1, 'big')
+
+        # found help command, send opcode 0b011
+        case 'help': return (0b011 << 5).to_bytes(1, 'big')
+
+        # found put command, create request with the validated input arguments
+        case 'put': return putRequest(args[1])
+
+        # found get command, create request with the validated input arguments
+        case 'get': return getRequest(args[1])
+
+        # found change command, create request with the validated input arguments
+        case 'change': return changeRequest(args[1], args[2])
+
+        # command not recognized
+        case _: return (0b111 << 5).to_bytes(1, 'big')
+
+# client calls handleResponse() to receive and handle the server's response to one command
+# Arguments:
+#  - args: list of arguments (strings) of the command the response is for
+#  - clientSocket: client socket to receive data, socket class
+#  - byte1: first byte of the response if already received, integer value
+def handleResponse(args, clientSocket, byte1=None):
+
+    # get 1-byte response from server, convert byte to integer
+    if byte1 is None: byte1 = int.from_bytes(recvExact(clientSocket, 1), 'big')
+
+    # print if debug enabled
+    if DEBUG:
+        print('***** SERVER RESPONSE *****')
+        print(f'  resCode: 0b{(byte1 >> 5):03b}')
+
+    # get byte1 opcode in top 3 bits and match
+    match byte1 >> 5:
+
+        # successfull put and change commands server response
+        case 0b000:
+            # if this was put command, print the uploaded filename
+            if args[0] == 'put': print(args[1] + ' has been uploaded successfully.')
+            # if this was change command, print old name and new name
+            elif args[0] == 'change': print(args[1] + ' has been renamed to ' + args[2] + ' successfully.')
+
+        # get response from server, need to further receive data in getResponse()
+        case 0b001: getResponse(byte1, clientSocket)
+
+        # server GET error response, file not found
+        case 0b010: print('SERVER ERROR: File not found...')
+
+        # server unknown request ERROR
+        case 0b011: print("SERVER ERROR: Unknown request... Try 'help' to see commands supported by server.")
+
+        # server CHANGE/PUT error response, unsuccessfull change
+        case 0b101: print('SERVER ERROR: Command was unsuccessful...')
+
+        # help response from server, need to further receive help data in helpResponse()
+        case 0b110: helpResponse(byte1, clientSocket)
+
+# client calls batchCommands() to read the commands of a batch and build their requests
+# Arguments:
+#  - lines: commands to run, iterable of strings, stops at 'bye' or at the end
+# Return:
+#  - generator of (args, request), for the commands that are valid and can be sent
+def batchCommands(lines):
+    for line in lines:
+        args = line.strip().split(' ')
+        # skip blank lines and comments
+        if args[0] == '' or args[0].startswith('#'): continue
+        # same input validation as in interactive mode
+        if inputErrors(args): continue
+        if args[0] == 'bye': break
+        # recursive, multi-stream, resume and delta commands need several round trips, they can't be pipelined
+        if args[0] in ('put', 'get') and args[1] in ('-r', '-n', '-c', '-d'):
+            print("ERROR: '" + args[0] + ' ' + args[1] + "' is not supported in batch mode")
+            continue
+        if args[0] in ('stats', 'ls', 'stat'):
+            print("ERROR: '" + args[0] + "' is not supported in batch mode")
+            continue
+
+        request = buildRequest(args)
+        # only PUT command may fail at this point, if the file cannot be read
+        if request == '': continue
+        yield args, request
+
+# client calls runBatch() to run commands without waiting for each response before sending the next request
+# a sender thread keeps up to 'window' requests in flight, while this thread handles the responses,
+# which the server always sends in the same order as the requests
+# Arguments:
+#  - clientSocket: connected client socket, socket class
+#  - lines: commands to run, iterable of strings, stops at 'bye' or at the end
+#  - window: max requests sent ahead of their responses, integer
+# Return:
+#  - number of commands that got a response
+def runBatch(clientSocket, lines, window):
+
+    # args of the requests sent, in order, None once there is nothing more to send
+    pending = queue.Queue()
+    # one slot per request in flight
+    slots = threading.Semaphore(window)
+
+    # send the requests, ahead of the responses
+    def sender():
+        try:
+            for args, request in batchCommands(lines):
+                slots.acquire()
+                # queue the args before sending, so the response is never read before they're known
+                pending.put(args)
+                clientSocket.sendall(request)
+        finally:
+            pending.put(None)
+
+    threading.Thread(target=sender, daemon=True).start()
+
+    # handle the responses in the order the requests were sent
+    count = 0
+    while (args := pending.get()) is not None:
+        handleResponse(args, clientSocket)
+        slots.release()
+        count += 1
+
+    return count
+
+# client calls runMuxBatch() to run the commands of a batch on their own streams of the v2 connection,
+# up to 'window' at a time, a response is handled as soon as it arrives, a big GET doesn't hold up
+# the small requests sent after it
+# Arguments:
+#  - lines: commands to run, iterable of strings, stops at 'bye' or at the end
+#  - window: max commands running at the same time, integer
+# Return:
+#  - number of commands that got a response
+def runMuxBatch(lines, window):
+
+    slots = threading.Semaphore(window)
+    count = 0
+    countLock = threading.Lock()
+
+    def run(args, request):
+        nonlocal count
+        try:
+            with MUX.open() as stream:
+                stream.sendall(request)
+                handleResponse(args, stream)
+            with countLock: count += 1
+        except OSError as e:
+            print(f'ERROR: {" ".join(args)} failed: {e}')
+        finally:
+            slots.release()
+
+    threads = []
+    for args, request in batchCommands(lines):
+        slots.acquire()
+        threads = [t for t in threads if t.is_alive()]
+        threads.append(threading.Thread(target=run, args=(args, request)))
+        threads[-1].start()
+    for t in threads: t.join()
+
+    return count
+
+############################## LIBRARY ##############################
+
+# the same requests as the commands above, for other scripts importing this one as a module:
+#
+#   from client import FileTransferClient
+#   with FileTransferClient('192.168.2.22', 2222) as ftc:
+#       with open('test.txt', 'rb') as f: ftc.put('test.txt', f)
+#       data = ftc.get('test.txt')
+#
+# nothing is printed or written to disk, results are returned and errors raised
+
+# error answered by the server to a request, ex: an upload that could not be stored, or a request
+# the server doesn't support
+class TransferError(Exception):
+    pass
+
+# connection errors after which a request is sent again on a new connection
+RETRY_ERRORS = (ConnectionError, TimeoutError, asyncio.TimeoutError, asyncio.IncompleteReadError)
+
+# encode a file name for a request, names of legacy requests fit in the 5 bits of FL
+# Arguments:
+#  - fName: filename, string
+#  - maxLen: max length of the encoded name, integer
+# Return:
+#  - encoded name, bytes
+# Raises:
+#  - ValueError if the name is empty or too long
+def encodeName(fName, maxLen=255):
+    name = fName.encode()
+    if not 0 < len(name) <= maxLen:
+        raise ValueError(f'file name must be 1 to {maxLen} bytes: {fName!r}')
+    return name
+
+# number of bytes a put will send, when it can be known before sending them
+# Arguments:
+#  - source: bytes-like, file object or iterator of bytes
+# Return:
+#  - size from the current position of a file, None for iterators and files that can't seek (pipes)
+def sourceSize(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+    try:
+        if hasattr(source, 'read') and source.seekable():
+            position = source.tell()
+            size = source.seek(0, os.SEEK_END) - position
+            source.seek(position)
+            return size
+    except (OSError, ValueError):
+        pass
+    return None
+
+# chunks of at most CHUNK_SIZE bytes read from a put source as they are sent
+# Arguments:
+#  - source: bytes-like, file object or iterator of bytes
+#  - size: bytes to read from a file object, None to read it to the end
+# Return:
+#  - generator of chunks, bytes-like, empty chunks are skipped
+def sourceChunks(source, size=None):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source).cast('B')
+        for i in range(0, len(view), CHUNK_SIZE):
+            yield view[i:i + CHUNK_SIZE]
+    elif hasattr(source, 'read'):
+        while size is None or size > 0:
+            chunk = source.read(CHUNK_SIZE if size is None else min(CHUNK_SIZE, size))
+            if not chunk: return
+            if size is not None: size -= len(chunk)
+            yield chunk
+    else:
+        for chunk in source:
+            if chunk: yield chunk
+
+# header of the upload of a put source, a PUT when its size is known and fits the legacy request,
+# else a PUTX chunk stream (the size of a PUTX is informational, the stream decides)
+# Arguments:
+#  - fName: filename on the server, string
+#  - size: bytes to send, None if unknown
+# Return:
+#  - (header, chunked): request header, bytes, and True if the data is sent as a chunk stream
+def putHeader(fName, size):
+    name = encodeName(fName)
+    if size is not None and len(name) <= 31 and size <= 0xFFFFFFFF:
+        return (0b000 << 5 | len(name)).to_bytes(1, 'big') + name + size.to_bytes(4, 'big'), False
+    return ((0b101 << 5) + 0b01001).to_bytes(1, 'big') + len(name).to_bytes(1, 'big') + name + (size or 0).to_bytes(8, 'big') + b'\x00', True
+
+# header of a download, a GET when the name fits the legacy request, else an uncompressed GETX
+# Arguments:
+#  - fName: filename on the server, string
+# Return:
+#  - (header, chunked): request header, bytes, and True if the data comes back as a chunk stream
+def getHeader(fName):
+    name = encodeName(fName)
+    if len(name) <= 31:
+        return (0b001 << 5 | len(name)).to_bytes(1, 'big') + name, False
+    return ((0b101 << 5) + 0b01010).to_bytes(1, 'big') + len(name).to_bytes(1, 'big') + name + b'\x00', True
+
+# error for a response code other than the one expected
+# Arguments:
+#  - resCode: response code received, integer
+#  - what: request and filename, for the message, string
+# Return:
+#  - FileNotFoundError or TransferError, to raise
+def responseError(resCode, what):
+    match resCode:
+        case 0b010: return FileNotFoundError(f'{what}: file not found on the server')
+        case 0b011: return TransferError(f'{what}: request not supported by the server')
+        case _: return TransferError(f'{what}: request was unsuccessful')
+
+# client with a pool of persistent connections to a server, safe to share between threads
+# a request that fails on a connection error is sent again on a new connection, up to retries times,
+# when it can be: uploads from bytes or seekable files, downloads into bytes or seekable files,
+# iterators only if nothing was read from them yet. CHANGE is not sent twice.
+class FileTransferClient:
+
+    # Arguments:
+    #  - host: IP address or name of the server, string
+    #  - port: port number of the server, integer
+    #  - poolSize: max connections open at once, requests wait for a free one, integer
+    #  - timeout: seconds to connect, and to wait for each send/receive, float
+    #  - retries: times a request is sent again after a connection error, integer
+    #  - backoff: seconds before the first retry, doubled for each next one, float
+    def __init__(self, host, port, poolSize=4, timeout=TIMEOUT, retries=2, backoff=0.1):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.idle = []      # connections ready for a request, the last used is reused first
+        self.slots = threading.BoundedSemaphore(poolSize)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # close the idle connections, connections in use are closed when their request completes
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for sock in idle:
+            sock.close()
+
+    # take an idle connection, or open a new one, waiting while poolSize connections are in use
+    # Return:
+    #  - (sock, reused): connected socket, and True if it already served requests
+    def acquire(self):
+        self.slots.acquire()
+        with self.lock:
+            if self.closed:
+                self.slots.release()
+                raise ValueError('client is closed')
+            if self.idle: return self.idle.pop(), True
+        try:
+            sock = create_connection(self.address, timeout=self.timeout)
+            sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        except BaseException:
+            self.slots.release()
+            raise
+        return sock, False
+
+    # give a connection back to the pool after a request
+    # Arguments:
+    #  - sock: connection from acquire()
+    #  - ok: False if the request did not complete, the connection may be out of sync and is closed
+    def release(self, sock, ok):
+        with self.lock:
+            if ok and not self.closed:
+                self.idle.append(sock)
+                sock = None
+        if sock is not None: sock.close()
+        self.slots.release()
+
+    # run a request on a pooled connection, and send it again on connection errors
+    # an idle connection the server closed (restart, worker drained) is replaced without counting as a retry
+    # Arguments:
+    #  - request: function(sock) sending the request and returning its result
+    #  - rewind: function() making the request ready to be sent again, False if it can't be
+    #  - keep: keep the connection, for a response read later by the caller
+    # Return:
+    #  - result of request, (sock, result) with keep, sock to be given back with release()
+    def call(self, request, rewind=None, keep=False):
+        attempt = 0
+        while True:
+            sock = None
+            reused = False
+            try:
+                sock, reused = self.acquire()
+                result = request(sock)
+            except RETRY_ERRORS:
+                # a refused connection is retried as well, the server may be restarting
+                if sock is not None: self.release(sock, False)
+                if reused:
+                    # the other idle connections are likely closed too
+                    with self.lock: idle, self.idle = self.idle, []
+                    for s in idle: s.close()
+                elif attempt >= self.retries:
+                    raise
+                if rewind is not None and not rewind(): raise
+                if not reused:
+                    time.sleep(self.backoff * 2 ** attempt)
+                    attempt += 1
+                continue
+            except BaseException:
+                if sock is not None: self.release(sock, False)
+                raise
+            if keep: return sock, result
+            self.release(sock, True)
+            return result
+
+    # upload data to a file on the server, replacing it if it exists
+    # Arguments:
+    #  - fName: filename on the server, string
+    #  - source: bytes-like, binary file object (read from its current position) or iterator of bytes
+    # Return:
+    #  - number of bytes uploaded
+    # Raises:
+    #  - TransferError if the server could not store the file, or a file ended before its size
+    def put(self, fName, source):
+        size = sourceSize(source)
+        header, chunked = putHeader(fName, size)
+        start = source.tell() if size is not None and hasattr(source, 'read') else None
+        read = False    # data was taken from an iterator, it can't be sent again
+
+        def request(sock):
+            nonlocal read
+            sock.sendall(header)
+            sent = 0
+            for chunk in sourceChunks(source, size):
+                read = True
+                sock.sendall(len(chunk).to_bytes(4, 'big') + chunk if chunked else chunk)
+                sent += len(chunk)
+            if chunked: sock.sendall(b'\x00\x00\x00\x00')
+            # the server is still waiting for the rest of a PUT, the connection can't be used again
+            elif sent != size: raise TransferError(f'put {fName}: source ended after {sent} of {size} bytes')
+            resCode = recvExact(sock, 1)[0] >> 5
+            if resCode != 0b000: raise responseError(resCode, 'put ' + fName)
+            return sent
+
+        def rewind():
+            if start is not None: source.seek(start)
+            return start is not None or isinstance(source, (bytes, bytearray, memoryview)) or not read
+
+        return self.call(request, rewind)
+
+    # receive the header of a download
+    # Return:
+    #  - (size, chunked): file size, and True if the data comes as a chunk stream
+    def recvGetHeader(self, sock, fName, chunked):
+        byte1 = recvExact(sock, 1)[0]
+        if byte1 >> 5 != 0b001: raise responseError(byte1 >> 5, 'get ' + fName)
+        if chunked:
+            size = int.from_bytes(recvExact(sock, 8), 'big')
+            if recvExact(sock, 1)[0] != 0: raise TransferError(f'get {fName}: unexpected codec')
+        else:
+            recvExact(sock, byte1 & 0x1F)
+            size = int.from_bytes(recvExact(sock, 4), 'big')
+        return size, chunked
+
+    # receive the data of a download, in chunks of at most CHUNK_SIZE bytes
+    def recvGetData(self, sock, size, chunked):
+        if chunked:
+            while (length := int.from_bytes(recvExact(sock, 4), 'big')) > 0:
+                yield recvExact(sock, length)
+            return
+        while size > 0:
+            chunk = sock.recv(min(CHUNK_SIZE, size))
+            if not chunk: raise ConnectionError('connection closed by server')
+            size -= len(chunk)
+            yield chunk
+
+    # download a file from the server
+    # Arguments:
+    #  - fName: filename on the server, string
+    #  - sink: binary file object the data is written to, None to return the data
+    # Return:
+    #  - data of the file, bytes, or the number of bytes written to sink
+    # Raises:
+    #  - FileNotFoundError if the server has no such file
+    def get(self, fName, sink=None):
+        header, chunked = getHeader(fName)
+        out = sink if sink is not None else bytearray()
+        start = out.tell() if sink is not None and hasattr(sink, 'seekable') and sink.seekable() else None
+        written = 0
+
+        def request(sock):
+            nonlocal written
+            sock.sendall(header)
+            for chunk in self.recvGetData(sock, *self.recvGetHeader(sock, fName, chunked)):
+                if sink is None: out.extend(chunk)
+                else: out.write(chunk)
+                written += len(chunk)
+            return written
+
+        def rewind():
+            nonlocal written
+            if sink is None: del out[:]
+            elif start is not None: out.seek(start); out.truncate()
+            elif written: return False
+            written = 0
+            return True
+
+        n = self.call(request, rewind)
+        return bytes(out) if sink is None else n
+
+    # download a file from the server as it is received, the connection is held until the last chunk
+    # is read, or given up if the generator is closed before
+    # Arguments:
+    #  - fName: filename on the server, string
+    # Return:
+    #  - generator of chunks of the file, bytes, a connection error after the first chunk is raised
+    # Raises:
+    #  - FileNotFoundError if the server has no such file
+    def stream(self, fName):
+        header, chunked = getHeader(fName)
+
+        def request(sock):
+            sock.sendall(header)
+            return self.recvGetHeader(sock, fName, chunked)
+
+        sock, (size, chunked) = self.call(request, keep=True)
+        ok = False
+        try:
+            yield from self.recvGetData(sock, size, chunked)
+            ok = True
+        finally:
+            self.release(sock, ok)
+
+    # rename a file on the server, not sent again after a connection error as it may have been done
+    # Arguments:
+    #  - oldName: current filename, string
+    #  - newName: new filename, string
+    # Raises:
+    #  - TransferError if the file could not be renamed
+    def change(self, oldName, newName):
+        old = encodeName(oldName, 31)
+        new = encodeName(newName)
+
+        def request(sock):
+            sock.sendall((0b010 << 5 | len(old)).to_bytes(1, 'big') + old + len(new).to_bytes(1, 'big') + new)
+            resCode = recvExact(sock, 1)[0] >> 5
+            if resCode != 0b000: raise responseError(resCode, f'change {oldName} {newName}')
+
+        self.call(request, lambda: False)
+
+    # list the files stored on the server, one LIST PAGE request per LIST_PAGE files
+    # Arguments:
+    #  - prefix: only files whose name starts with prefix are listed, string
+    # Return:
+    #  - list of (name, size, mtime in ns), sorted by name
+    def list(self, prefix=''):
+        encodeName(prefix or ' ')
+
+        def request(sock):
+            entries = []
+            after = ''
+            while True:
+                sock.sendall(listPageRequest(prefix, after, LIST_PAGE))
+                resCode = recvExact(sock, 1)[0] >> 5
+                if resCode != 0b000: raise responseError(resCode, 'list ' + prefix)
+                count = int.from_bytes(recvExact(sock, 4), 'big')
+                more = recvExact(sock, 1)[0]
+                for _ in range(count):
+                    after = recvExact(sock, recvExact(sock, 1)[0]).decode()
+                    entry = recvExact(sock, 16)
+                    entries.append((after, int.from_bytes(entry[:8], 'big'), int.from_bytes(entry[8:], 'big')))
+                if not more: return entries
+
+        return self.call(request)
+
+    # size, modification time and sha256 of a file on the server
+    # Arguments:
+    #  - fName: filename on the server, string
+    # Return:
+    #  - (size, mtime in ns, sha256 in hex or None if the server doesn't know it)
+    # Raises:
+    #  - FileNotFoundError if the server has no such file
+    def stat(self, fName):
+        name = encodeName(fName)
+
+        def request(sock):
+            sock.sendall(((0b101 << 5) + 0b01101).to_bytes(1, 'big') + len(name).to_bytes(1, 'big') + name)
+            resCode = recvExact(sock, 1)[0] >> 5
+            if resCode != 0b000: raise responseError(resCode, 'stat ' + fName)
+            entry = recvExact(sock, 17)
+            sha = recvExact(sock, 32).hex() if entry[16] else None
+            return int.from_bytes(entry[:8], 'big'), int.from_bytes(entry[8:16], 'big'), sha
+
+        return self.call(request)
+
+    # commands supported by the server, as sent in its HELP response
+    # Return:
+    #  - string
+    def help(self):
+        def request(sock):
+            sock.sendall((0b011 << 5).to_bytes(1, 'big'))
+            byte1 = recvExact(sock, 1)[0]
+            if byte1 >> 5 != 0b110: raise responseError(byte1 >> 5, 'help')
+            return recvExact(sock, byte1 & 0x1F).decode()
+
+        return self.call(request)
+
+    # the server's metrics in Prometheus text format, for the worker serving the connection
+    # Return:
+    #  - string
+    def stats(self):
+        def request(sock):
+            sock.sendall(((0b101 << 5) + 0b01011).to_bytes(1, 'big'))
+            resCode = recvExact(sock, 1)[0] >> 5
+            if resCode != 0b000: raise responseError(resCode, 'stats')
+            return recvExact(sock, int.from_bytes(recvExact(sock, 4), 'big')).decode()
+
+        return self.call(request)
+
+# one connection of AsyncFileTransferClient, reads and writes with the client's timeout
+class AsyncConnection:
+
+    # Arguments:
+    #  - reader, writer: asyncio streams of the connection
+    #  - timeout: seconds to wait for each send/receive, float
+    def __init__(self, reader, writer, timeout):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+
+    async def sendall(self, data):
+        self.writer.write(data)
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+    async def recvExact(self, n):
+        return await asyncio.wait_for(self.reader.readexactly(n), self.timeout)
+
+    async def recv(self, n):
+        chunk = await asyncio.wait_for(self.reader.read(n), self.timeout)
+        if not chunk: raise ConnectionError('connection closed by server')
+        return chunk
+
+    def close(self):
+        self.writer.close()
+
+# chunks of a put source for AsyncFileTransferClient, async iterators and files with a coroutine
+# read() are read without blocking, the others as in sourceChunks()
+# Arguments:
+#  - source: bytes-like, file object, iterator or async iterator of bytes
+#  - size: bytes to read from a file object with a plain read(), None to read it to the end
+# Return:
+#  - async generator of chunks, bytes-like
+async def asyncSourceChunks(source, size=None):
+    if hasattr(source, 'read') and inspect.iscoroutinefunction(source.read):
+        while chunk := await source.read(CHUNK_SIZE):
+            yield chunk
+    elif hasattr(source, '__aiter__'):
+        async for chunk in source:
+            if chunk: yield chunk
+    else:
+        for chunk in sourceChunks(source, size):
+            yield chunk
+
+# FileTransferClient for asyncio, the same requests as coroutines on a pool of asyncio streams
+# the sources of put() can also be async iterators, the sinks of get() can have a coroutine write()
+class AsyncFileTransferClient:
+
+    # Arguments: as FileTransferClient
+    def __init__(self, host, port, poolSize=4, timeout=TIMEOUT, retries=2, backoff=0.1):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.idle = []      # connections ready for a request, the last used is reused first
+        self.slots = asyncio.Semaphore(poolSize)
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # close the idle connections, connections in use are closed when their request completes
+    async def close(self):
+        self.closed = True
+        idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+    # take an idle connection, or open a new one, waiting while poolSize connections are in use
+    # Return:
+    #  - (conn, reused): AsyncConnection, and True if it already served requests
+    async def acquire(self):
+        await self.slots.acquire()
+        if self.closed:
+            self.slots.release()
+            raise ValueError('client is closed')
+        if self.idle: return self.idle.pop(), True
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(*self.address), self.timeout)
+        except BaseException:
+            self.slots.release()
+            raise
+        writer.get_extra_info('socket').setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        return AsyncConnection(reader, writer, self.timeout), False
+
+    # give a connection back to the pool, closed if the request did not complete
+    def release(self, conn, ok):
+        if ok and not self.closed: self.idle.append(conn)
+        else: conn.close()
+        self.slots.release()
+
+    # as FileTransferClient.call(), with coroutines for request and rewind
+    async def call(self, request, rewind=None, keep=False):
+        attempt = 0
+        while True:
+            conn = None
+            reused = False
+            try:
+                conn, reused = await self.acquire()
+                result = await request(conn)
+            except RETRY_ERRORS:
+                if conn is not None: self.release(conn, False)
+                if reused:
+                    # the other idle connections are likely closed too
+                    idle, self.idle = self.idle, []
+                    for c in idle: c.close()
+                elif attempt >= self.retries:
+                    raise
+                if rewind is not None and not await rewind(): raise
+                if not reused:
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+                    attempt += 1
+                continue
+            except BaseException:
+                if conn is not None: self.release(conn, False)
+                raise
+            if keep: return conn, result
+            self.release(conn, True)
+            return result
+
+    # as FileTransferClient.put()
+    async def put(self, fName, source):
+        size = None if hasattr(source, '__aiter__') or inspect.iscoroutinefunction(getattr(source, 'read', None)) else sourceSize(source)
+        header, chunked = putHeader(fName, size)
+        start = source.tell() if size is not None and hasattr(source, 'read') else None
+        read = False    # data was taken from an iterator, it can't be sent again
+
+        async def request(conn):
+            nonlocal read
+            await conn.sendall(header)
+            sent = 0
+            async for chunk in asyncSourceChunks(source, size):
+                read = True
+                await conn.sendall(len(chunk).to_bytes(4, 'big') + chunk if chunked else chunk)
+                sent += len(chunk)
+            if chunked: await conn.sendall(b'\x00\x00\x00\x00')
+            # the server is still waiting for the rest of a PUT, the connection can't be used again
+            elif sent != size: raise TransferError(f'put {fName}: source ended after {sent} of {size} bytes')
+            resCode = (await conn.recvExact(1))[0] >> 5
+            if resCode != 0b000: raise responseError(resCode, 'put ' + fName)
+            return sent
+
+        async def rewind():
+            if start is not None: source.seek(start)
+            return start is not None or isinstance(source, (bytes, bytearray, memoryview)) or not read
+
+        return await self.call(request, rewind)
+
+    # as FileTransferClient.recvGetHeader()
+    async def recvGetHeader(self, conn, fName, chunked):
+        byte1 = (await conn.recvExact(1))[0]
+        if byte1 >> 5 != 0b001: raise responseError(byte1 >> 5, 'get ' + fName)
+        if chunked:
+            size = int.from_bytes(await conn.recvExact(8), 'big')
+            if (await conn.recvExact(1))[0] != 0: raise TransferError(f'get {fName}: unexpected codec')
+        else:
+            await conn.recvExact(byte1 & 0x1F)
+            size = int.from_bytes(await conn.recvExact(4), 'big')
+        return size, chunked
+
+    # as FileTransferClient.recvGetData()
+    async def recvGetData(self, conn, size, chunked):
+        if chunked:
+            while (length := int.from_bytes(await conn.recvExact(4), 'big')) > 0:
+                yield await conn.recvExact(length)
+            return
+        while size > 0:
+            chunk = await conn.recv(min(CHUNK_SIZE, size))
+            size -= len(chunk)
+            yield chunk
+
+    # as FileTransferClient.get()
+    async def get(self, fName, sink=None):
+        header, chunked = getHeader(fName)
+        out = sink if sink is not None else bytearray()
+        start = out.tell() if sink is not None and hasattr(sink, 'seekable') and sink.seekable() else None
+        written = 0
+
+        async def request(conn):
+            nonlocal written
+            await conn.sendall(header)
+            async for chunk in self.recvGetData(conn, *await self.recvGetHeader(conn, fName, chunked)):
+                if sink is None: out.extend(chunk)
+                elif inspect.isawaitable(result := out.write(chunk)): await result
+                written += len(chunk)
+            return written
+
+        async def rewind():
+            nonlocal written
+            if sink is None: del out[:]
+            elif start is not None: out.seek(start); out.truncate()
+            elif written: return False
+            written = 0
+            return True
+
+        n = await self.call(request, rewind)
+        return bytes(out) if sink is None else n
+
+    # as FileTransferClient.stream(), an async generator
+    async def stream(self, fName):
+        header, chunked = getHeader(fName)
+
+        async def request(conn):
+            await conn.sendall(header)
+            return await self.recvGetHeader(conn, fName, chunked)
+
+        conn, (size, chunked) = await self.call(request, keep=True)
+        ok = False
+        try:
+            async for chunk in self.recvGetData(conn, size, chunked):
+                yield chunk
+            ok = True
+        finally:
+            self.release(conn, ok)
+
+    # as FileTransferClient.change()
+    async def change(self, oldName, newName):
+        old = encodeName(oldName, 31)
+        new = encodeName(newName)
+
+        async def request(conn):
+            await conn.sendall((0b010 << 5 | len(old)).to_bytes(1, 'big') + old + len(new).to_bytes(1, 'big') + new)
+            resCode = (await conn.recvExact(1))[0] >> 5
+            if resCode != 0b000: raise responseError(resCode, f'change {oldName} {newName}')
+
+        async def rewind():
+            return False
+
+        await self.call(request, rewind)
+
+    # as FileTransferClient.list()
+    async def list(self, prefix=''):
+        encodeName(prefix or ' ')
+
+        async def request(conn):
+            entries = []
+            after = ''
+            while True:
+                await conn.sendall(listPageRequest(prefix, after, LIST_PAGE))
+                resCode = (await conn.recvExact(1))[0] >> 5
+                if resCode != 0b000: raise responseError(resCode, 'list ' + prefix)
+                count = int.from_bytes(await conn.recvExact(4), 'big')
+                more = (await conn.recvExact(1))[0]
+                for _ in range(count):
+                    after = (await conn.recvExact((await conn.recvExact(1))[0])).decode()
+                    entry = await conn.recvExact(16)
+                    entries.append((after, int.from_bytes(entry[:8], 'big'), int.from_bytes(entry[8:], 'big')))
+                if not more: return entries
+
+        return await self.call(request)
+
+    # as FileTransferClient.stat()
+    async def stat(self, fName):
+        name = encodeName(fName)
+
+        async def request(conn):
+            await conn.sendall(((0b101 << 5) + 0b01101).to_bytes(1, 'big') + len(name).to_bytes(1, 'big') + name)
+            resCode = (await conn.recvExact(1))[0] >> 5
+            if resCode != 0b000: raise responseError(resCode, 'stat ' + fName)
+            entry = await conn.recvExact(17)
+            sha = (await conn.recvExact(32)).hex() if entry[16] else None
+            return int.from_bytes(entry[:8], 'big'), int.from_bytes(entry[8:16], 'big'), sha
+
+        return await self.call(request)
+
+    # as FileTransferClient.help()
+    async def help(self):
+        async def request(conn):
+            await conn.sendall((0b011 << 5).to_bytes(1, 'big'))
+            byte1 = (await conn.recvExact(1))[0]
+            if byte1 >> 5 != 0b110: raise responseError(byte1 >> 5, 'help')
+            return (await conn.recvExact(byte1 & 0x1F)).decode()
+
+        return await self.call(request)
+
+    # as FileTransferClient.stats()
+    async def stats(self):
+        async def request(conn):
+            await conn.sendall(((0b101 << 5) + 0b01011).to_bytes(1, 'big'))
+            resCode = (await conn.recvExact(1))[0] >> 5
+            if resCode != 0b000: raise responseError(resCode, 'stats')
+            return (await conn.recvExact(int.from_bytes(await conn.recvExact(4), 'big'))).decode()
+
+        return await self.call(request)
+
+############################## MAIN CODE ##############################
+
+# if this script was called directly, and not as module by another script
+if __name__ == '__main__':
+
+    # input argument parser
+    parser = argparse.ArgumentParser(description='Client for FTP socket server', epilog='Requires Python 3.10 or higher to run')
+    parser.add_argument('host', type=str, help='IP address of the server')
+    parser.add_argument('port', type=int, help='Port number on which the server is listening')
+    parser.add_argument('-d', '--debug', action='store_const', const=1, default=0, help='Debug: print everything sent/received by client')
+    parser.add_argument('-b', '--batch', metavar='FILE', help="Run the commands in FILE, one per line, without waiting for each response ('-' for stdin)")
+    parser.add_argument('-w', '--window', type=int, default=WINDOW, help=f'Batch mode: max requests sent ahead of their responses (default {WINDOW})')
+    parser.add_argument('-u', '--dedupe', action='store_true', help="Before each put, skip sending files whose content the server already has (server run with '-u')")
+    parser.add_argument('-z', '--compress', nargs='?', const='zlib', choices=[c for c in CODECS.values() if c != 'none'],
+                        help="Compress put/get data with this codec (default zlib) when the file compresses, reports ratio and throughput")
+    parser.add_argument('-s', '--digest', nargs='?', const='crc32', choices=[d for d in DIGESTS.values() if d != 'none'],
+                        help="Check put/get data with a digest (default crc32) computed while it is sent and received")
+    parser.add_argument('-m', '--mux', action='store_true', help='Use protocol v2: parallel transfers and batch commands run on streams of one connection')
+    parser.add_argument('-j', '--jobs', type=int, default=JOBS, help=f"'put -r' and 'get -r': number of parallel connections (default {JOBS})")
+    parser.add_argument('-C', '--cluster', action='store_true', help="Ask the server for the nodes of its cluster, put/get/change/stat go straight to the nodes storing the file, with failover")
+    parser.add_argument('-B', '--bundle', type=int, default=BUNDLE_FILES,
+                        help=f"'put -r' and 'get -r': max small files sent in one request, 0 for a request per file (default {BUNDLE_FILES})")
+    sysArgs = parser.parse_args()
+
+    # get input arguments
+    SERVER_HOST = sysArgs.host
+    SERVER_PORT = sysArgs.port
+    DEBUG = sysArgs.debug
+    DEDUPE = sysArgs.dedupe
+    BUNDLE_FILES = sysArgs.bundle
+
+    # create client TCP socket and connect to server
+    clientSocket = socket(AF_INET, SOCK_STREAM)
+    clientSocket.connect((SERVER_HOST, SERVER_PORT))
+    # send a request header and its data right away, Nagle's algorithm would hold the data back until
+    # the header is acknowledged
+    clientSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+    # protocol v2, the commands typed run on a stream of their own, other streams are opened for parallel transfers
+    if sysArgs.mux:
+        if helloRequest(clientSocket) >= 2:
+            MUX = MuxConnection(clientSocket)
+            clientSocket = MUX.open()
+            print('Protocol v2: transfers are multiplexed on this connection')
+        else:
+            print('Server does not support protocol v2, using v1.')
+    print('Session has been established!')
+
+    # cluster routing, the connection already open is used for the names the server owns
+    if sysArgs.cluster:
+        if MUX is not None: parser.error("--cluster can't be combined with --mux")
+        ring = ringRequest(clientSocket)
+        if ring is None:
+            print('Server is not part of a cluster, requests go to it alone.')
+        else:
+            CLUSTER = ClusterRouter(ring[1], ring[0], (f'{SERVER_HOST}:{SERVER_PORT}', clientSocket))
+            print(f'Cluster: {len(ring[1].nodes)} nodes, {ring[0]} replicas of each file')
+
+    # compression and digests need the server to support them, otherwise plain PUT/GET are used
+    supported = capsRequest(clientSocket) if sysArgs.compress is not None or sysArgs.digest is not None else set()
+    if sysArgs.compress is not None:
+        COMPRESS = {name: codec for codec, name in CODECS.items()}[sysArgs.compress]
+        if COMPRESS not in supported:
+            COMPRESS = 1 if 1 in supported else 0
+            print(f'Server does not support {sysArgs.compress} compression, ' + ('using zlib.' if COMPRESS else 'transfers are not compressed.'))
+    if sysArgs.digest is not None:
+        DIGEST = {name: digest for digest, name in DIGESTS.items()}[sysArgs.digest]
+        if DIGEST_CAP + DIGEST - 1 not in supported:
+            DIGEST = 1 if DIGEST_CAP in supported else 0
+            print(f'Server does not support {sysArgs.digest} digests, ' + ('using crc32.' if DIGEST else 'transfers are not checked.'))
+
+    # batch mode, run all commands from a file or stdin then exit
+    if sysArgs.batch is not None:
+        lines = sys.stdin if sysArgs.batch == '-' else open(sysArgs.batch)
+        start = time.perf_counter()
+        # with protocol v2 every command runs on its own stream, responses come back as they are ready
+        if MUX is not None: count = runMuxBatch(lines, max(1, sysArgs.window))
+        else: count = runBatch(clientSocket, lines, max(1, sysArgs.window))
+        print(f'{count} commands completed in {time.perf_counter() - start:.3f} s')
+        # send bye, close client socket and end script
+        clientSocket.sendall((0b100 << 5).to_bytes(1, 'big'))
+        clientSocket.close()
+        if MUX is not None: MUX.close()
+        print('client exit')
+        sys.exit(0)
+
+    # loop until exit
+    while True:
+        command = input('>> ')   # get command and arguments from user
+        args = command.split(' ')  # split input line by space char ' '
+
+        # do input validation here, keeps match cases cleaner
+        # checks number of arguments, and if filenames > 31 chars
+        if inputErrors(args):
+            # restart loop from beginning
+            continue
+
+        # recursive put/get run over their own parallel connections
+        if args[0] in ('put', 'get') and args[1] == '-r':
+            if args[0] == 'put': putTree(args[2], clientSocket, (SERVER_HOST, SERVER_PORT), sysArgs.jobs)
+            else: getTree(args[2], clientSocket, (SERVER_HOST, SERVER_PORT), sysArgs.jobs)
+            continue
+
+        # upload what changed in a directory since its last sync, once or until Ctrl+C
+        if args[0] == 'sync':
+            if not os.path.isdir(args[-1]): print('ERROR: "' + args[-1] + '" is not a directory')
+            elif args[1] == '-w': watchTree(args[2], clientSocket, (SERVER_HOST, SERVER_PORT), sysArgs.jobs)
+            else:
+                if syncTree(args[1], clientSocket, (SERVER_HOST, SERVER_PORT), sysArgs.jobs) == 0: print(args[1] + ' is up to date.')
+            continue
+
+        # resume an interrupted put/get from where it stopped
+        if args[0] in ('put', 'get') and args[1] == '-c':
+            if args[0] == 'put': putResume(args[2], clientSocket)
+            else: getResume(args[2], clientSocket)
+            continue
+
+        # server metrics, printed as received
+        if args[0] == 'stats':
+            statsRequest(clientSocket)
+            continue
+
+        # files stored on the server, and the metadata of one file
+        if args[0] == 'ls':
+            listCommand(args[1] if len(args) > 1 else '', clientSocket)
+            continue
+        if args[0] == 'stat':
+            if CLUSTER is not None: clusterCommand(args)
+            else: statRequest(args[1], clientSocket)
+            continue
+
+        # delta put sends only what changed in a file already on the server
+        if args[0] == 'put' and args[1] == '-d':
+            putDelta(args[2], clientSocket)
+            continue
+
+        # multi-stream put/get split the file over their own parallel connections
+        if args[0] in ('put', 'get') and args[1] == '-n':
+            if args[0] == 'put': putMulti(args[3], clientSocket, (SERVER_HOST, SERVER_PORT), int(args[2]))
+            else: getMulti(args[3], clientSocket, (SERVER_HOST, SERVER_PORT), int(args[2]))
+            continue
+
+        # in a cluster, put/get/change go to the nodes owning the name
+        if CLUSTER is not None and args[0] in ('put', 'get', 'change'):
+            clusterCommand(args)
+            continue
+
+        # in dedupe mode, the server may already have the content of the file to put
+        if args[0] == 'put' and DEDUPE and skipUpload(args[1], clientSocket):
+            print(args[1] + ' has been uploaded successfully (content already on server, data not sent).')
+            continue
+
+        # compressed or checked put/get, only in interactive mode
+        if args[0] in ('put', 'get') and (COMPRESS or DIGEST):
+            if args[0] == 'put': putCompressed(args[1], clientSocket, COMPRESS, DIGEST)
+            else: getCompressed(args[1], clientSocket, COMPRESS, DIGEST)
+            continue
+
+        # create the request for the command
+        request = buildRequest(args)
+
+        # only PUT command may fail at this point, if the file cannot be read
+        # continue loop from beginning
+        if request == '': continue
+
+        # send request
+        clientSocket.sendall(request)
+
+        if args[0] == 'bye':
+            # close client socket and end script
+            if CLUSTER is not None: CLUSTER.close()
+            clientSocket.close()
+            if MUX is not None: MUX.close()
+            print('client exit')
+            break
 
-            # help response from server, need to further receive help data in helpResponse()
-            case 0b110: helpResponse(byte1, clientSocket)
\ No newline at end of file
+        # receive and handle the response
+        handleResponse(args, clientSocket)
@@ -0,0 +1,106 @@
+################################################################################
+#   Filename:       migrate.py
+#
+#   Description:    Offline migration of a server directory between the storage
+#                   layouts of server.py ('--layout flat|sharded').
+#                   - Moves every stored file to its path in the new layout,
+#                     with the staging files of interrupted uploads, the
+#                     scripts of the server (server.py, migrate.py) stay
+#                   - Deletes temporary files of unfinished uploads, and the
+#                     directories left empty
+#                   - Can be run again after an interruption, it continues
+#                     with the files not moved yet
+#                   The server must be stopped while the files are moved.
+#
+#                   > py migrate.py /srv/files sharded
+#                   > py migrate.py . flat
+#
+################################################################################
+import os, sys, argparse, time
+
+from server import LAYOUTS, SHARD_DIR, SERVER_FILES, partPath, metaPath, storageLock
+
+############################## FUNCTIONS ##############################
+
+# move a file to a new path, creating the directories it needs
+# Arguments:
+#  - src: path of the file, string
+#  - dst: new path, string
+def moveFile(src, dst):
+    if os.path.dirname(dst): os.makedirs(os.path.dirname(dst), exist_ok=True)
+    os.rename(src, dst)
+
+# move the stored files of one layout to their paths in another
+# staging files of interrupted uploads ('.name.part' and '.name.part.meta') follow their name, temporary
+# files of uploads that never completed can't be resumed and are deleted
+# Arguments:
+#  - source: layout the files are stored with, FlatStorage class
+#  - target: layout to move them to, FlatStorage class
+# Return:
+#  - (moved, deleted): number of files moved, and temporary files deleted
+def migrate(source, target):
+
+    moved = 0
+    deleted = 0
+    dirs = []
+    start = time.perf_counter()
+    for dirPath, dirNames, fileNames in os.walk(source.root):
+        # the blob store and the shards are hidden, only the files of the flat layout are in the server directory
+        dirNames[:] = [d for d in dirNames if not d.startswith('.')]
+        if dirPath == '.':
+            # the scripts of the server stay next to the files, whatever the layout
+            dirNames[:] = [d for d in dirNames if d not in SERVER_FILES]
+            fileNames = [f for f in fileNames if f not in SERVER_FILES]
+        dirs.append(dirPath)
+        for fileName in fileNames:
+            path = os.path.relpath(os.path.join(dirPath, fileName), '.')
+            if not fileName.startswith('.'):
+                dst = target.path(source.name(path))
+            elif fileName.endswith('.part') or fileName.endswith('.part.meta'):
+                # staging file of the name between the leading '.' and '.part'
+                final = os.path.relpath(os.path.join(dirPath, fileName[1:fileName.rindex('.part')]), '.')
+                final = target.path(source.name(final))
+                dst = partPath(final) if fileName.endswith('.part') else metaPath(final)
+            else:
+                # the lock file and the index log stay
+                if fileName.endswith('.tmp'):
+                    os.remove(path)
+                    deleted += 1
+                continue
+            with storageLock():
+                moveFile(path, dst)
+            moved += 1
+            if moved % 100000 == 0:
+                print(f'{moved} files moved ({time.perf_counter() - start:.1f} s)')
+
+    # the directories of the old layout left empty, deepest first, the server directory itself stays
+    for dirPath in reversed(dirs):
+        if dirPath == '.': continue
+        try:
+            os.rmdir(dirPath)
+        except OSError:
+            pass
+
+    return moved, deleted
+
+############################## MAIN CODE ##############################
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Move the files of a server directory to another storage layout, with the server stopped')
+    parser.add_argument('directory', help='Server directory')
+    parser.add_argument('layout', choices=list(LAYOUTS), help='Layout to move the files to')
+    sysArgs = parser.parse_args()
+
+    # the paths of both layouts are relative to the server directory
+    os.chdir(sysArgs.directory)
+    target = LAYOUTS[sysArgs.layout]()
+    source = next(layout() for name, layout in LAYOUTS.items() if name != sysArgs.layout)
+    if source.layout == 'sharded' and not os.path.isdir(SHARD_DIR):
+        print('Nothing to migrate, no sharded files in ' + sysArgs.directory)
+        sys.exit(0)
+
+    start = time.perf_counter()
+    moved, deleted = migrate(source, target)
+    print(f'{moved} files moved from the {source.layout} layout to the {target.layout} layout in {time.perf_counter() - start:.1f} s')
+    if deleted: print(f'{deleted} temporary files of unfinished uploads deleted')
@@ -14,11 +14,1504 @@
 #                     printing of messages sent/received
 #
 ################################################################################
-from socket import socket, gethostname, gethostbyname, AF_INET, SOCK_STREAM
-import os, argparse
+from socket import socket, create_connection, gethostname, gethostbyname, AF_INET, SOCK_STREAM, SOL_SOCKET, IPPROTO_TCP, TCP_NODELAY
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from bisect import bisect_left, bisect_right, insort
+from stat import S_ISREG
+import os, sys, argparse, time, asyncio, signal, tempfile, threading, json, hashlib, math, zlib
+
+# fcntl only exists on POSIX systems, without it commits are only serialized inside one process
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# TCP_NOTSENT_LOWAT is not available on every system, v2 connections then keep the default send buffer
+try:
+    from socket import TCP_NOTSENT_LOWAT
+except ImportError:
+    TCP_NOTSENT_LOWAT = None
+
+# lzma is an optional part of the standard library, without it only zlib compression is offered
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# crc32c and xxhash are optional packages, without them PUTX/GETX digests are crc32 or sha256
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+############################## GLOBALS ##############################
+
+# defaults used when this script is imported as a module, overwritten by input arguments in MAIN CODE
+DEBUG = 0
+CHUNK_SIZE = 64 * 1024  # size of reusable receive buffer for streaming file data, in bytes
+HELP_DATA = 'get, put, change, help, bye'
+THREADS = 64            # asyncio engine: max requests handled at the same time, idle connections don't count, the others wait
+LOCK_FILE = '.sfts.lock'  # lock file serializing commits and renames between worker processes
+INDEX_LOG = '.sfts.index' # log of the changes to the file index, replayed by the other worker processes
+DRAIN_TIMEOUT = 30      # seconds a worker waits for active requests to finish when shutting down
+DEDUPE = False          # store file bodies once in a content-addressed blob store, names are hard links to them
+BLOB_DIR = '.blobs'     # directory of the blob store, blobs are named by the sha256 of their content
+SHARD_DIR = '.shards'   # sharded layout: directory of the shards holding the stored files
+SERVER_FILES = ('server.py', 'migrate.py', '__pycache__')   # the server's own scripts next to its files, not stored with the sharded layout
+CACHE_SIZE = 64 * 1024 * 1024     # max bytes of file bodies kept in memory for GETs, 0 disables the cache
+CACHE_MAX_FILE = 1024 * 1024      # files bigger than this are always sent from disk
+MUX_VERSION = 2         # highest protocol version, v2 multiplexes streams over one connection
+FRAME_SIZE = 16 * 1024  # v2: max payload of a frame, transfers on different streams interleave every FRAME_SIZE bytes
+STREAM_BUFFER = 1024 * 1024     # v2: max bytes received ahead on a stream, reading stops until its handler catches up
+MUX_STREAMS = 128       # v2: max streams served at once on one connection, each has a thread, new ones are ended right away
+LIST_PAGE_MAX = 10000   # max names in one page of a LIST PAGE response
+BUNDLE_BUFFER = 1024 * 1024     # BGET: bytes of small files gathered before they are sent
+BUNDLE_CAP = 0x80       # bit of the CAPS mask telling clients BPUT and BGET are supported
+DIGEST_CAP = 3          # bit of the CAPS mask of digest 1, digest n is bit DIGEST_CAP + n - 1
+COMPRESS_THRESHOLD = 0.9    # a GETX is compressed only if its first chunk shrinks to this share of its size
+DURABILITY = 'none'     # 'none': the OS writes uploads to disk when it wants, 'fsync': each upload is flushed before it is answered,
+                        # 'group': as 'fsync', uploads completing together share the flush of their directory
+GROUP_COMMIT_DELAY = 0.002  # group durability: seconds a directory flush waits for other uploads to join it, while others are handled
+TRACE_RATE = 10         # debug: max requests traced per second, the others are only counted, 0 traces every request
+CONN_RATE = 0           # max bytes per second sent and received on one connection, 0 for no limit
+TOTAL_RATE = 0          # max bytes per second sent and received on all connections of this process, 0 for no limit
+RATE_BURST = 0.1        # rate limits: seconds of traffic a connection idle for a while can move at once
+FAIR_QUANTUM = 16 * 1024    # total rate limit: bytes a connection is granted at each of its turns, rate limited sends are split in pieces this size
+CLUSTER = None          # HashRing of the nodes of the cluster, None when the server runs alone
+NODE = None             # cluster: 'host:port' of this server, as listed in the ring
+REPLICAS = 2            # cluster: number of nodes storing each file
+VNODES = 64             # cluster: points of each node on the hash ring, more spread the names more evenly
+PEER_TIMEOUT = 5        # cluster: seconds to wait for another node before it is considered down
+PEER_RETRY = 10         # cluster: seconds a node that did not answer is skipped before it is tried again
+
+# compression codecs of PUTX/GETX chunk streams, by the id sent in the codec byte
+CODECS = {0: 'none', 1: 'zlib'}
+if lzma is not None: CODECS[2] = 'lzma'
+
+# integrity digests of PUTX/GETX chunk streams, by the id sent in the top 4 bits of the codec byte
+DIGESTS = {0: 'none', 1: 'crc32', 2: 'sha256'}
+if crc32c is not None: DIGESTS[3] = 'crc32c'
+if xxhash is not None: DIGESTS[4] = 'xxh64'
+
+### extended requests use opCode 0b101, with a sub-opcode in the bottom 5 bits of byte1              ###
+### instead of a filename length, filenames follow as a 1-byte length then the name                  ###
+###   0b00000: LIST, names and sizes of stored files starting with a prefix                          ###
+###   0b00001: RANGE GET, offset and length (8 bytes each) of a file                                 ###
+###   0b00010: RANGE PUT, total size, offset and length (8 bytes each) then data                     ###
+###   0b00011: COMMIT, total size (8 bytes), replaces the file with its RANGE PUT data               ###
+###   0b00100: RESUME, total size (8 bytes), ranges of an upload received and their sha256           ###
+###   0b00101: HAS, sha256 (32 bytes) before the name, size (8 bytes), PUT without data              ###
+###   0b00110: SIGS, block signatures of a file, before a delta upload                               ###
+###   0b00111: DELTA, size (8 bytes), block size (4 bytes), then COPY/DATA ops and sha256            ###
+###   0b01000: CAPS, no body, mask (1 byte): bits 0-2 codecs, bits 3-6 digests, bit 7 BPUT/BGET      ###
+###   0b01001: PUTX, size (8 bytes), codec (1 byte), then chunks of length (4 bytes) and data        ###
+###   0b01010: GETX, codec wanted (1 byte), answered with size, codec used and chunks                ###
+###            chunks end with a length of 0, codecs: 0 none, 1 zlib, 2 lzma                         ###
+###            top 4 bits of the codec byte: digest 0 none, 1 crc32, 2 sha256, 3 crc32c, 4 xxh64,    ###
+###            of the uncompressed data, sent after the last chunk, resCode 0b100 on a mismatch      ###
+###   0b01011: STATS, no body, answered with length (4 bytes) and metrics in Prometheus text format  ###
+###   0b01100: LIST PAGE, prefix and name to start after, then max names (4 bytes), one page of LIST ###
+###   0b01101: STAT, size, mtime (8 bytes each) and sha256 of a file, if known                       ###
+###   0b01110: BPUT, entries of name, size (8 bytes) and data, ends with a filename length of 0      ###
+###            answered with the count (4 bytes) and a resCode (1 byte) per entry                    ###
+###   0b01111: BGET, names, ends with a filename length of 0, answered with the count (4 bytes)      ###
+###            then per name resCode 0b001, size (8 bytes) and data, or resCode 0b010                ###
+###   0b10000: REPL, between cluster nodes, kind (1 byte) and name, then for kind 0 (store)          ###
+###            size (8 bytes) and data of a replica, kind 1 deletes the name                         ###
+###   0b10001: RING, no body, replicas (1 byte), vnodes, count (2 bytes each) and cluster nodes      ###
+###                                                                                                  ###
+### opCode 0b110 is a hello, version (5 bits) asked for, answered with 0b110 and the version used    ###
+###   v2: the connection then carries frames: stream ID (4 bytes), flags (1 byte), length (4 bytes), ###
+###       then data, each stream is read and answered like a v1 connection of its own                ###
+###       flag 0x01 FIN ends a stream, FIN on stream 0 closes the connection                         ###
+
+# state of this process when shutting down gracefully, see stopWorker()
+SHUTDOWN = False        # True once a shutdown was requested, no new requests are started
+BUSY = False            # blocking engine: True while a request is being handled
+CONNECTIONS = {}        # asyncio engine: open connections, mapped to True while a request is being handled
 
 ############################## FUNCTIONS ##############################
 
+# receive exactly n bytes from a socket, looping over short reads
+# Arguments:
+#  - sock: socket to receive data from, socket class
+#  - n: number of bytes to receive, integer
+# Return:
+#  - bytes received, always of length n
+# Raises:
+#  - ConnectionError if the peer closes the connection before n bytes are received
+def recvExact(sock, n):
+
+    # collect chunks in a list, joined once at the end
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(n)
+        # empty chunk means the peer closed the connection
+        if not chunk:
+            raise ConnectionError('connection closed by peer')
+        chunks.append(chunk)
+        n -= len(chunk)
+
+    return b''.join(chunks)
+
+# stream exactly size bytes from a socket into a file, CHUNK_SIZE bytes at a time
+# the same buffer is reused for every chunk, so memory used is fixed no matter the file size
+# Arguments:
+#  - sock: socket to receive data from, socket class
+#  - f: file opened in WRITE and BINARY mode, or None to discard the data
+#  - size: number of bytes to receive, integer
+#  - hasher: hashlib object updated with every chunk received, optional
+# Return:
+#  - number of bytes received, always equal to size
+# Raises:
+#  - ConnectionError if the peer closes the connection before size bytes are received
+#  - OSError if writing to the file failed, raised only after all size bytes were received
+def recvToFile(sock, f, size, hasher=None):
+
+    # allocate the reusable buffer once, and a memoryview to slice it without copies
+    buf = bytearray(min(CHUNK_SIZE, size) or 1)
+    view = memoryview(buf)
+    remaining = size
+
+    # first error raised while writing, the rest of the data is still drained from the
+    # socket so the next request on the connection starts at the right byte
+    writeErr = None
+
+    while remaining > 0:
+        # fill as much of the buffer as is left of the file
+        n = sock.recv_into(view, min(len(buf), remaining))
+        # 0 bytes means the peer closed the connection
+        if n == 0:
+            raise ConnectionError('connection closed by peer')
+        # hash the chunk while it is in memory, so the file never has to be read back
+        if hasher is not None:
+            hasher.update(view[:n])
+        # write only the bytes received in this chunk
+        if f is not None and writeErr is None:
+            try:
+                f.write(view[:n])
+            except OSError as e:
+                writeErr = e
+        remaining -= n
+
+    # report the write failure once the whole file has been received
+    if writeErr is not None:
+        raise writeErr
+
+    return size
+
+# receive a filename sent as a 1-byte length then the name, as in extended requests
+# Arguments:
+#  - sock: socket to receive data from, socket class
+# Return:
+#  - filename, string
+def recvName(sock):
+    nameLen = int.from_bytes(recvExact(sock, 1), 'big')
+    return recvExact(sock, nameLen).decode()
+
+# file-like object writing at increasing positions of a file descriptor, so several connections
+# can each write their own range of the same file at the same time, used with recvToFile()
+class PositionalWriter:
+
+    # Arguments:
+    #  - fd: file descriptor opened for writing, integer
+    #  - offset: position of the first byte to write, integer
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
+
+    # write all of data at the current position, then move past it
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            # os.pwrite doesn't move a shared file position, on systems without it seek and write under the lock
+            if hasattr(os, 'pwrite'):
+                n = os.pwrite(self.fd, view, self.offset)
+            else:
+                with _threadLock:
+                    os.lseek(self.fd, self.offset, os.SEEK_SET)
+                    n = os.write(self.fd, view)
+            self.offset += n
+            view = view[n:]
+        return len(data)
+
+# send count bytes of a file to a socket, starting at offset
+# uses zero-copy socket.sendfile() so the data never passes through python memory,
+# falls back to a chunked send loop for socket-like objects that don't support it
+# Arguments:
+#  - sock: socket to send data to, socket class
+#  - f: file opened in READ and BINARY mode
+#  - offset: position in the file of the first byte to send, integer
+#  - count: number of bytes to send, integer
+# Return:
+#  - number of bytes sent
+def sendFile(sock, f, offset, count):
+
+    # nothing to send for an empty file
+    if count == 0:
+        return 0
+
+    # zero-copy path, socket.sendfile() itself falls back to send() where os.sendfile() is missing
+    if hasattr(sock, 'sendfile'):
+        return sock.sendfile(f, offset, count)
+
+    # chunked fallback, reads and sends CHUNK_SIZE bytes at a time
+    f.seek(offset)
+    sent = 0
+    while sent < count:
+        chunk = f.read(min(CHUNK_SIZE, count - sent))
+        # file got shorter than announced, nothing more to send
+        if not chunk:
+            break
+        sock.sendall(chunk)
+        sent += len(chunk)
+    return sent
+
+# umask of the process, read once since os.umask() can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# map a filename received from a client to the path where it is stored, with the storage layout in use
+# Arguments:
+#  - fName: filename from a request, string
+# Return:
+#  - path of the file, relative to the server directory, string
+# Raises:
+#  - ValueError if the name is empty, absolute, or has '.' / '..' or hidden components
+def storagePath(fName):
+    return STORAGE.path(fName)
+
+# flat storage layout, files are stored in the server directory under their name
+# names may contain '/' to store files in sub-directories, but can't leave the server directory
+class FlatStorage:
+
+    layout = 'flat'
+    root = '.'      # directory holding the stored files
+
+    # check a filename received from a client
+    # Arguments:
+    #  - fName: filename from a request, string
+    # Return:
+    #  - list of the components of the name, between '/'
+    # Raises:
+    #  - ValueError if the name is empty, absolute, or has '.' / '..' or hidden components
+    @staticmethod
+    def split(fName):
+        parts = fName.replace('\\', '/').split('/')
+        # hidden names are reserved for temporary files and the lock file
+        if fName.startswith('/') or any(p == '' or p.startswith('.') for p in parts):
+            raise ValueError('invalid filename: ' + fName)
+        return parts
+
+    # path where a name is stored, see storagePath()
+    def path(self, fName):
+        return os.path.join(*self.split(fName))
+
+    # name stored at a path, the reverse of path()
+    # Arguments:
+    #  - path: path of a stored file, relative to the server directory, string
+    # Return:
+    #  - name, '/' between directories like in requests, string
+    def name(self, path):
+        return path.replace(os.sep, '/')
+
+    # walk the stored files, skipping hidden files and directories
+    # Return:
+    #  - iterator of (path, os.DirEntry) of the files
+    def files(self):
+        stack = [self.root]
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.name.startswith('.'): continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        yield os.path.relpath(entry.path, '.'), entry
+
+    # rename a file, or a directory and every file under it, must be called under storageLock()
+    # Arguments:
+    #  - oldName, newName: names from a CHANGE request, strings
+    # Return:
+    #  - list of (oldPath, newPath) renamed
+    # Raises:
+    #  - OSError if the name is not stored, ValueError for an invalid name
+    def rename(self, oldName, newName):
+        oldPath, newPath = self.path(oldName), self.path(newName)
+        if os.path.dirname(newPath): os.makedirs(os.path.dirname(newPath), exist_ok=True)
+        os.rename(oldPath, newPath)
+        return [(oldPath, newPath)]
+
+    # whether the server directory holds files stored with the other layout, they would not be found
+    def foreign(self):
+        return os.path.isdir(SHARD_DIR)
+
+# sharded storage layout, files are spread over SHARD_DIR/x/y/ by the first 2 hex digits of the sha256
+# of their name, 256 directories that each hold a few thousand files when millions are stored, so no
+# directory grows too big to list or update. More directories would each hold fewer files, but every
+# create then dirties the blocks of a different directory, which was slower in bench_layout.py
+# names keep their sub-directories below the shard, the files of a directory are in different shards
+class ShardedStorage(FlatStorage):
+
+    layout = 'sharded'
+    root = SHARD_DIR
+
+    def path(self, fName):
+        parts = self.split(fName)
+        digest = hashlib.sha256('/'.join(parts).encode()).hexdigest()
+        return os.path.join(SHARD_DIR, digest[0], digest[1], *parts)
+
+    def name(self, path):
+        # SHARD_DIR and the 2 levels of shard directories come first
+        return '/'.join(path.replace(os.sep, '/').split('/')[3:])
+
+    def files(self):
+        # SHARD_DIR is created with the first file stored
+        if os.path.isdir(SHARD_DIR): yield from super().files()
+
+    def rename(self, oldName, newName):
+        # a directory is not stored as one, each file under it moves to the shard of its new name
+        if os.path.isfile(self.path(oldName)):
+            moved = [(oldName, newName)]
+        else:
+            moved = [(name, newName + name[len(oldName):]) for name in INDEX.namesUnder(oldName.rstrip('/') + '/')]
+            if not moved: raise FileNotFoundError('not stored: ' + oldName)
+        renamed = []
+        for old, new in moved:
+            renamed += super().rename(old, new)
+        return renamed
+
+    def foreign(self):
+        # the scripts of the server are in the server directory with either layout
+        with os.scandir('.') as it:
+            return any(not entry.name.startswith('.') and entry.name not in SERVER_FILES for entry in it)
+
+# storage layouts, by the name given with '--layout'
+LAYOUTS = {'flat': FlatStorage, 'sharded': ShardedStorage}
+STORAGE = FlatStorage()
+
+# lock held while files are renamed into place, so commits from several threads or
+# worker processes touching the same names are applied one after the other
+_threadLock = threading.Lock()
+
+@contextmanager
+def storageLock():
+
+    with _threadLock:
+        # no fcntl, only threads of this process are serialized
+        if fcntl is None:
+            yield
+            return
+        # flock on the shared lock file also serializes other worker processes
+        with open(LOCK_FILE, 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+# create a temporary file next to fName, to receive data before it replaces fName
+# Arguments:
+#  - fName: final filename, string
+# Return:
+#  - (f, tmpName): file opened in WRITE and BINARY mode, and its name
+def openTemp(fName):
+    # create the sub-directories of the name, if any
+    if os.path.dirname(fName): os.makedirs(os.path.dirname(fName), exist_ok=True)
+    fd, tmpName = tempfile.mkstemp(prefix='.' + os.path.basename(fName) + '.', suffix='.tmp', dir=os.path.dirname(fName) or '.')
+    # mkstemp creates the file private to the owner, give it the permissions open() would have
+    if hasattr(os, 'fchmod'): os.fchmod(fd, 0o666 & ~UMASK)
+    return os.fdopen(fd, 'wb'), tmpName
+
+# atomically replace fName with the completed temporary file tmpName
+# readers see either the old or the new file, never a partial one, and with DURABILITY 'fsync' or 'group'
+# the file is on disk when this returns, so an answered upload survives a crash
+# Arguments:
+#  - tmpName: completed temporary file, string
+#  - fName: final filename, string
+#  - sha: sha256 hex digest of the content if already known, optional
+#  - replicate: in a cluster, copy the file to the other nodes owning its name, False for a replica
+def commitFile(tmpName, fName, sha=None, replicate=True):
+
+    # hash the content before waiting for a group commit, the committer thread only flushes and renames
+    if DEDUPE: sha = sha or hashFile(tmpName)
+
+    match DURABILITY:
+        case 'none':
+            replaceFile(tmpName, fName, sha)
+        case 'fsync':
+            # the data first, a name must never point to data that could be lost, then the new name
+            fsyncPath(tmpName)
+            replaceFile(tmpName, fName, sha)
+            fsyncPath(os.path.dirname(fName) or '.')
+        case 'group':
+            COMMITTER.commit(tmpName, fName, sha)
+
+    if CLUSTER is not None and replicate: replicateFile(fName)
+
+# flush a file's data, or a directory's entries, to disk
+# Arguments:
+#  - path: file or directory, string
+def fsyncPath(path):
+    isDir = os.path.isdir(path)
+    try:
+        fd = os.open(path, os.O_RDONLY if isDir else os.O_RDWR)
+    except OSError:
+        # directories can't be opened on Windows, renames there are written with the file
+        if isDir: return
+        raise
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# group durability: each upload flushes its own data, concurrent flushes are committed together by the
+# filesystem journal, then the directory entries renamed by uploads completing at about the same time are
+# flushed with one fsync() of their directory instead of one each
+# the first upload to need a flush leads it, uploads renamed while it runs wait and are flushed by the next
+class GroupCommitter:
+
+    # Arguments:
+    #  - delay: seconds a leader waits for other uploads to join its flush, float
+    def __init__(self, delay):
+        self.delay = delay
+        self.dirs = {}      # directory -> [tickets given, tickets flushed, flush running]
+        self.cond = threading.Condition()
+
+    # rename an upload into place and wait until its directory entry is on disk
+    # Arguments:
+    #  - tmpName, fName, sha: as for commitFile()
+    def commit(self, tmpName, fName, sha):
+        fsyncPath(tmpName)
+        replaceFile(tmpName, fName, sha)
+        path = os.path.dirname(fName) or '.'
+
+        with self.cond:
+            state = self.dirs.setdefault(path, [0, 0, False])
+            state[0] += 1
+            ticket = state[0]
+            # a flush started before this rename doesn't cover it, wait for the next one or lead it
+            while state[1] < ticket:
+                if state[2]:
+                    self.cond.wait()
+                    continue
+                state[2] = True
+                self.cond.release()
+                try:
+                    # like PostgreSQL's commit_delay, only wait when other requests being handled could join
+                    if self.delay and METRICS.gauges['requests_in_flight'] > 1: time.sleep(self.delay)
+                    with self.cond:
+                        target = state[0]
+                    fsyncPath(path)
+                finally:
+                    self.cond.acquire()
+                    state[2] = False
+                    self.cond.notify_all()
+                state[1] = target
+            # forget directories nobody is waiting on, uploads spread over many directories don't add up
+            if state[1] == state[0] and not state[2] and self.dirs.get(path) is state: del self.dirs[path]
+
+COMMITTER = GroupCommitter(GROUP_COMMIT_DELAY)
+
+# replace fName with tmpName under the storage lock, the rename of commitFile()
+# in dedupe mode the content is stored once as a blob, and fName becomes a hard link to it
+# Arguments:
+#  - tmpName: completed temporary file, string
+#  - fName: final filename, string
+#  - sha: sha256 hex digest of the content, needed in dedupe mode
+def replaceFile(tmpName, fName, sha):
+
+    if DEDUPE: os.makedirs(os.path.dirname(blobPath(sha)), exist_ok=True)
+    with storageLock():
+        placeFile(tmpName, fName, sha)
+    CACHE.invalidate(fName)
+
+# the rename of replaceFile(), must be called under storageLock()
+# Arguments:
+#  - tmpName, fName, sha: as for replaceFile(), the blob directory already exists in dedupe mode
+def placeFile(tmpName, fName, sha):
+
+    if not DEDUPE:
+        os.replace(tmpName, fName)
+        INDEX.update(fName, sha)
+        return
+
+    blob = blobPath(sha)
+    if os.path.exists(blob):
+        # content already stored, the upload is not needed, link the name to the existing blob
+        os.remove(tmpName)
+        os.link(blob, tmpName)
+    else:
+        # new content, the upload becomes the blob
+        os.link(tmpName, blob)
+    os.replace(tmpName, fName)
+    # rename() does nothing when fName already links to the same blob, the temporary name is left over
+    if os.path.lexists(tmpName): os.remove(tmpName)
+    INDEX.update(fName, sha)
+
+# commit several completed temporary files, as commitFile() does for one, for the entries of a BPUT
+# the storage lock is taken once for all of them, and with DURABILITY 'fsync' or 'group' each
+# directory is flushed once after all the renames instead of once per file
+# Arguments:
+#  - items: list of (tmpName, fName, sha), sha may be None
+# Return:
+#  - list of booleans, True for the files committed, the temporary files of the others are removed
+def commitFiles(items):
+
+    durable = DURABILITY != 'none'
+    pending = []
+    done = [False] * len(items)
+    for i, (tmpName, fName, sha) in enumerate(items):
+        try:
+            if DEDUPE:
+                sha = sha or hashFile(tmpName)
+                os.makedirs(os.path.dirname(blobPath(sha)), exist_ok=True)
+            # the data first, a name must never point to data that could be lost
+            if durable: fsyncPath(tmpName)
+            pending.append((i, tmpName, fName, sha))
+        except OSError:
+            discardTemp(tmpName)
+
+    with storageLock():
+        for i, tmpName, fName, sha in pending:
+            try:
+                placeFile(tmpName, fName, sha)
+                done[i] = True
+            except OSError:
+                discardTemp(tmpName)
+
+    for i, _, fName, _ in pending:
+        CACHE.invalidate(fName)
+    # then the new names, one flush per directory
+    if durable:
+        for path in {os.path.dirname(items[i][1]) or '.' for i, *_ in pending if done[i]}:
+            fsyncPath(path)
+    if CLUSTER is not None:
+        for i, _, fName, _ in pending:
+            if done[i]: replicateFile(fName)
+    return done
+
+# sha256 of a file's content
+# Arguments:
+#  - fName: file to hash, string
+# Return:
+#  - hex digest, string
+def hashFile(fName):
+    hasher = hashlib.sha256()
+    with open(fName, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+# path of the blob storing the content with a sha256 hex digest, blobs are spread over 256 directories
+# Arguments:
+#  - sha: hex digest, string
+# Return:
+#  - path of the blob, string
+def blobPath(sha):
+    return os.path.join(BLOB_DIR, sha[:2], sha)
+
+# delete blobs no name links to anymore, their only remaining link is the blob itself
+# Return:
+#  - number of blobs deleted
+def collectBlobs():
+    deleted = 0
+    for dirPath, _, fileNames in os.walk(BLOB_DIR):
+        for fileName in fileNames:
+            blob = os.path.join(dirPath, fileName)
+            with storageLock():
+                if os.stat(blob).st_nlink == 1:
+                    os.remove(blob)
+                    deleted += 1
+    return deleted
+
+# in-memory index of the stored files, name -> (size, mtime, sha256), built once at startup and updated
+# when uploads are committed and files renamed, so LIST and STAT don't scan the server directory
+# names are kept sorted, a prefix or the page after a name is found by bisection
+# worker processes each have an index, the changes each one makes are appended to a shared log that
+# the others replay before answering, files changed outside the server are only seen by STAT
+class MetaIndex:
+
+    def __init__(self):
+        self.names = []     # stored names, sorted, '/' between directories like in requests
+        self.entries = {}   # name -> (size, mtime in ns, sha256 hex digest or None)
+        self.log = None     # path of the shared log of changes, None in a single process
+        self.logOffset = 0  # bytes of the log already replayed
+        self.lock = threading.Lock()
+
+    # scan the stored files of the storage layout, skipping hidden files and directories
+    # in dedupe mode the sha256 of a file is the name of the blob it links to
+    # Return:
+    #  - number of files indexed
+    def build(self):
+        blobs = {}
+        for dirPath, _, fileNames in os.walk(BLOB_DIR):
+            for fileName in fileNames:
+                blobs[os.stat(os.path.join(dirPath, fileName)).st_ino] = fileName
+        entries = {}
+        for path, entry in STORAGE.files():
+            st = entry.stat()
+            entries[STORAGE.name(path)] = (st.st_size, st.st_mtime_ns, blobs.get(st.st_ino))
+        with self.lock:
+            self.entries = entries
+            self.names = sorted(entries)
+        return len(entries)
+
+    # share changes with other worker processes through a log, emptied since the index was just built
+    # Arguments:
+    #  - path: path of the log, string
+    def share(self, path):
+        open(path, 'w').close()
+        self.log = path
+        self.logOffset = 0
+
+    # record a file stored or replaced, must be called under storageLock() right after the change
+    # Arguments:
+    #  - path: path of the file, string
+    #  - sha: sha256 hex digest of its content if known, optional
+    def update(self, path, sha=None):
+        st = os.stat(path)
+        self._record(['put', STORAGE.name(path), st.st_size, st.st_mtime_ns, sha])
+
+    # record a file or directory renamed, must be called under storageLock() right after the change
+    # Arguments:
+    #  - oldPath, newPath: paths before and after, strings
+    def rename(self, oldPath, newPath):
+        self._record(['rename', STORAGE.name(oldPath), STORAGE.name(newPath)])
+
+    # record a file deleted, must be called under storageLock() right after the change
+    # Arguments:
+    #  - path: path of the file, string
+    def remove(self, path):
+        self._record(['delete', STORAGE.name(path)])
+
+    # names under a directory, must be called under storageLock(), the changes of other worker processes
+    # are replayed first
+    # Arguments:
+    #  - prefix: directory name followed by '/', string
+    # Return:
+    #  - list of names
+    def namesUnder(self, prefix):
+        if self.log is not None: self._replay()
+        with self.lock:
+            return self.names[bisect_left(self.names, prefix):bisect_left(self.names, prefix[:-1] + '0')]
+
+    # replay the changes other worker processes appended to the log
+    def refresh(self):
+        if self.log is None: return
+        try:
+            if os.path.getsize(self.log) == self.logOffset: return
+        except OSError:
+            return
+        with storageLock():
+            self._replay()
+
+    # apply a change made by this process and append it to the log, after the changes of the other
+    # processes, must be called under storageLock() so the log is in the order the changes were made
+    def _record(self, change):
+        if self.log is not None: self._replay()
+        self._apply(change)
+        if self.log is not None:
+            with open(self.log, 'a') as f:
+                f.write(json.dumps(change) + '\n')
+                self.logOffset = f.tell()
+
+    # apply the changes appended to the log since it was last read, must be called under storageLock()
+    def _replay(self):
+        with open(self.log) as f:
+            f.seek(self.logOffset)
+            changes = f.readlines()
+            self.logOffset = f.tell()
+        for line in changes:
+            self._apply(json.loads(line))
+
+    # apply a change to the names and entries
+    # Arguments:
+    #  - change: ['put', name, size, mtime, sha], ['rename', oldName, newName] or ['delete', name]
+    def _apply(self, change):
+        with self.lock:
+            match change[0]:
+                case 'put':
+                    name = change[1]
+                    if name not in self.entries: insort(self.names, name)
+                    self.entries[name] = tuple(change[2:5])
+                case 'rename':
+                    old, new = change[1], change[2]
+                    # a directory renamed moves every name under it
+                    if old in self.entries:
+                        moved = [(old, new)]
+                    else:
+                        start = bisect_left(self.names, old + '/')
+                        end = bisect_left(self.names, old + '0')    # '0' follows '/'
+                        moved = [(name, new + name[len(old):]) for name in self.names[start:end]]
+                    for oldName, newName in moved:
+                        entry = self.entries.pop(oldName)
+                        del self.names[bisect_left(self.names, oldName)]
+                        if newName not in self.entries: insort(self.names, newName)
+                        self.entries[newName] = entry
+                case 'delete':
+                    if self.entries.pop(change[1], None) is not None:
+                        del self.names[bisect_left(self.names, change[1])]
+
+    # record the sha256 of a file hashed while it was read, must be called under storageLock(), nothing is
+    # recorded if the file was replaced or changed since it was opened
+    # Arguments:
+    #  - path: path of the file, string
+    #  - st: os.stat_result of the file when it was opened
+    #  - sha: sha256 hex digest of its content, string
+    def learn(self, path, st, sha):
+        try:
+            now = os.stat(path)
+        except OSError:
+            return
+        if (now.st_ino, now.st_size, now.st_mtime_ns) == (st.st_ino, st.st_size, st.st_mtime_ns):
+            self._record(['put', STORAGE.name(path), st.st_size, st.st_mtime_ns, sha])
+
+    # entry of one file, checked against the file itself, so a file changed outside the server is seen
+    # Arguments:
+    #  - path: path of the file, string
+    # Return:
+    #  - (size, mtime, sha256 or None), None if the file doesn't exist
+    def stat(self, path):
+        self.refresh()
+        name = STORAGE.name(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        with self.lock:
+            entry = self.entries.get(name)
+            if st is None or not S_ISREG(st.st_mode):
+                # deleted outside the server
+                if entry is not None:
+                    del self.entries[name]
+                    del self.names[bisect_left(self.names, name)]
+                return None
+            if entry is None or entry[:2] != (st.st_size, st.st_mtime_ns):
+                # created or changed outside the server, its content is not known anymore
+                if entry is None: insort(self.names, name)
+                entry = self.entries[name] = (st.st_size, st.st_mtime_ns, None)
+            return entry
+
+    # one page of the names starting with a prefix
+    # Arguments:
+    #  - prefix: names listed start with it, string
+    #  - after: names listed come after it, '' for the first page, string
+    #  - limit: max names listed, integer
+    # Return:
+    #  - (entries, more): list of (name, size, mtime), and True if names are left after the page
+    def page(self, prefix, after, limit):
+        self.refresh()
+        with self.lock:
+            i = bisect_right(self.names, after) if after > prefix else bisect_left(self.names, prefix)
+            entries = []
+            while i < len(self.names) and self.names[i].startswith(prefix):
+                if len(entries) == limit:
+                    return entries, True
+                name = self.names[i]
+                entries.append((name,) + self.entries[name][:2])
+                i += 1
+            return entries, False
+
+INDEX = MetaIndex()
+
+# name of the hidden staging file receiving the ranges of an upload before it is committed
+# Arguments:
+#  - path: path of the final file, string
+# Return:
+#  - path of the staging file, in the same directory, string
+def partPath(path):
+    return os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.part')
+
+# name of the sidecar file recording which ranges of a staging file have been received
+# Arguments:
+#  - path: path of the final file, string
+# Return:
+#  - path of the sidecar file, string
+def metaPath(path):
+    return partPath(path) + '.meta'
+
+# read the sidecar file of an upload
+# Arguments:
+#  - path: path of the final file, string
+# Return:
+#  - (total, ranges): total size of the upload, None if there is no sidecar,
+#    and sorted list of received [start, end) ranges
+def readMeta(path):
+    try:
+        with open(metaPath(path)) as f:
+            meta = json.load(f)
+        return meta['total'], meta['ranges']
+    except (OSError, ValueError, KeyError):
+        return None, []
+
+# sha256 of the bytes of a staging file in its received ranges, one after the other, the client compares
+# it with the same bytes of its file before resuming, an upload of another version of the file starts over
+# Arguments:
+#  - path: path of the final file, string
+#  - ranges: sorted list of received [start, end) ranges
+# Return:
+#  - sha256 digest, 32 bytes
+def rangesDigest(path, ranges):
+    hasher = hashlib.sha256()
+    with open(partPath(path), 'rb') as f:
+        for start, end in ranges:
+            f.seek(start)
+            while start < end:
+                chunk = f.read(min(CHUNK_SIZE, end - start))
+                if not chunk: break
+                hasher.update(chunk)
+                start += len(chunk)
+    return hasher.digest()
+
+# record that a range of an upload was received in its staging file, must be called under storageLock()
+# ranges recorded for a different total size belong to an older upload and are forgotten
+# Arguments:
+#  - path: path of the final file, string
+#  - total: total size of the upload, integer
+#  - start: position of the first byte received, integer
+#  - end: position after the last byte received, integer
+def addRange(path, total, start, end):
+
+    oldTotal, ranges = readMeta(path)
+    if oldTotal != total: ranges = []
+    if end > start: ranges.append([start, end])
+
+    # merge overlapping and adjacent ranges
+    merged = []
+    for r in sorted(ranges):
+        if merged and r[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], r[1])
+        else:
+            merged.append(list(r))
+
+    # replace the sidecar atomically, a crash leaves the old or the new one
+    tmpMeta = metaPath(path) + '.tmp'
+    with open(tmpMeta, 'w') as f:
+        json.dump({'total': total, 'ranges': merged}, f)
+    os.replace(tmpMeta, metaPath(path))
+
+# keep what was received of an interrupted PUT as a staging file, so the client can resume it
+# Arguments:
+#  - tmpName: temporary file holding the first bytes of the upload, string
+#  - path: path of the final file, string
+#  - total: total size of the upload, integer
+def keepPartial(tmpName, path, total):
+    received = os.path.getsize(tmpName)
+    with storageLock():
+        os.replace(tmpName, partPath(path))
+        # the sidecar is rewritten, the staging file now only holds this upload
+        try:
+            os.remove(metaPath(path))
+        except OSError:
+            pass
+        addRange(path, total, 0, received)
+
+# remove a temporary file left by a failed upload, ignoring errors
+# Arguments:
+#  - tmpName: temporary file, string
+def discardTemp(tmpName):
+    try:
+        os.remove(tmpName)
+    except OSError:
+        pass
+
+# consistent hash ring of the nodes of a cluster, each node is placed at VNODES points given by the sha256
+# of its address, a name is owned by the first nodes found going around the ring from the hash of the name
+# adding or removing a node only moves the names of the ring segments next to its points
+# the client builds the same ring from the RING response, so both agree on the owners of a name
+class HashRing:
+
+    # Arguments:
+    #  - nodes: 'host:port' of every node, list of strings
+    #  - vnodes: points of each node on the ring, integer
+    def __init__(self, nodes, vnodes):
+        self.nodes = list(nodes)
+        self.vnodes = vnodes
+        self.points = sorted((self._hash(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes))
+        self.keys = [key for key, _ in self.points]
+
+    @staticmethod
+    def _hash(text):
+        return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], 'big')
+
+    # nodes storing a name, the first one is the one clients ask first
+    # Arguments:
+    #  - name: filename, '/' between directories, string
+    #  - r: number of owners, integer
+    # Return:
+    #  - list of 'host:port', at most r and at most the number of nodes
+    def owners(self, name, r):
+        owners = []
+        start = bisect_right(self.keys, self._hash(name))
+        for i in range(len(self.points)):
+            node = self.points[(start + i) % len(self.points)][1]
+            if node not in owners:
+                owners.append(node)
+                if len(owners) == r: break
+        return owners
+
+# connections to the other nodes of the cluster, kept open between replications
+# a node that doesn't answer is skipped for PEER_RETRY seconds, so each upload doesn't wait for it again
+class PeerPool:
+
+    def __init__(self):
+        self.idle = {}      # node -> list of connected sockets
+        self.down = {}      # node -> time.monotonic() until which it is skipped
+        self.lock = threading.Lock()
+
+    # send a request to a node and read the resCode of its response
+    # a pooled connection the node closed in the meantime is replaced by a new one once
+    # Arguments:
+    #  - node: 'host:port', string
+    #  - header: request header, bytes
+    #  - f: open file whose data follows the header, None for none
+    #  - size: bytes of f to send, integer
+    # Return:
+    #  - resCode, or None if the node could not be reached
+    def call(self, node, header, f=None, size=0):
+        with self.lock:
+            if self.down.get(node, 0) > time.monotonic(): return None
+            pooled = self.idle.get(node, [])
+            sock = pooled.pop() if pooled else None
+        for attempt in range(2):
+            try:
+                if sock is None:
+                    host, _, port = node.rpartition(':')
+                    sock = create_connection((host, int(port)), timeout=PEER_TIMEOUT)
+                    sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+                sock.sendall(header)
+                if f is not None: sendFile(sock, f, 0, size)
+                resCode = recvExact(sock, 1)[0] >> 5
+            except OSError as e:
+                if sock is not None: sock.close()
+                sock = None
+                # a new connection failed too, the node is down
+                if attempt == 1 or isinstance(e, TimeoutError):
+                    with self.lock: self.down[node] = time.monotonic() + PEER_RETRY
+                    print(f'Cluster: node {node} is not answering ({e})')
+                    return None
+                continue
+            with self.lock:
+                self.idle.setdefault(node, []).append(sock)
+            return resCode
+
+PEERS = PeerPool()
+
+# cluster: copy a stored file to a node with a REPL request, under a name
+# Arguments:
+#  - node: 'host:port', string
+#  - fName: name to store the file under, string
+#  - path: path of the stored file, string
+# Return:
+#  - True if the node stored it
+def pushFile(node, fName, path):
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return False
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        # REPL: kind 0 (store), FL (1 byte), Filename, FS (8 bytes), then data
+        header = ((0b101 << 5) + 0b10000).to_bytes(1, 'big') + (0).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big') + fName.encode() + size.to_bytes(8, 'big')
+        return PEERS.call(node, header, f, size) == 0b000
+
+# cluster: delete a name from a node with a REPL request
+# Arguments:
+#  - node: 'host:port', string
+#  - fName: name to delete, string
+# Return:
+#  - True if the node no longer stores it
+def dropFile(node, fName):
+    # REPL: kind 1 (delete), FL (1 byte), Filename
+    header = ((0b101 << 5) + 0b10000).to_bytes(1, 'big') + (1).to_bytes(1, 'big') + len(fName.encode()).to_bytes(1, 'big') + fName.encode()
+    return PEERS.call(node, header) == 0b000
+
+# delete a stored file of this node
+# Arguments:
+#  - path: path of the file, string
+def removeFile(path):
+    with storageLock():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        INDEX.remove(path)
+    CACHE.invalidate(path)
+
+# cluster: after a file is committed, copy it to the other nodes owning its name, and drop it from this node
+# if the node is not one of the owners, which happens when a client sends a request to any node of the
+# cluster instead of an owner, unless no owner could be reached
+# replicas missing while a node is down are not copied later, a GET then fails over to the other owners
+# Arguments:
+#  - path: path of the file committed, string
+def replicateFile(path):
+    fName = STORAGE.name(path)
+    owners = CLUSTER.owners(fName, REPLICAS)
+    copies = [node for node in owners if node != NODE and pushFile(node, fName, path)]
+    if len(copies) < len(owners) - (NODE in owners):
+        print(f'Cluster: {fName} stored on {len(copies) + (NODE in owners)} of {len(owners)} nodes')
+    if NODE not in owners and copies: removeFile(path)
+
+# cluster: rename a file whose new name may be owned by other nodes, it is copied to the owners of the
+# new name before the owners of the old name drop it, so a failure leaves a copy under one of the names
+# Arguments:
+#  - oldName, newName: names from a CHANGE request, strings
+# Return:
+#  - list of (oldPath, newPath) renamed on this node
+# Raises:
+#  - OSError if the file is not stored on this node, or no owner of the new name could store it
+def clusterRename(oldName, newName):
+    oldPath = storagePath(oldName)
+    # only files are spread over the nodes, a directory exists on each of them
+    if not os.path.isfile(oldPath): raise FileNotFoundError('not stored on this node: ' + oldName)
+    oldOwners = CLUSTER.owners(oldName, REPLICAS)
+    newOwners = CLUSTER.owners(newName, REPLICAS)
+
+    copies = [node for node in newOwners if node != NODE and pushFile(node, newName, oldPath)]
+    if NODE not in newOwners and not copies: raise OSError('no owner of ' + newName + ' answered')
+
+    renamed = []
+    if NODE in newOwners:
+        with storageLock():
+            renamed = STORAGE.rename(oldName, newName)
+            for pair in renamed: INDEX.rename(*pair)
+    else:
+        removeFile(oldPath)
+    for node in oldOwners:
+        if node != NODE: dropFile(node, oldName)
+    return renamed
+
+# streaming compressor of a codec, data compressed chunk by chunk is one compressed stream
+# Arguments:
+#  - codec: codec id, integer
+# Return:
+#  - object with compress() and flush(), None for codec 0
+def compressor(codec):
+    match codec:
+        case 0: return None
+        case 1: return zlib.compressobj(6)
+        # lowest preset, higher ones cost far more CPU for a few percent
+        case 2: return lzma.LZMACompressor(preset=1)
+
+# streaming decompressor of a codec
+# Arguments:
+#  - codec: codec id, integer
+# Return:
+#  - object with decompress(data, max_length), None for codec 0
+def decompressor(codec):
+    match codec:
+        case 0: return None
+        case 1: return zlib.decompressobj()
+        case 2: return lzma.LZMADecompressor()
+
+# running crc of a stream, with the update() and digest() of hashlib objects
+class Crc:
+
+    # Arguments:
+    #  - fn: crc function taking the data and the crc so far, zlib.crc32 or crc32c.crc32c
+    def __init__(self, fn):
+        self.fn = fn
+        self.value = 0
+
+    def update(self, data):
+        self.value = self.fn(data, self.value)
+
+    def digest(self):
+        return self.value.to_bytes(4, 'big')
+
+# streaming digest of a PUTX/GETX chunk stream, updated with the uncompressed data of each chunk
+# Arguments:
+#  - digest: digest id, integer
+# Return:
+#  - object with update() and digest(), None for digest 0
+def digester(digest):
+    match digest:
+        case 0: return None
+        case 1: return Crc(zlib.crc32)
+        case 2: return hashlib.sha256()
+        case 3: return Crc(crc32c.crc32c)
+        case 4: return xxhash.xxh64()
+
+# decide if a transfer is worth compressing from a sample of its data, already compressed files
+# like videos and pictures are sent as they are instead of spending CPU for nothing
+# Arguments:
+#  - sample: first chunk of the data, bytes
+#  - codec: codec asked for, integer
+# Return:
+#  - codec to use, 0 if the sample doesn't compress well enough or the codec isn't supported
+def chooseCodec(sample, codec):
+    if codec not in CODECS or codec == 0 or not sample:
+        return 0
+    # fast zlib level 1 estimates how compressible the data is for every codec
+    return codec if len(zlib.compress(sample, 1)) <= len(sample) * COMPRESS_THRESHOLD else 0
+
+# send a file as a chunk stream, each chunk a length (4 bytes) then data compressed with codec,
+# ended by a chunk of length 0
+# Arguments:
+#  - sock: socket to send data to, socket class
+#  - f: file opened in READ and BINARY mode, sent from its current position to the end
+#  - codec: codec id, integer
+#  - hasher: digester() updated with the data read from the file, optional
+# Return:
+#  - (raw, wire): bytes read from the file, and bytes sent including the lengths
+def sendChunks(sock, f, codec, hasher=None):
+    comp = compressor(codec)
+    raw = 0
+    wire = 0
+    while chunk := f.read(CHUNK_SIZE):
+        raw += len(chunk)
+        if hasher is not None: hasher.update(chunk)
+        data = comp.compress(chunk) if comp else chunk
+        # a compressor keeps small inputs until it has enough for a block
+        if data:
+            sock.sendall(len(data).to_bytes(4, 'big') + data)
+            wire += 4 + len(data)
+    if comp and (data := comp.flush()):
+        sock.sendall(len(data).to_bytes(4, 'big') + data)
+        wire += 4 + len(data)
+    sock.sendall(b'\x00\x00\x00\x00')
+    return raw, wire + 4
+
+# decompress one chunk of a stream without letting it expand to more than CHUNK_SIZE bytes at a time
+# Arguments:
+#  - decomp: decompressor(), zlib or lzma
+#  - data: compressed chunk, bytes
+# Return:
+#  - generator of decompressed pieces, bytes
+def inflate(decomp, data):
+    while True:
+        out = decomp.decompress(data, CHUNK_SIZE)
+        if out: yield out
+        # zlib keeps the input past max_length in unconsumed_tail, lzma keeps it inside
+        if hasattr(decomp, 'unconsumed_tail'):
+            data = decomp.unconsumed_tail
+            if not data and len(out) < CHUNK_SIZE: return
+        else:
+            data = b''
+            if decomp.needs_input or decomp.eof: return
+
+# receive a chunk stream sent by sendChunks() into a file, decompressing it with codec
+# Arguments:
+#  - sock: socket to receive data from, socket class
+#  - f: file opened in WRITE and BINARY mode, or None to discard the data
+#  - codec: codec id, integer
+#  - hasher: hashlib object or digester() updated with the decompressed data, optional
+# Return:
+#  - (raw, wire): bytes written to the file, and bytes received including the lengths
+# Raises:
+#  - ConnectionError if the peer closes the connection before the end of the stream
+#  - OSError if writing to the file failed, ValueError if the stream can't be decompressed,
+#    both raised only after the whole stream was received
+def recvChunks(sock, f, codec, hasher=None):
+
+    decomp = decompressor(codec)
+    raw = 0
+    wire = 0
+    # first error, the rest of the stream is still drained from the socket
+    err = None
+
+    while (length := int.from_bytes(recvExact(sock, 4), 'big')) > 0:
+        data = recvExact(sock, length)
+        wire += 4 + length
+        if err is not None: continue
+        try:
+            for piece in (inflate(decomp, data) if decomp else [data]):
+                raw += len(piece)
+                if hasher is not None: hasher.update(piece)
+                if f is not None: f.write(piece)
+        except OSError as e:
+            err = e
+        except Exception as e:
+            # zlib.error or lzma.LZMAError, corrupt compressed data
+            err = ValueError(str(e))
+
+    # a compressed stream must be complete
+    if err is None and decomp is not None and not decomp.eof:
+        err = ValueError('compressed stream truncated')
+    if err is not None:
+        raise err
+    return raw, wire + 4
+
+# block size of the signatures of a file for delta uploads, about the square root of its size
+# so both the number of signatures and the data resent around a change stay small
+# Arguments:
+#  - size: size of the file, integer
+# Return:
+#  - block size in bytes, a power of 2 between 1 KB and 128 KB
+def deltaBlockSize(size):
+    return min(128 * 1024, max(1024, 1 << max(0, math.isqrt(size).bit_length() - 1)))
+
+# signatures of the blocks of a file, the last block is left out if it is shorter than blockSize
+# Arguments:
+#  - f: file opened in READ and BINARY mode
+#  - blockSize: size of the blocks, integer
+# Return:
+#  - generator of 20-byte signatures, a weak adler32 checksum (4 bytes) that can be rolled one byte at
+#    a time by the client, then a strong 16-byte blake2b digest to confirm a match
+def blockSignatures(f, blockSize):
+    while len(block := f.read(blockSize)) == blockSize:
+        yield zlib.adler32(block).to_bytes(4, 'big') + hashlib.blake2b(block, digest_size=16).digest()
+
+# size-bounded LRU cache of small file bodies, so the same files fetched again and again by many
+# clients are sent from memory instead of being opened and read each time
+# entries are checked against the file's inode, size and mtime, so a file changed by another
+# worker process or outside the server is never served stale
+class FileCache:
+
+    # Arguments:
+    #  - maxBytes: max total size of the cached bodies, integer, 0 disables the cache
+    #  - maxFile: max size of one cached body, integer
+    def __init__(self, maxBytes, maxFile):
+        self.maxBytes = maxBytes
+        self.maxFile = maxFile
+        self.entries = OrderedDict()    # path -> ((inode, size, mtime), body), least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    # identity of a version of a file
+    @staticmethod
+    def _key(st):
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    # body of a file if it is cached and unchanged
+    # Arguments:
+    #  - path: path of the file, string
+    # Return:
+    #  - body, bytes, or None on a miss or for files too big to be cached
+    def get(self, path):
+        if self.maxBytes == 0: return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        # large files bypass the cache, they don't count as misses
+        if st.st_size > self.maxFile: return None
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == self._key(st):
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None: self._remove(path)
+        return None
+
+    # cache the body of a file, evicting the least recently used bodies to make room
+    # Arguments:
+    #  - path: path of the file, string
+    #  - st: os.stat_result of the file the body was read from
+    #  - body: content of the file, bytes
+    def put(self, path, st, body):
+        if len(body) > self.maxFile or len(body) > self.maxBytes: return
+        with self.lock:
+            if path in self.entries: self._remove(path)
+            self.entries[path] = (self._key(st), body)
+            self.size += len(body)
+            while self.size > self.maxBytes:
+                _, (_, old) = self.entries.popitem(last=False)
+                self.size -= len(old)
+                self.evictions += 1
+
+    # forget a file that was replaced or renamed
+    # Arguments:
+    #  - path: path of the file, string
+    def invalidate(self, path):
+        with self.lock:
+            if path in self.entries: self._remove(path)
+
+    # remove an entry, must be called with the lock held
+    def _remove(self, path):
+        self.size -= len(self.entries.pop(path)[1])
+
+    # counters for sizing the cache against the working set
+    # Return:
+    #  - one line summary, string
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return (f'cache: {self.hits} hits, {self.misses} misses ({self.hits / total * 100 if total else 0:.1f}% hit rate), '
+                    f'{self.evictions} evictions, {len(self.entries)} files, {self.size} of {self.maxBytes} bytes')
+
+CACHE = FileCache(CACHE_SIZE, CACHE_MAX_FILE)
+
+# print the cache counters, on SIGUSR1
+def printCacheStats(signum, frame):
+    print(f'[{os.getpid()}] ' + CACHE.stats(), flush=True)
+
+# debug tracing is sampled so it can stay on under load: at most TRACE_RATE requests a second print
+# their header fields, the others are counted and the count is printed with the next trace
+_trace = {'second': 0, 'count': 0, 'skipped': 0}
+_traceLock = threading.Lock()
+
+# decide if the request being handled prints its debug trace
+# Return:
+#  - True if debug is enabled and the trace rate allows one more trace this second
+def traced():
+    if DEBUG != 1: return False
+    if TRACE_RATE == 0: return True
+    second = int(time.monotonic())
+    with _traceLock:
+        if second != _trace['second']:
+            _trace['second'] = second
+            _trace['count'] = 0
+        _trace['count'] += 1
+        if _trace['count'] > TRACE_RATE:
+            _trace['skipped'] += 1
+            return False
+        skipped, _trace['skipped'] = _trace['skipped'], 0
+    if skipped: print(f'***** {skipped} REQUESTS NOT TRACED *****')
+    return True
+
+# names of the requests in metrics, by opCode, and by sub-opcode for extended requests (opCode 0b101)
+OP_NAMES = {0b000: 'put', 0b001: 'get', 0b010: 'change', 0b011: 'help'}
+EXT_NAMES = {0b00000: 'list', 0b00001: 'range_get', 0b00010: 'range_put', 0b00011: 'commit', 0b00100: 'resume',
+             0b00101: 'has', 0b00110: 'sigs', 0b00111: 'delta', 0b01000: 'caps', 0b01001: 'putx',
+             0b01010: 'getx', 0b01011: 'stats', 0b01100: 'list_page', 0b01101: 'stat', 0b01110: 'bput',
+             0b01111: 'bget', 0b10000: 'repl', 0b10001: 'ring'}
+
+# name of a request in metrics
+# Arguments:
+#  - byte1: first byte received from client, integer value
+# Return:
+#  - name, string, 'unknown' for requests the server doesn't support
+def opName(byte1):
+    if byte1 >> 5 == 0b101: return EXT_NAMES.get(byte1 & 0x1F, 'unknown')
+    return OP_NAMES.get(byte1 >> 5, 'unknown')
+
+# request counters, bytes received and sent and latency histograms by request type, and gauges of the
+# connections, v2 streams and requests being handled, for this process (each worker counts its own)
+class Metrics:
+
+    # upper bounds of the latency histogram buckets, in seconds, the last bucket counts everything slower
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.start = time.time()
+        self.ops = {}       # request name -> [requests, errors, bytes received, bytes sent, seconds, bucket counts]
+        self.gauges = {'connections': 0, 'streams': 0, 'requests_in_flight': 0}
+        self.throttle = {'connection': 0.0, 'total': 0.0}     # seconds transfers waited for a rate limit
+        self.lock = threading.Lock()
+
+    # add n to a gauge
+    # Arguments:
+    #  - name: gauge, 'connections', 'streams' or 'requests_in_flight'
+    #  - n: change, integer
+    def add(self, name, n):
+        with self.lock:
+            self.gauges[name] += n
+
+    # record time a transfer waited for a rate limit
+    # Arguments:
+    #  - limit: 'connection' or 'total'
+    #  - seconds: time waited, float
+    def throttled(self, limit, seconds):
+        if seconds > 0:
+            with self.lock:
+                self.throttle[limit] += seconds
+
+    # record a request that was handled
+    # Arguments:
+    #  - op: request name, string
+    #  - seconds: time taken to handle it, float
+    #  - received: bytes received for it, integer
+    #  - sent: bytes sent for it, integer
+    #  - failed: True if it was answered with an error or the connection was lost, boolean
+    def observe(self, op, seconds, received, sent, failed):
+        bucket = bisect_left(self.BUCKETS, seconds)
+        with self.lock:
+            stats = self.ops.get(op)
+            if stats is None:
+                stats = self.ops[op] = [0, 0, 0, 0, 0.0, [0] * (len(self.BUCKETS) + 1)]
+            stats[0] += 1
+            stats[1] += failed
+            stats[2] += received
+            stats[3] += sent
+            stats[4] += seconds
+            stats[5][bucket] += 1
+
+    # all metrics, and the counters of the file cache, in Prometheus text format
+    # Return:
+    #  - text, string
+    def render(self):
+        with self.lock:
+            ops = {op: stats[:5] + [list(stats[5])] for op, stats in sorted(self.ops.items())}
+            gauges = dict(self.gauges)
+            throttle = dict(self.throttle)
+        with CACHE.lock:
+            cache = (CACHE.hits, CACHE.misses, CACHE.evictions, len(CACHE.entries), CACHE.size)
+
+        lines = [f'# sfts server process {os.getpid()}']
+
+        # one metric, its help and type lines then its samples
+        def metric(name, kind, text, samples):
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{labels} {value}' for labels, value in samples)
+
+        metric('sfts_requests_total', 'counter', 'Requests handled.',
+               [(f'{{op="{op}"}}', stats[0]) for op, stats in ops.items()])
+        metric('sfts_request_errors_total', 'counter', 'Requests answered with an error, or interrupted by a lost connection.',
+               [(f'{{op="{op}"}}', stats[1]) for op, stats in ops.items()])
+        metric('sfts_received_bytes_total', 'counter', 'Bytes received from clients, headers included.',
+               [(f'{{op="{op}"}}', stats[2]) for op, stats in ops.items()])
+        metric('sfts_sent_bytes_total', 'counter', 'Bytes sent to clients, headers included.',
+               [(f'{{op="{op}"}}', stats[3]) for op, stats in ops.items()])
+
+        # histogram buckets are cumulative in the text format
+        samples = []
+        for op, stats in ops.items():
+            total = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), stats[5]):
+                total += count
+                samples.append((f'_bucket{{op="{op}",le="{bound}"}}', total))
+            samples.append((f'_sum{{op="{op}"}}', f'{stats[4]:.6f}'))
+            samples.append((f'_count{{op="{op}"}}', stats[0]))
+        metric('sfts_request_duration_seconds', 'histogram', 'Time taken to handle a request.', samples)
+
+        metric('sfts_connections', 'gauge', 'Client connections open.', [('', gauges['connections'])])
+        metric('sfts_streams', 'gauge', 'Protocol v2 streams open.', [('', gauges['streams'])])
+        metric('sfts_requests_in_flight', 'gauge', 'Requests being handled.', [('', gauges['requests_in_flight'])])
+        metric('sfts_rate_limit_bytes_per_second', 'gauge', 'Rate limit of the bytes sent and received, 0 for no limit, the total is shared by the workers.',
+               [('{limit="connection"}', CONN_RATE), ('{limit="total"}', TOTAL_RATE)])
+        metric('sfts_rate_limit_wait_seconds_total', 'counter', 'Time transfers waited for a rate limit.',
+               [(f'{{limit="{limit}"}}', f'{seconds:.6f}') for limit, seconds in throttle.items()])
+        metric('sfts_fair_queue_connections', 'gauge', 'Connections waiting for their turn under the total rate limit.',
+               [('', SCHEDULER.waiting() if SCHEDULER is not None else 0)])
+        metric('sfts_cache_hits_total', 'counter', 'GETs sent from the file cache.', [('', cache[0])])
+        metric('sfts_cache_misses_total', 'counter', 'GETs of cacheable files not in the file cache.', [('', cache[1])])
+        metric('sfts_cache_evictions_total', 'counter', 'Files evicted from the file cache.', [('', cache[2])])
+        metric('sfts_cache_files', 'gauge', 'Files in the file cache.', [('', cache[3])])
+        metric('sfts_cache_bytes', 'gauge', 'Bytes of file bodies in the file cache.', [('', cache[4])])
+        metric('sfts_uptime_seconds', 'gauge', 'Seconds since the process started.', [('', f'{time.time() - self.start:.1f}')])
+
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+
+# format a transfer rate for printing
+# Arguments:
+#  - nBytes: number of bytes transferred, integer
+#  - seconds: duration of the transfer, float
+# Return:
+#  - string with bytes/sec in the most readable unit
+def formatRate(nBytes, seconds):
+    rate = nBytes / seconds if seconds > 0 else 0.0
+    for unit in ('B/s', 'KB/s', 'MB/s'):
+        if rate < 1024:
+            return f'{rate:.1f} {unit}'
+        rate /= 1024
+    return f'{rate:.1f} GB/s'
+
 # server calls putResponse() to handle and create a response to a client's PUT command
 # Arguments:
 #  - byte1: first byte received from client, integer value
@@ -32,23 +1525,48 @@ def putResponse(byte1, clientSocket):
     # get the Filename Length, bottom 5 bits of byte1
     fNameLen = byte1 & 0x1F
     # use Filename Length to read the next bytes from client for Filename, decode to string
-    fName = clientSocket.recv(fNameLen).decode()
+    fName = recvExact(clientSocket, fNameLen).decode()
     # read next 4 bytes from client for File Size, convert the 4 bytes into 1 integer, using big-endian notation
-    fSize = int.from_bytes(clientSocket.recv(4), 'big')
-    # use File Size to receive the whole file from client in bytes
-    fBytes = clientSocket.recv(fSize)
+    fSize = int.from_bytes(recvExact(clientSocket, 4), 'big')
+
+    # time the upload to report its throughput
+    start = time.perf_counter()
 
     # now try to store the file, overwrites any existing file with same name
+    tmpName = None
     try:
-        # open in WRITE and BINARY mode for any type of file
-        with open(fName, 'wb') as f:
-            # write uploaded data to file
-            f.write(fBytes)
+        # open a temporary file in WRITE and BINARY mode for any type of file,
+        # the existing file is only replaced once the upload is complete
+        try:
+            f, tmpName = openTemp(storagePath(fName))
+        except:
+            # still receive the file data so the connection stays in sync, then fail
+            recvToFile(clientSocket, None, fSize)
+            raise
+        # in dedupe mode, hash the upload as it arrives
+        hasher = hashlib.sha256() if DEDUPE else None
+        with f:
+            # stream uploaded data to file as it arrives, chunk by chunk
+            recvToFile(clientSocket, f, fSize, hasher)
+        # move the complete upload into place
+        commitFile(tmpName, storagePath(fName), hasher and hasher.hexdigest())
+        tmpName = None
         # store response code for SUCCESS
         resCode = 0b000
         # no error msg when successful
         err = ''
 
+    # the client went away in the middle of the upload, nothing left to respond to,
+    # what was received is kept so the client can resume the upload with a RANGE PUT
+    except ConnectionError:
+        if tmpName is not None:
+            try:
+                keepPartial(tmpName, storagePath(fName), fSize)
+                tmpName = None
+            except OSError:
+                pass
+        raise
+
     # catch exceptions during write
     except:
         ### The project documentation does not specify a response code for PUT failures,    ###
@@ -62,32 +1580,40 @@ def putResponse(byte1, clientSocket):
         # error msg for put failure
         err = 'ERROR: Could not create file "' + fName + '"'
 
+    # remove what was received of an upload that was not committed
+    finally:
+        if tmpName is not None: discardTemp(tmpName)
+
+    # measure how long receiving and writing the file took
+    elapsed = time.perf_counter() - start
+
     # print request and the response data when debug enabled
-    if DEBUG == 1:
+    if traced():
         print('***** PUT REQUEST *****')
         print(f'  opCode:  0b{opCode:03b}-----')
         print(f'  FL:      0b---{fNameLen:05b}')
         print( '  fName:   ' + fName)
         print(f'  FS:      0x{fSize:08X}')
-        print( '  Data:    ', end='')
-        print(fBytes)
+        print(f'  Data:    <{fSize} bytes streamed to file>')
         print('***** PUT RESPONSE *****')
         print(f'  resCode: 0b{resCode:03b}')
 
-    # always print atleast the command type and filename for PUT
-    print('Client PUT request: ' + fName)
+    # always print atleast the command type and filename for PUT, with the upload throughput
+    print('Client PUT request: ' + fName + f' ({fSize} bytes, {formatRate(fSize, elapsed)})')
     # print err if not empty
     if err != '': print(err)
     
     # return the response (in bytes array)
     return (resCode << 5).to_bytes(1, 'big')
 
-# server calls getResponse() to handle and create its response to a client's GET command
+# server calls getResponse() to handle a client's GET command and send its response
+# the header is sent first, then the file data is streamed straight from disk to the socket
 # Arguments:
 #  - byte1: first byte received from client, integer value
 #  - clientSocket: client socket to receive data, socket class
 # Return:
-#  - response, one byte with resCode 0b010 in top 3 bits for FAIL, multiple bytes with header and data for SUCCESS
+#  - response, one byte with resCode 0b010 in top 3 bits for FAIL, empty bytes for SUCCESS since
+#    header and data have already been sent
 def getResponse(byte1, clientSocket):
 
     # store opCode for debug print, top 3 bits of byte1
@@ -95,24 +1621,25 @@ def getResponse(byte1, clientSocket):
     # get the Filename Length, bottom 5 bits of byte1
     fNameLen = byte1 & 0x1F
     # use Filename Length to read the next bytes from client for Filename, decode to string
-    fName = clientSocket.recv(fNameLen).decode()
+    fName = recvExact(clientSocket, fNameLen).decode()
+
+    # time the download to report its throughput
+    start = time.perf_counter()
+    fSize = 0
 
-    # now try to read the file, fails if file does not exist
+    # small files fetched often are sent from the cache, without opening the file
     try:
-        # open in READ and BINARY mode for any type of file
-        with open(fName, 'rb') as f:
-            # read and store data from file
-            fBytes = f.read()
-        # get the file size
-        fSize = len(fBytes)
-        # store response code for SUCCESS
-        resCode = 0b001
-        # build full request with resCode, FL, Filename, FS, and Data
-        response = ((resCode << 5) + fNameLen).to_bytes(1, 'big') + fName.encode() + fSize.to_bytes(4, 'big') + fBytes
-        # no error msg when successful
-        err = ''
-    
-    # catch exceptions during read
+        body = CACHE.get(storagePath(fName))
+    except ValueError:
+        body = None
+    cacheHit = body is not None
+
+    # now try to open the file, fails if file does not exist
+    try:
+        # open in READ and BINARY mode for any type of file, unless it is cached
+        f = open(storagePath(fName), 'rb') if body is None else None
+
+    # catch exceptions during open
     except:
         # store response code for FAIL (File Not found)
         resCode = 0b010
@@ -121,8 +1648,44 @@ def getResponse(byte1, clientSocket):
         # error msg for GET failure
         err = 'ERROR: File not found'
 
+    else:
+        try:
+            # get the file size without reading the file
+            st = os.fstat(f.fileno()) if f is not None else None
+            fSize = len(body) if body is not None else st.st_size
+
+            # the FS field is only 4 bytes, bigger files can't be described by a GET response
+            if fSize > 0xFFFFFFFF:
+                resCode = 0b010
+                response = (resCode << 5).to_bytes(1, 'big')
+                err = f'ERROR: File too big for GET, size = 0x{fSize:x}'
+
+            else:
+                # store response code for SUCCESS
+                resCode = 0b001
+                # send header on its own with resCode, FL, Filename and FS
+                clientSocket.sendall(((resCode << 5) + fNameLen).to_bytes(1, 'big') + fName.encode() + fSize.to_bytes(4, 'big'))
+                # then send the Data, from the cache, or read once into the cache for small files
+                if body is None and CACHE.maxBytes and fSize <= CACHE.maxFile:
+                    body = f.read()
+                    CACHE.put(storagePath(fName), st, body)
+                if body is not None:
+                    clientSocket.sendall(body)
+                # or straight from the file
+                else:
+                    sendFile(clientSocket, f, 0, fSize)
+                # everything has been sent already, nothing left for the caller to send
+                response = b''
+                # no error msg when successful
+                err = ''
+        finally:
+            if f is not None: f.close()
+
+    # measure how long sending the file took
+    elapsed = time.perf_counter() - start
+
     # print request and the response data when debug enabled
-    if DEBUG == 1:
+    if traced():
         print('***** GET REQUEST *****')
         print(f'  opCode:  0b{opCode:03b}-----')
         print(f'  FL:      0b---{fNameLen:05b}')
@@ -135,11 +1698,13 @@ def getResponse(byte1, clientSocket):
             print(f'  FL:      0b---{fNameLen:05b}')
             print( '  fName:   ' + fName)
             print(f'  FS:      0x{fSize:08X}')
-            print( '  Data:    ', end='')
-            print(fBytes)
+            print(f'  Data:    <{fSize} bytes sent from file>')
 
-    # always print atleast the command type and filename for GET
-    print('Client GET request: ' + fName)
+    # always print atleast the command type and filename for GET, with the download throughput when sent
+    if resCode == 0b001:
+        print('Client GET request: ' + fName + f' ({fSize} bytes, {formatRate(fSize, elapsed)}' + (', cached)' if cacheHit else ')'))
+    else:
+        print('Client GET request: ' + fName)
     # print err if not empty
     if err != '': print(err)
 
@@ -159,16 +1724,28 @@ def changeResponse(byte1, clientSocket):
     # get the old Filename Length, bottom 5 bits of byte1
     oldNameLen = byte1 & 0x1F
     # use old Filename Length to read the next bytes from client for old Filename, decode to string
-    oldName = clientSocket.recv(oldNameLen).decode()
+    oldName = recvExact(clientSocket, oldNameLen).decode()
     # read next byte from client for new Filename Length, and convert the byte into integer using big-endian notation
-    newNameLen = int.from_bytes(clientSocket.recv(1), 'big')
+    newNameLen = int.from_bytes(recvExact(clientSocket, 1), 'big')
     # use new Filename Length to read the next bytes from client for new Filename, decode to string
-    newName = clientSocket.recv(newNameLen).decode()
+    newName = recvExact(clientSocket, newNameLen).decode()
 
     # now try to rename file, fails if file does not exist
     try:
-        # rename the file
-        os.rename(oldName, newName)
+        # rename the file, one commit or rename at a time between workers, a directory of the sharded
+        # layout is renamed one file at a time, in a cluster the owners of the new name get a copy first
+        if CLUSTER is not None:
+            renamed = clusterRename(oldName, newName)
+        else:
+            with storageLock():
+                renamed = STORAGE.rename(oldName, newName)
+                for oldPath, newPath in renamed: INDEX.rename(oldPath, newPath)
+        # renames are rare, they are flushed right away in both durable modes
+        if DURABILITY != 'none':
+            for path in {os.path.dirname(p) or '.' for pair in renamed for p in pair}: fsyncPath(path)
+        for oldPath, newPath in renamed:
+            CACHE.invalidate(oldPath)
+            CACHE.invalidate(newPath)
         # store response code for SUCCESS
         resCode = 0b000
         # no error msg when successful
@@ -182,7 +1759,7 @@ def changeResponse(byte1, clientSocket):
         err = 'ERROR: Change unsuccessful.'
 
     # print request and the response data when debug enabled
-    if DEBUG == 1:
+    if traced():
         print('***** CHANGE REQUEST *****')
         print(f'  opCode:  0b{opCode:03b}-----')
         print(f'  OFL:     0b---{oldNameLen:05b}')
@@ -218,14 +1795,13 @@ def helpResponse(byte1, HELP_DATA):
     length = len(helpData)
 
     # print request and the response data when debug enabled
-    if DEBUG == 1:
+    if traced():
         print('***** HELP REQUEST *****')
         print(f'  opCode:  0b{opCode:03b}-----')
         print('***** HELP RESPONSE *****')
         print(f'  resCode: 0b{resCode:03b}-----')
         print(f'  length:  0b---{length:05b}')
-        print( '  Data:   ', end='')
-        print(helpData)
+        print(f'  Data:    <{length} bytes>')
 
     # always print atleast the command type for HELP
     print('Client HELP request')
@@ -233,74 +1809,2020 @@ def helpResponse(byte1, HELP_DATA):
     # return the response (in bytes array), byte1 + data
     return ((resCode << 5) + length).to_bytes(1, 'big') + helpData
 
-############################## MAIN CODE ##############################
+# server calls listResponse() to handle and create a response to a client's LIST request
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response, resCode 0b000 then count (4 bytes) and for each file:
+#    name length (1 byte), name, size (8 bytes)
+def listResponse(byte1, clientSocket):
 
-# if this script was called directly, and not as module by another script
-if __name__ == '__main__':
+    # read the prefix the listed names must start with
+    prefixLen = int.from_bytes(recvExact(clientSocket, 1), 'big')
+    prefix = recvExact(clientSocket, prefixLen).decode()
 
-    # accept arguments when calling script
-    parser = argparse.ArgumentParser(description='Backend for FTP socket server', epilog='Requires Python 3.10 or higher to run')
-    parser.add_argument('port', type=int, help='Port number on which the server is listening')
-    parser.add_argument('-d', '--debug', action='store_const', const=1, default=0, help='Debug: print everything sent/received by server')
-    sysArgs = parser.parse_args()
+    # every name starting with the prefix, from the index
+    entries, _ = INDEX.page(prefix, '', None)
 
-    # define input, constants
-    SERVER_PORT = sysArgs.port
-    DEBUG = sysArgs.debug
-    HELP_DATA = 'get, put, change, help, bye'
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** LIST REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  prefix:  ' + prefix)
+        print('***** LIST RESPONSE *****')
+        print('  resCode: 0b000-----')
+        print(f'  count:   {len(entries)}')
 
-    # create server TCP socket
-    serverSocket = socket(AF_INET, SOCK_STREAM)
-    # bind socket to IP and PORT, blank IP means use this computer's address
-    serverSocket.bind(('', SERVER_PORT))
-    serverSocket.listen(1) # start listening, max 1 connection at a time
-    print(f'Server listening on {gethostbyname(gethostname())}:{SERVER_PORT}')
+    # always print atleast the command type and prefix for LIST
+    print('Client LIST request: ' + prefix)
 
-    # loop forever listening for clients
-    while True:
-    
-        # block and wait for client connection to accept
-        clientSocket, addr = serverSocket.accept()
-        # print IP address of new connection
-        print('New connection: ' + addr[0])
- 
+    # build the response, names longer than 255 bytes can't be listed
+    response = [(0b000 << 5).to_bytes(1, 'big'), b'']
+    count = 0
+    for name, size, _ in entries:
+        nameBytes = name.encode()
+        if len(nameBytes) > 0xFF: continue
+        response.append(len(nameBytes).to_bytes(1, 'big') + nameBytes + size.to_bytes(8, 'big'))
+        count += 1
+    response[1] = count.to_bytes(4, 'big')
+    return b''.join(response)
+
+# server calls listPageResponse() to handle a client's LIST PAGE request, one page of the names
+# starting with a prefix, so listing a directory of many files takes several short requests
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response, resCode 0b000 then count (4 bytes), more (1 byte, 1 if names are left after the page)
+#    and for each file: name length (1 byte), name, size (8 bytes), mtime in ns (8 bytes)
+def listPageResponse(byte1, clientSocket):
+
+    # read the prefix, the name the page starts after ('' for the first page) and the max names listed
+    prefix = recvName(clientSocket)
+    after = recvName(clientSocket)
+    limit = min(int.from_bytes(recvExact(clientSocket, 4), 'big'), LIST_PAGE_MAX)
+
+    entries, more = INDEX.page(prefix, after, limit)
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** LIST PAGE REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  prefix:  ' + prefix)
+        print( '  after:   ' + after)
+        print(f'  limit:   0x{limit:08X}')
+        print('***** LIST PAGE RESPONSE *****')
+        print('  resCode: 0b000-----')
+        print(f'  count:   {len(entries)}')
+        print(f'  more:    {int(more)}')
+
+    # always print atleast the command type, prefix and page size for LIST PAGE
+    print(f'Client LIST PAGE request: {prefix} ({len(entries)} files' + (', more)' if more else ')'))
+
+    # build the response, names longer than 255 bytes can't be listed
+    response = [(0b000 << 5).to_bytes(1, 'big'), b'', int(more).to_bytes(1, 'big')]
+    count = 0
+    for name, size, mtime in entries:
+        nameBytes = name.encode()
+        if len(nameBytes) > 0xFF: continue
+        response.append(len(nameBytes).to_bytes(1, 'big') + nameBytes + size.to_bytes(8, 'big') + mtime.to_bytes(8, 'big'))
+        count += 1
+    response[1] = count.to_bytes(4, 'big')
+    return b''.join(response)
+
+# server calls statResponse() to handle a client's STAT request, the metadata of one file from the index
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response, resCode 0b000 then size (8 bytes), mtime in ns (8 bytes), hash flag (1 byte) and the
+#    sha256 (32 bytes) if the flag is 1, or resCode 0b010 if the file doesn't exist
+def statResponse(byte1, clientSocket):
+
+    fName = recvName(clientSocket)
+
+    try:
+        entry = INDEX.stat(storagePath(fName))
+    except ValueError:
+        entry = None
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** STAT REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  fName:   ' + fName)
+        print('***** STAT RESPONSE *****')
+        print(f'  resCode: 0b{0b000 if entry else 0b010:03b}-----')
+        if entry:
+            print(f'  FS:      0x{entry[0]:016X}')
+            print(f'  mtime:   0x{entry[1]:016X}')
+            print( '  sha256:  ' + (entry[2] or 'unknown'))
+
+    # always print atleast the command type and filename for STAT
+    print('Client STAT request: ' + fName + ('' if entry else ' (not found)'))
+
+    if entry is None:
+        return (0b010 << 5).to_bytes(1, 'big')
+    size, mtime, sha = entry
+    return ((0b000 << 5).to_bytes(1, 'big') + size.to_bytes(8, 'big') + mtime.to_bytes(8, 'big')
+            + (b'\x01' + bytes.fromhex(sha) if sha else b'\x00'))
+
+# server calls rangeGetResponse() to handle a client's ranged GET request and send its response
+# only the requested range of the file is sent, straight from disk
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response, one byte with resCode 0b010 in top 3 bits for FAIL, empty bytes for SUCCESS since
+#    resCode 0b001, total file size (8 bytes), range length (8 bytes) and data have already been sent
+def rangeGetResponse(byte1, clientSocket):
+
+    # read Filename, then offset and length of the range (8 bytes each)
+    fName = recvName(clientSocket)
+    offset = int.from_bytes(recvExact(clientSocket, 8), 'big')
+    length = int.from_bytes(recvExact(clientSocket, 8), 'big')
+
+    try:
+        f = open(storagePath(fName), 'rb')
+    except:
+        # store response code for FAIL (File Not found)
+        resCode = 0b010
+        response = (resCode << 5).to_bytes(1, 'big')
+        err = 'ERROR: File not found'
+    else:
+        with f:
+            # clip the range to the end of the file, a length of 0 only asks for the file size
+            total = os.fstat(f.fileno()).st_size
+            length = max(0, min(length, total - offset))
+            resCode = 0b001
+            clientSocket.sendall((resCode << 5).to_bytes(1, 'big') + total.to_bytes(8, 'big') + length.to_bytes(8, 'big'))
+            sendFile(clientSocket, f, offset, length)
+            response = b''
+            err = ''
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** RANGE GET REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  fName:   ' + fName)
+        print(f'  offset:  0x{offset:016X}')
+        print(f'  length:  0x{length:016X}')
+        print('***** RANGE GET RESPONSE *****')
+        print(f'  resCode: 0b{resCode:03b}-----')
+
+    # always print atleast the command type, filename and range for RANGE GET
+    print(f'Client RANGE GET request: {fName} [{offset}, {offset + length})')
+    if err != '': print(err)
+
+    return response
+
+# server calls rangePutResponse() to handle and create a response to a client's ranged PUT request
+# the range is written in place into the hidden staging file of the name, several connections can
+# write different ranges of the same file at once, the file is replaced by a COMMIT request
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response byte with resCode in top 3 bits, 0b000 if SUCCESS, 0b101 if FAIL
+def rangePutResponse(byte1, clientSocket):
+
+    # read Filename, then total size of the file, offset and length of the range (8 bytes each)
+    fName = recvName(clientSocket)
+    total = int.from_bytes(recvExact(clientSocket, 8), 'big')
+    offset = int.from_bytes(recvExact(clientSocket, 8), 'big')
+    length = int.from_bytes(recvExact(clientSocket, 8), 'big')
+
+    fd = None
+    writer = None
+    try:
+        if offset + length > total:
+            raise ValueError('range past the end of the file')
+        path = storagePath(fName)
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        # open the staging file without truncating it, other ranges may already be written
+        fd = os.open(partPath(path), os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+        # a staging file left by an upload of a bigger file is cut to the new size
+        if os.fstat(fd).st_size > total:
+            os.ftruncate(fd, total)
+        # stream the range into its place in the staging file
+        writer = PositionalWriter(fd, offset)
+        recvToFile(clientSocket, writer, length)
+        # record the range as received, for COMMIT and for resuming
+        with storageLock():
+            addRange(path, total, offset, offset + length)
+        resCode = 0b000
+        err = ''
+
+    # the client went away in the middle of the range, record the part that was written
+    except ConnectionError:
+        if writer is not None:
+            with storageLock():
+                addRange(path, total, offset, writer.offset)
+        raise
+    except:
+        # the range data still has to be received to keep the connection in sync
+        if fd is None: recvToFile(clientSocket, None, length)
+        resCode = 0b101
+        err = 'ERROR: Could not write range of "' + fName + '"'
+    finally:
+        if fd is not None: os.close(fd)
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** RANGE PUT REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  fName:   ' + fName)
+        print(f'  total:   0x{total:016X}')
+        print(f'  offset:  0x{offset:016X}')
+        print(f'  length:  0x{length:016X}')
+        print('***** RANGE PUT RESPONSE *****')
+        print(f'  resCode: 0b{resCode:03b}')
+
+    # always print atleast the command type, filename and range for RANGE PUT
+    print(f'Client RANGE PUT request: {fName} [{offset}, {offset + length})')
+    if err != '': print(err)
+
+    return (resCode << 5).to_bytes(1, 'big')
+
+# server calls commitResponse() to handle and create a response to a client's COMMIT request,
+# sent once all ranges of a file were uploaded, replaces the file with its staging file
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response byte with resCode in top 3 bits, 0b000 if SUCCESS, 0b101 if FAIL
+def commitResponse(byte1, clientSocket):
+
+    # read Filename and total size of the file (8 bytes)
+    fName = recvName(clientSocket)
+    total = int.from_bytes(recvExact(clientSocket, 8), 'big')
+
+    try:
+        path = storagePath(fName)
+        with storageLock():
+            # every byte of the file must have been received in the staging file
+            metaTotal, ranges = readMeta(path)
+            if metaTotal != total or (total > 0 and ranges != [[0, total]]) or not os.path.exists(partPath(path)):
+                raise ValueError('upload incomplete')
+            # take the staging file out of the way of new uploads, it is committed below
+            f, tmpName = openTemp(path)
+            f.close()
+            os.replace(partPath(path), tmpName)
+            os.remove(metaPath(path))
+        commitFile(tmpName, path)
+        resCode = 0b000
+        err = ''
+    except:
+        resCode = 0b101
+        err = 'ERROR: Could not commit "' + fName + '"'
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** COMMIT REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  fName:   ' + fName)
+        print(f'  total:   0x{total:016X}')
+        print('***** COMMIT RESPONSE *****')
+        print(f'  resCode: 0b{resCode:03b}')
+
+    # always print atleast the command type and filename for COMMIT
+    print(f'Client COMMIT request: {fName} ({total} bytes)')
+    if err != '': print(err)
+
+    return (resCode << 5).to_bytes(1, 'big')
+
+# server calls resumeResponse() to handle and create a response to a client's RESUME request,
+# tells the client which ranges of an interrupted upload the server already has
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response, resCode 0b000 then count (4 bytes) and each received range as start and end (8 bytes each),
+#    no ranges if nothing was received for an upload of this total size, then the sha256 of the bytes
+#    received (32 bytes), see rangesDigest()
+def resumeResponse(byte1, clientSocket):
+
+    # read Filename and total size of the file (8 bytes)
+    fName = recvName(clientSocket)
+    total = int.from_bytes(recvExact(clientSocket, 8), 'big')
+
+    try:
+        path = storagePath(fName)
+        with storageLock():
+            metaTotal, ranges = readMeta(path)
+            # the sidecar only counts if its staging file is still there
+            if metaTotal != total or not os.path.exists(partPath(path)): ranges = []
+        digest = rangesDigest(path, ranges) if ranges else hashlib.sha256().digest()
+    except (OSError, ValueError):
+        ranges = []
+        digest = hashlib.sha256().digest()
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** RESUME REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  fName:   ' + fName)
+        print(f'  total:   0x{total:016X}')
+        print('***** RESUME RESPONSE *****')
+        print('  resCode: 0b000-----')
+        print(f'  ranges:  {ranges}')
+        print(f'  sha256:  {digest.hex()}')
+
+    # always print atleast the command type, filename and bytes already received for RESUME
+    print(f'Client RESUME request: {fName} ({sum(end - start for start, end in ranges)} of {total} bytes received)')
+
+    return (0b000 << 5).to_bytes(1, 'big') + len(ranges).to_bytes(4, 'big') \
+        + b''.join(start.to_bytes(8, 'big') + end.to_bytes(8, 'big') for start, end in ranges) + digest
+
+# server calls hasResponse() to handle and create a response to a client's HAS request, sent before a PUT
+# if the server already stores content with the same sha256 and size, the name is linked to it
+# and the client doesn't need to send the file at all
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response byte with resCode in top 3 bits, 0b000 if the file was stored without its data,
+#    0b010 if the content is not on the server and the file must be sent with a PUT
+def hasResponse(byte1, clientSocket):
+
+    # read sha256 of the content (32 bytes), Filename, and file size (8 bytes)
+    sha = recvExact(clientSocket, 32).hex()
+    fName = recvName(clientSocket)
+    fSize = int.from_bytes(recvExact(clientSocket, 8), 'big')
+
+    resCode = 0b010
+    if DEDUPE:
+        try:
+            path = storagePath(fName)
+            blob = blobPath(sha)
+            if os.path.getsize(blob) == fSize:
+                # link a temporary name to the blob, then commit it like an upload
+                if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+                f, tmpName = openTemp(path)
+                f.close()
+                os.remove(tmpName)
+                os.link(blob, tmpName)
+                commitFile(tmpName, path, sha)
+                resCode = 0b000
+        except (OSError, ValueError):
+            pass
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** HAS REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  sha256:  ' + sha)
+        print( '  fName:   ' + fName)
+        print(f'  FS:      0x{fSize:016X}')
+        print('***** HAS RESPONSE *****')
+        print(f'  resCode: 0b{resCode:03b}')
+
+    # always print atleast the command type, filename and whether the upload was skipped for HAS
+    print('Client HAS request: ' + fName + (' (stored, upload skipped)' if resCode == 0b000 else ' (not stored)'))
+
+    return (resCode << 5).to_bytes(1, 'big')
+
+# server calls sigsResponse() to handle a client's SIGS request, sent before a delta upload
+# the block signatures of the stored file let the client find which parts of it are unchanged
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response, one byte with resCode 0b010 if the file was not found, empty bytes for SUCCESS since
+#    resCode 0b000, file size (8 bytes), block size (4 bytes), count (4 bytes) and the signatures are already sent
+def sigsResponse(byte1, clientSocket):
+
+    # read Filename
+    fName = recvName(clientSocket)
+
+    fSize = 0
+    blockSize = 0
+    try:
+        f = open(storagePath(fName), 'rb')
+    except (OSError, ValueError):
+        resCode = 0b010
+        response = (resCode << 5).to_bytes(1, 'big')
+    else:
+        with f:
+            fSize = os.fstat(f.fileno()).st_size
+            blockSize = deltaBlockSize(fSize)
+            resCode = 0b000
+            clientSocket.sendall((resCode << 5).to_bytes(1, 'big') + fSize.to_bytes(8, 'big')
+                                 + blockSize.to_bytes(4, 'big') + (fSize // blockSize).to_bytes(4, 'big'))
+            # send the signatures in batches as they are computed, the file is read once
+            batch = []
+            for signature in blockSignatures(f, blockSize):
+                batch.append(signature)
+                if len(batch) == 1024:
+                    clientSocket.sendall(b''.join(batch))
+                    batch = []
+            if batch: clientSocket.sendall(b''.join(batch))
+            response = b''
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** SIGS REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  fName:   ' + fName)
+        print('***** SIGS RESPONSE *****')
+        print(f'  resCode: 0b{resCode:03b}-----')
+        if resCode == 0b000:
+            print(f'  FS:      0x{fSize:016X}')
+            print(f'  block:   0x{blockSize:08X}')
+            print(f'  count:   0x{fSize // blockSize:08X}')
+
+    # always print atleast the command type, filename and number of signatures for SIGS
+    if resCode == 0b000:
+        print(f'Client SIGS request: {fName} ({fSize // blockSize} blocks of {blockSize} bytes)')
+    else:
+        print('Client SIGS request: ' + fName + ' (not found)')
+
+    return response
+
+# server calls deltaResponse() to handle a client's DELTA request, a file rebuilt from blocks of the stored
+# file and new data sent by the client, the new version is written to a temporary file and replaces the
+# stored one once its sha256 matches the one sent by the client
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response byte with resCode in top 3 bits, 0b000 if SUCCESS, 0b101 if FAIL
+def deltaResponse(byte1, clientSocket):
+
+    # read Filename, size of the new file (8 bytes) and block size of the signatures (4 bytes)
+    fName = recvName(clientSocket)
+    fSize = int.from_bytes(recvExact(clientSocket, 8), 'big')
+    blockSize = int.from_bytes(recvExact(clientSocket, 4), 'big')
+
+    basis = None
+    f = None
+    tmpName = None
+    err = ''
+    try:
+        path = storagePath(fName)
+        # no stored file is fine, the client then sends all of the data
+        if os.path.exists(path): basis = open(path, 'rb')
+        f, tmpName = openTemp(path)
+    except (OSError, ValueError):
+        err = 'ERROR: Could not write "' + fName + '"'
+
+    # the ops are always received to the end, even after an error, to keep the connection in sync
+    hasher = hashlib.sha256()
+    copied = 0
+    received = 0
+    try:
+        while True:
+            op = recvExact(clientSocket, 1)[0]
+
+            # END, the sha256 of the new file follows
+            if op == 0x00:
+                break
+
+            # COPY, count blocks of the stored file starting at block index
+            elif op == 0x01:
+                index = int.from_bytes(recvExact(clientSocket, 4), 'big')
+                count = int.from_bytes(recvExact(clientSocket, 4), 'big')
+                if err != '': continue
+                try:
+                    if basis is None: raise ValueError('no stored file to copy from')
+                    basis.seek(index * blockSize)
+                    remaining = count * blockSize
+                    while remaining > 0:
+                        chunk = basis.read(min(CHUNK_SIZE, remaining))
+                        if not chunk: raise ValueError('block past the end of the stored file')
+                        hasher.update(chunk)
+                        f.write(chunk)
+                        remaining -= len(chunk)
+                    copied += count * blockSize
+                except (OSError, ValueError):
+                    err = 'ERROR: Could not rebuild "' + fName + '"'
+
+            # DATA, length (4 bytes) then new data
+            elif op == 0x02:
+                length = int.from_bytes(recvExact(clientSocket, 4), 'big')
+                try:
+                    recvToFile(clientSocket, f if err == '' else None, length, hasher)
+                except OSError as e:
+                    if isinstance(e, ConnectionError): raise
+                    err = 'ERROR: Could not write "' + fName + '"'
+                received += length
+
+            # the rest of the stream can't be parsed, the connection can't be kept in sync
+            else:
+                raise ConnectionError(f'invalid delta op 0x{op:02X}')
+
+        sha = recvExact(clientSocket, 32)
+
+        # the rebuilt file must be exactly the client's file, or the stored file changed since SIGS
+        if err == '':
+            f.close()
+            if os.path.getsize(tmpName) != fSize or hasher.digest() != sha:
+                err = 'ERROR: Rebuilt "' + fName + '" does not match, stored file changed during upload'
+            else:
+                commitFile(tmpName, path, sha.hex())
+                tmpName = None
+
+    finally:
+        if basis is not None: basis.close()
+        if f is not None: f.close()
+        if tmpName is not None: discardTemp(tmpName)
+
+    resCode = 0b000 if err == '' else 0b101
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** DELTA REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  fName:   ' + fName)
+        print(f'  FS:      0x{fSize:016X}')
+        print(f'  block:   0x{blockSize:08X}')
+        print(f'  Data:    <{copied} bytes copied, {received} bytes received>')
+        print('***** DELTA RESPONSE *****')
+        print(f'  resCode: 0b{resCode:03b}')
+
+    # always print atleast the command type, filename and bytes reused for DELTA
+    print(f'Client DELTA request: {fName} ({copied} bytes reused, {received} bytes received)')
+    if err != '': print(err)
+
+    return (resCode << 5).to_bytes(1, 'big')
+
+# server calls capsResponse() to tell a client which compression codecs and digests it supports
+# Arguments:
+#  - byte1: first byte received from client, integer value
+# Return:
+#  - response, resCode 0b000 then a 1-byte mask, bit n set if codec n is supported, bit DIGEST_CAP + n - 1
+#    if digest n is
+def capsResponse(byte1):
+
+    # bits of the codecs, of the digests, and of the bundle requests
+    mask = sum(1 << codec for codec in CODECS) | sum(1 << (DIGEST_CAP + digest - 1) for digest in DIGESTS if digest) | BUNDLE_CAP
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** CAPS REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print('***** CAPS RESPONSE *****')
+        print('  resCode: 0b000-----')
+        print(f'  mask:    0b{mask:08b}')
+
+    # always print atleast the command type, the codecs and the digests for CAPS
+    print('Client CAPS request: ' + ', '.join(CODECS.values()) + ' / ' + ', '.join(DIGESTS.values()))
+
+    return (0b000 << 5).to_bytes(1, 'big') + mask.to_bytes(1, 'big')
+
+# server calls putxResponse() to handle a client's PUTX request, a PUT whose data is a chunk stream
+# compressed with the codec chosen by the client, optionally followed by a digest of the data checked
+# against the one computed while the chunks were received
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response byte with resCode in top 3 bits, 0b000 if SUCCESS, 0b101 if FAIL, 0b100 if the digest doesn't match
+def putxResponse(byte1, clientSocket):
+
+    # read Filename, size of the file (8 bytes, informational, the stream decides) and codec (1 byte),
+    # the digest sent after the stream in its top 4 bits
+    fName = recvName(clientSocket)
+    fSize = int.from_bytes(recvExact(clientSocket, 8), 'big')
+    codec = recvExact(clientSocket, 1)[0]
+    digest = codec >> 4
+    codec &= 0x0F
+    # the length of an unknown digest is unknown too, the end of the request can't be found
+    if digest not in DIGESTS: raise ConnectionError(f'unknown digest {digest}')
+
+    start = time.perf_counter()
+    f = None
+    tmpName = None
+    raw = wire = 0
+    try:
+        path = storagePath(fName)
+        f, tmpName = openTemp(path)
+    except (OSError, ValueError):
+        pass
+
+    hasher = digester(digest)
+    try:
+        try:
+            # an unknown codec can't be decoded, the stream is still received as is to stay in sync
+            raw, wire = recvChunks(clientSocket, f if codec in CODECS else None, codec if codec in CODECS else 0, hasher)
+        except ConnectionError:
+            raise
+        except (OSError, ValueError):
+            # the digest still follows the stream
+            if hasher is not None: recvExact(clientSocket, len(hasher.digest()))
+            raise
+        value = recvExact(clientSocket, len(hasher.digest())) if hasher is not None else None
+        if f is None or codec not in CODECS: raise ValueError('cannot store upload')
+        f.close()
+        if hasher is not None and value != hasher.digest():
+            resCode = 0b100
+            err = 'ERROR: Digest of "' + fName + '" does not match, upload discarded'
+        else:
+            # a sha256 checked on the way in is kept in the index, GETX sends it without reading the file twice
+            commitFile(tmpName, path, hasher.hexdigest() if digest == 2 else None)
+            tmpName = None
+            resCode = 0b000
+            err = ''
+    except ConnectionError:
+        raise
+    except (OSError, ValueError):
+        resCode = 0b101
+        err = 'ERROR: Could not write "' + fName + '"'
+    finally:
+        if f is not None: f.close()
+        if tmpName is not None: discardTemp(tmpName)
+
+    elapsed = time.perf_counter() - start
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** PUTX REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  fName:   ' + fName)
+        print(f'  FS:      0x{fSize:016X}')
+        print(f'  codec:   {CODECS.get(codec, codec)}')
+        print(f'  digest:  {DIGESTS[digest]}')
+        print(f'  Data:    <{raw} bytes stored, {wire} bytes received>')
+        print('***** PUTX RESPONSE *****')
+        print(f'  resCode: 0b{resCode:03b}')
+
+    # always print atleast the command type, filename, codec, ratio and throughput for PUTX
+    print(f'Client PUTX request: {fName} ({CODECS.get(codec, codec)}, {raw} bytes, {wire} on the wire, '
+          f'ratio {raw / wire if wire else 0:.2f}, {formatRate(raw, elapsed)}' + (f', {DIGESTS[digest]})' if digest else ')'))
+    if err != '': print(err)
+
+    return (resCode << 5).to_bytes(1, 'big')
+
+# server calls getxResponse() to handle a client's GETX request, a GET whose data is sent as a chunk stream,
+# compressed with the codec asked for by the client when a sample of the file shows it is worth it, and followed
+# by the digest asked for, computed while the chunks are sent or, for a sha256 already in the index, sent as it is
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response, one byte with resCode 0b010 if the file was not found, empty bytes for SUCCESS since
+#    resCode 0b001, file size (8 bytes), codec (1 byte), the chunk stream and the digest are already sent
+def getxResponse(byte1, clientSocket):
+
+    # read Filename and codec asked for (1 byte), the digest asked for in its top 4 bits
+    fName = recvName(clientSocket)
+    wanted = recvExact(clientSocket, 1)[0]
+    # a digest this server doesn't support is not sent, the client sees it in the codec byte of the response
+    digest = wanted >> 4 if wanted >> 4 in DIGESTS else 0
+    wanted &= 0x0F
+
+    start = time.perf_counter()
+    codec = 0
+    raw = wire = 0
+    stored = False
+    try:
+        path = storagePath(fName)
+        f = open(path, 'rb')
+    except (OSError, ValueError):
+        resCode = 0b010
+        response = (resCode << 5).to_bytes(1, 'big')
+    else:
+        with f:
+            st = os.fstat(f.fileno())
+            fSize = st.st_size
+            # the sha256 of a file uploaded with one, or hashed by an earlier GETX, if it didn't change since
+            hasher = digester(digest)
+            if digest == 2:
+                entry = INDEX.stat(path)
+                if entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns) and entry[2]:
+                    hasher = None
+                    value = bytes.fromhex(entry[2])
+                    stored = True
+            # sample the first chunk, then send from the start
+            codec = chooseCodec(f.read(CHUNK_SIZE), wanted)
+            f.seek(0)
+            resCode = 0b001
+            clientSocket.sendall((resCode << 5).to_bytes(1, 'big') + fSize.to_bytes(8, 'big') + ((digest << 4) + codec).to_bytes(1, 'big'))
+            raw, wire = sendChunks(clientSocket, f, codec, hasher)
+            if hasher is not None: value = hasher.digest()
+            if digest: clientSocket.sendall(value)
+            response = b''
+        # keep a sha256 computed on the way out for the next GETX
+        if digest == 2 and not stored:
+            with storageLock():
+                INDEX.learn(path, st, value.hex())
+
+    elapsed = time.perf_counter() - start
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** GETX REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print( '  fName:   ' + fName)
+        print(f'  codec:   {CODECS.get(wanted, wanted)}')
+        print(f'  digest:  {DIGESTS[digest]}')
+        print('***** GETX RESPONSE *****')
+        print(f'  resCode: 0b{resCode:03b}-----')
+        if resCode == 0b001:
+            print(f'  FS:      0x{fSize:016X}')
+            print(f'  codec:   {CODECS[codec]}')
+            print(f'  Data:    <{raw} bytes from file, {wire} bytes sent>')
+            if digest: print(f'  digest:  {value.hex()}' + (' (stored)' if stored else ''))
+
+    # always print atleast the command type and filename for GETX, with codec, ratio and throughput when sent
+    if resCode == 0b001:
+        print(f'Client GETX request: {fName} ({CODECS[codec]}, {raw} bytes, {wire} on the wire, '
+              f'ratio {raw / wire if wire else 0:.2f}, {formatRate(raw, elapsed)}'
+              + (f', {DIGESTS[digest]}' + (' stored)' if stored else ')') if digest else ')'))
+    else:
+        print('Client GETX request: ' + fName)
+        print('ERROR: File not found')
+
+    return response
+
+# server calls statsResponse() to send a client the metrics of this process
+# Arguments:
+#  - byte1: first byte received from client, integer value
+# Return:
+#  - response, resCode 0b000 then length (4 bytes) and the metrics in Prometheus text format
+def statsResponse(byte1):
+
+    text = METRICS.render().encode()
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** STATS REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print('***** STATS RESPONSE *****')
+        print('  resCode: 0b000-----')
+        print(f'  length:  0x{len(text):08X}')
+
+    # always print atleast the command type for STATS
+    print('Client STATS request')
+
+    return (0b000 << 5).to_bytes(1, 'big') + len(text).to_bytes(4, 'big') + text
+
+# server calls bputResponse() to handle a client's BPUT request, many small files uploaded in one request
+# entries are received into temporary files one after the other, then committed together with commitFiles()
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response: resCode 0b000, count (4 bytes), then the resCode of each entry, 0b000 if stored, 0b101 if not
+def bputResponse(byte1, clientSocket):
+
+    start = time.perf_counter()
+    names = []
+    codes = []
+    staged = []     # (index of the entry, tmpName, path, sha) of the entries received
+    nBytes = 0
+    try:
+        # entries: FL (1 byte), Filename, FS (8 bytes) then data, until a FL of 0
+        while (nameLen := recvExact(clientSocket, 1)[0]) > 0:
+            fName = recvExact(clientSocket, nameLen).decode()
+            fSize = int.from_bytes(recvExact(clientSocket, 8), 'big')
+            names.append(fName)
+            nBytes += fSize
+            try:
+                path = storagePath(fName)
+                f, tmpName = openTemp(path)
+            except (OSError, ValueError):
+                # still receive the data so the next entry starts at the right byte
+                recvToFile(clientSocket, None, fSize)
+                codes.append(0b101)
+                continue
+            try:
+                hasher = hashlib.sha256() if DEDUPE else None
+                with f:
+                    recvToFile(clientSocket, f, fSize, hasher)
+            except ConnectionError:
+                discardTemp(tmpName)
+                raise
+            except OSError:
+                discardTemp(tmpName)
+                codes.append(0b101)
+                continue
+            staged.append((len(codes), tmpName, path, hasher and hasher.hexdigest()))
+            codes.append(0b000)
+
+        for (i, *_), ok in zip(staged, commitFiles([item[1:] for item in staged])):
+            if not ok: codes[i] = 0b101
+        staged = []
+
+    # the client went away in the middle of the bundle, none of it is stored
+    finally:
+        for _, tmpName, _, _ in staged:
+            discardTemp(tmpName)
+
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for code in codes if code != 0b000)
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** BPUT REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        for fName, code in zip(names, codes):
+            print(f'  entry:   {fName} -> 0b{code:03b}')
+        print('***** BPUT RESPONSE *****')
+        print('  resCode: 0b000-----')
+        print(f'  count:   {len(codes)}')
+
+    # always print atleast the command type and the number of files for BPUT, with the upload throughput
+    print(f'Client BPUT request: {len(codes)} files ({nBytes} bytes, {formatRate(nBytes, elapsed)})' + (f', {failed} failed' if failed else ''))
+
+    return (0b000 << 5).to_bytes(1, 'big') + len(codes).to_bytes(4, 'big') + bytes(code << 5 for code in codes)
+
+# server calls bgetResponse() to handle a client's BGET request, many small files downloaded in one request
+# the entries are gathered in a buffer sent every BUNDLE_BUFFER bytes, larger files are sent from disk
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - empty bytes, the response is already sent: resCode 0b000, count (4 bytes), then for each entry
+#    resCode 0b001, FS (8 bytes) and data, or resCode 0b010 if the file was not found
+def bgetResponse(byte1, clientSocket):
+
+    start = time.perf_counter()
+    # entries: FL (1 byte) then Filename, until a FL of 0
+    names = []
+    while (nameLen := recvExact(clientSocket, 1)[0]) > 0:
+        names.append(recvExact(clientSocket, nameLen).decode())
+
+    buffer = bytearray((0b000 << 5).to_bytes(1, 'big') + len(names).to_bytes(4, 'big'))
+    nBytes = 0
+    missing = 0
+    for fName in names:
+        try:
+            path = storagePath(fName)
+            body = CACHE.get(path)
+            f = open(path, 'rb') if body is None else None
+        except (OSError, ValueError):
+            buffer += (0b010 << 5).to_bytes(1, 'big')
+            missing += 1
+            continue
+
+        try:
+            if f is not None:
+                st = os.fstat(f.fileno())
+                # small files are read into the buffer, and into the cache as for a GET
+                if st.st_size <= max(CHUNK_SIZE, CACHE.maxFile):
+                    body = f.read()
+                    if CACHE.maxBytes and len(body) <= CACHE.maxFile: CACHE.put(path, st, body)
+            if body is not None:
+                buffer += (0b001 << 5).to_bytes(1, 'big') + len(body).to_bytes(8, 'big') + body
+                nBytes += len(body)
+            else:
+                # a large file is sent from disk after what was gathered before it
+                clientSocket.sendall(buffer + (0b001 << 5).to_bytes(1, 'big') + st.st_size.to_bytes(8, 'big'))
+                buffer = bytearray()
+                nBytes += sendFile(clientSocket, f, 0, st.st_size)
+        finally:
+            if f is not None: f.close()
+
+        if len(buffer) >= BUNDLE_BUFFER:
+            clientSocket.sendall(buffer)
+            buffer = bytearray()
+
+    if buffer: clientSocket.sendall(buffer)
+    elapsed = time.perf_counter() - start
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** BGET REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print(f'  count:   {len(names)}')
+        print('***** BGET RESPONSE *****')
+        print('  resCode: 0b000-----')
+        print(f'  Data:    <{nBytes} bytes of {len(names) - missing} files sent>')
+
+    # always print atleast the command type and the number of files for BGET, with the download throughput
+    print(f'Client BGET request: {len(names)} files ({nBytes} bytes, {formatRate(nBytes, elapsed)})' + (f', {missing} not found' if missing else ''))
+
+    return b''
+
+# server calls replResponse() to handle a REPL request from another node of the cluster, storing or
+# deleting this node's copy of a file, a copy stored this way is not replicated further
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response, resCode 0b000 if the copy was stored or deleted, 0b101 if not
+def replResponse(byte1, clientSocket):
+
+    # kind (1 byte): 0 store, 1 delete, FL (1 byte), Filename
+    kind = recvExact(clientSocket, 1)[0]
+    fName = recvExact(clientSocket, recvExact(clientSocket, 1)[0]).decode()
+    fSize = 0
+    err = ''
+    match kind:
+        # store: FS (8 bytes) then data, committed like a PUT
+        case 0:
+            fSize = int.from_bytes(recvExact(clientSocket, 8), 'big')
+            try:
+                path = storagePath(fName)
+                f, tmpName = openTemp(path)
+            except (OSError, ValueError):
+                recvToFile(clientSocket, None, fSize)
+                err = 'ERROR: Could not store replica of "' + fName + '"'
+            else:
+                try:
+                    hasher = hashlib.sha256() if DEDUPE else None
+                    with f:
+                        recvToFile(clientSocket, f, fSize, hasher)
+                    commitFile(tmpName, path, hasher and hasher.hexdigest(), replicate=False)
+                    tmpName = None
+                except ConnectionError:
+                    raise
+                except OSError:
+                    err = 'ERROR: Could not store replica of "' + fName + '"'
+                finally:
+                    if tmpName is not None: discardTemp(tmpName)
+        # delete, the file may already be gone
+        case 1:
+            try:
+                removeFile(storagePath(fName))
+            except (OSError, ValueError):
+                err = 'ERROR: Could not delete replica of "' + fName + '"'
+        case _:
+            err = f'ERROR: Unknown REPL kind {kind}'
+
+    resCode = 0b000 if err == '' else 0b101
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** REPL REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print(f'  kind:    {kind}')
+        print( '  fName:   ' + fName)
+        if kind == 0: print(f'  FS:      0x{fSize:016X}')
+        print('***** REPL RESPONSE *****')
+        print(f'  resCode: 0b{resCode:03b}-----')
+
+    # always print atleast the command type and filename for REPL
+    print(f'Client REPL request: {["store", "delete"][kind] if kind < 2 else kind} {fName}')
+    if err != '': print(err)
+
+    return (resCode << 5).to_bytes(1, 'big')
+
+# server calls ringResponse() to tell a client the nodes of the cluster, to build the same hash ring
+# Arguments:
+#  - byte1: first byte received from client, integer value
+# Return:
+#  - response, resCode 0b000, replicas (1 byte), vnodes (2 bytes), count (2 bytes), then for each node
+#    its length (1 byte) and 'host:port', or resCode 0b010 if the server is not part of a cluster
+def ringResponse(byte1):
+
+    # print request and the response data when debug enabled
+    if traced():
+        print('***** RING REQUEST *****')
+        print(f'  opCode:  0b{byte1 >> 5:03b}{byte1 & 0x1F:05b}')
+        print('***** RING RESPONSE *****')
+        print(f'  resCode: 0b{0b000 if CLUSTER else 0b010:03b}-----')
+        if CLUSTER: print('  nodes:   ' + ', '.join(CLUSTER.nodes))
+
+    # always print atleast the command type for RING
+    print('Client RING request')
+
+    if CLUSTER is None:
+        return (0b010 << 5).to_bytes(1, 'big')
+    nodes = b''.join(len(node.encode()).to_bytes(1, 'big') + node.encode() for node in CLUSTER.nodes)
+    return (0b000 << 5).to_bytes(1, 'big') + REPLICAS.to_bytes(1, 'big') + CLUSTER.vnodes.to_bytes(2, 'big') + len(CLUSTER.nodes).to_bytes(2, 'big') + nodes
+
+# server calls extResponse() to dispatch an extended request, opCode 0b101, on its sub-opcode
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class
+# Return:
+#  - response to send to the client (in bytes array), empty if already sent
+def extResponse(byte1, clientSocket):
+
+    # sub-opcode in the bottom 5 bits of byte1
+    match byte1 & 0x1F:
+
+        # list stored files
+        case 0b00000: return listResponse(byte1, clientSocket)
+
+        # get a range of a file
+        case 0b00001: return rangeGetResponse(byte1, clientSocket)
+
+        # put a range of a file into its staging file
+        case 0b00010: return rangePutResponse(byte1, clientSocket)
+
+        # replace a file with its completed staging file
+        case 0b00011: return commitResponse(byte1, clientSocket)
+
+        # ranges of an interrupted upload already received
+        case 0b00100: return resumeResponse(byte1, clientSocket)
+
+        # content already stored, skip the upload
+        case 0b00101: return hasResponse(byte1, clientSocket)
+
+        # block signatures of a file, before a delta upload
+        case 0b00110: return sigsResponse(byte1, clientSocket)
+
+        # rebuild a file from blocks of the stored file and new data
+        case 0b00111: return deltaResponse(byte1, clientSocket)
+
+        # compression codecs supported
+        case 0b01000: return capsResponse(byte1)
+
+        # put a file sent as a compressed chunk stream
+        case 0b01001: return putxResponse(byte1, clientSocket)
+
+        # get a file as a compressed chunk stream
+        case 0b01010: return getxResponse(byte1, clientSocket)
+
+        # metrics of this process
+        case 0b01011: return statsResponse(byte1)
+
+        # one page of the stored files starting with a prefix
+        case 0b01100: return listPageResponse(byte1, clientSocket)
+
+        # metadata of one stored file
+        case 0b01101: return statResponse(byte1, clientSocket)
+
+        # many small files uploaded in one request
+        case 0b01110: return bputResponse(byte1, clientSocket)
+
+        # many small files downloaded in one request
+        case 0b01111: return bgetResponse(byte1, clientSocket)
+
+        # copy of a file stored or deleted by another node of the cluster
+        case 0b10000: return replResponse(byte1, clientSocket)
+
+        # nodes of the cluster
+        case 0b10001: return ringResponse(byte1)
+
+        # sub-opcode not recognized, send 0b011 "ERROR-Unknown Request" response
+        case _: return (0b011 << 5).to_bytes(1, 'big')
+
+# server calls handleRequest() to handle one client request, other than BYE, and record it in METRICS
+# bytes are counted by the socket wrappers, the response returned is counted here as it is sent by the caller
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, BufferedSocket, StreamSocket or MuxStream
+# Return:
+#  - response to send to the client (in bytes array), empty if already sent
+def handleRequest(byte1, clientSocket):
+
+    start = time.perf_counter()
+    received = getattr(clientSocket, 'received', 0)
+    sent = getattr(clientSocket, 'sent', 0)
+    response = None
+    METRICS.add('requests_in_flight', 1)
+    try:
+        response = dispatchRequest(byte1, clientSocket)
+        return response
+    finally:
+        METRICS.add('requests_in_flight', -1)
+        # 'not found' answers are normal results, only unknown, corrupted and failed requests count as errors
+        failed = response is None or (len(response) > 0 and response[0] >> 5 in (0b011, 0b100, 0b101))
+        METRICS.observe(opName(byte1), time.perf_counter() - start,
+                        getattr(clientSocket, 'received', 0) - received + 1,
+                        getattr(clientSocket, 'sent', 0) - sent + len(response or b''), failed)
+
+# server calls dispatchRequest() to dispatch one client request, other than BYE, to its response function
+# Arguments:
+#  - byte1: first byte received from client, integer value
+#  - clientSocket: client socket to receive data, socket class or StreamSocket
+# Return:
+#  - response to send to the client (in bytes array), empty if already sent
+def dispatchRequest(byte1, clientSocket):
+
+    # use top 3 bits of byte1, opCode, to determine how server handles request and formulates response
+    match byte1 >> 5:
+
+        # opCode 0b000 means PUT request, create PUT response
+        case 0b000: return putResponse(byte1, clientSocket)
+
+        # opCode 0b001 means GET request, create GET response
+        case 0b001: return getResponse(byte1, clientSocket)
+
+        # opCode 0b010 means CHANGE request, create CHANGE response
+        case 0b010: return changeResponse(byte1, clientSocket)
+
+        # opCode 0b011 means HELP request, create HELP response
+        case 0b011: return helpResponse(byte1, HELP_DATA)
+
+        # opCode 0b101 means extended request, the sub-opcode decides the response
+        case 0b101: return extResponse(byte1, clientSocket)
+
+        # default is that server did not recognize the opCode, send 0b011 "ERROR-Unknown Request" response
+        case _: return (0b011 << 5).to_bytes(1, 'big')
+
+# server calls serveClient() to respond to a connected client's requests until it sends BYE
+# Arguments:
+#  - clientSocket: accepted client socket, socket class or BufferedSocket
+#  - addr: address of the client, (IP, PORT) tuple
+def serveClient(clientSocket, addr):
+
+    # print IP address of new connection
+    print('New connection: ' + addr[0])
+    METRICS.add('connections', 1)
+
+    # a client disconnecting in the middle of a request ends its session
+    try:
         # loop until client send 'bye' command
         while True:
             # READ FIRST BYTE SENT BY CLIENT ONLY, contains the opCode which decides how
             # the server reacts to the rest of data inbound on socket
-            # convert the byte to integer as well
-            byte1 = int.from_bytes(clientSocket.recv(1), 'big')
+            byte1 = clientSocket.recv(1)
+            # no byte means the client closed the connection without sending 'bye'
+            if not byte1: break
+            # convert the byte to integer
+            byte1 = int.from_bytes(byte1, 'big')
+
+            # opCode 0b100 means BYE request, break while loop
+            if byte1 >> 5 == 0b100: break
+
+            # opCode 0b110 means hello, a v2 session runs until the connection is closed
+            if byte1 >> 5 == 0b110:
+                if serveMux(clientSocket, addr, byte1): break
+                continue
+
+            # create the response for any other request, a shutdown waits for it to be sent
+            global BUSY
+            BUSY = True
+            try:
+                response = handleRequest(byte1, clientSocket)
+
+                # send the response created above, GET responses with data are already sent and empty here
+                if response: clientSocket.sendall(response)
+            finally:
+                BUSY = False
+
+            # worker is shutting down, end the session between requests
+            if SHUTDOWN: break
+
+    except ConnectionError:
+        print('Connection lost: ' + addr[0])
+
+    # close connection to client and print IP address of closed client connection
+    clientSocket.close()
+    METRICS.add('connections', -1)
+    print('Closed Connection: ' + addr[0])
+
+# token bucket limiting a flow of bytes to rate bytes per second, with bursts of up to burst bytes
+# a caller reserves the bytes it is about to move and sleeps until the bucket has refilled them,
+# so several threads sharing a bucket are served in the order they asked
+class TokenBucket:
+
+    # Arguments:
+    #  - rate: bytes per second, float
+    #  - burst: bytes that can be moved at once after an idle period, float
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    # reserve n bytes and wait until they may be moved
+    # Arguments:
+    #  - n: number of bytes, integer
+    # Return:
+    #  - seconds waited, float
+    def take(self, n):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            # the bucket goes below 0 for a reservation larger than what it holds, later callers wait for it too
+            self.tokens -= n
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay > 0: time.sleep(delay)
+        return delay
+
+# deficit round-robin scheduler of the bytes all connections move under the global rate limit
+# each connection gets FAIR_QUANTUM bytes of credit per turn, so one moving a large file gets its share of
+# the rate and the others are delayed by at most a quantum per busy connection. As in fq_codel, a connection
+# that was idle goes before the busy ones for its first quantum, a small request is answered right away
+class FairScheduler:
+
+    # Arguments:
+    #  - rate: bytes per second shared by all connections, float
+    #  - burst: bytes that can be moved at once after an idle period, float
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.new = OrderedDict()    # connection -> deque of (bytes, Event) waiting, connections that were idle
+        self.old = OrderedDict()    # same, busy connections, in the order of their turns
+        self.credit = {}            # connection -> bytes it may still be granted in its turn
+        self.cond = threading.Condition()
+        self.thread = None
+
+    # wait for the turn of a connection to move n bytes
+    # Arguments:
+    #  - flow: connection the bytes are sent or received on, any hashable object
+    #  - n: number of bytes, integer
+    # Return:
+    #  - seconds waited, float
+    def acquire(self, flow, n):
+        start = time.monotonic()
+        granted = threading.Event()
+        with self.cond:
+            # the dispatcher thread is started on first use, and again in a forked worker
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.dispatch, daemon=True)
+                self.thread.start()
+            waiting = self.new.get(flow, self.old.get(flow))
+            if waiting is None:
+                waiting = self.new[flow] = deque()
+                self.credit[flow] = FAIR_QUANTUM
+            waiting.append((n, granted))
+            self.cond.notify()
+        granted.wait()
+        return time.monotonic() - start
+
+    # connections waiting for their turn
+    def waiting(self):
+        with self.cond:
+            return sum(1 for waiting in (*self.new.values(), *self.old.values()) if waiting)
+
+    # dispatcher thread, grants the connection whose turn it is what the global bucket allows
+    def dispatch(self):
+        while True:
+            with self.cond:
+                while not self.new and not self.old:
+                    self.cond.wait()
+                flows = self.new or self.old
+                flow, waiting = next(iter(flows.items()))
+                if not waiting or self.credit[flow] <= 0:
+                    del flows[flow]
+                    # out of credit, the next turn is at the back of the round with one more quantum
+                    if waiting:
+                        self.credit[flow] += FAIR_QUANTUM
+                        self.old[flow] = waiting
+                    # nothing to move, a connection that just went idle stays in the round once more so it
+                    # can't come back as new after each piece it sends
+                    elif flows is self.new:
+                        self.old[flow] = waiting
+                    else:
+                        del self.credit[flow]
+                    continue
+                n, granted = waiting.popleft()
+                self.credit[flow] -= n
+            self.bucket.take(n)
+            granted.set()
+
+SCHEDULER = None    # FairScheduler when the total rate is limited
+
+# wait until n more bytes may be sent or received on a connection, under its own rate limit then the total one
+# Arguments:
+#  - sock: BufferedSocket or StreamSocket of the connection
+#  - n: number of bytes, integer
+def throttle(sock, n):
+    if sock.bucket is not None:
+        METRICS.throttled('connection', sock.bucket.take(n))
+    if SCHEDULER is not None:
+        METRICS.throttled('total', SCHEDULER.acquire(sock, n))
+
+# pieces a send is split into when it is rate limited, so connections take turns every FAIR_QUANTUM bytes
+# Arguments:
+#  - sock: BufferedSocket or StreamSocket of the connection
+#  - count: number of bytes to send, integer
+# Return:
+#  - list of (start, length) of the pieces, a single piece when there are no limits
+def sendPieces(sock, count):
+    if sock.bucket is None and SCHEDULER is None:
+        return [(0, count)] if count > 0 else []
+    return [(start, min(FAIR_QUANTUM, count - start)) for start in range(0, count, FAIR_QUANTUM)]
+
+# token bucket of a new connection, None when connections are not rate limited
+def connectionBucket():
+    return TokenBucket(CONN_RATE, max(CHUNK_SIZE, CONN_RATE * RATE_BURST)) if CONN_RATE > 0 else None
+
+# socket wrapper reading ahead through a buffer, so a client sending many requests without
+# waiting for responses (pipelining) costs one recv() per buffer instead of several per request
+class BufferedSocket:
+
+    # Arguments:
+    #  - sock: accepted client socket, socket class
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb', buffering=CHUNK_SIZE)
+        self.received = 0   # bytes read and sent, for METRICS
+        self.sent = 0
+        self.bucket = connectionBucket()
+
+    # receive up to n bytes, from the buffer when it holds any, empty bytes when the client closed the connection
+    def recv(self, n):
+        data = self.reader.read1(n)
+        self.received += len(data)
+        throttle(self, len(data))
+        return data
+
+    # receive up to nbytes bytes into buf, returns the number of bytes received
+    def recv_into(self, buf, nbytes=0):
+        n = self.reader.readinto1(memoryview(buf)[:nbytes or len(buf)])
+        self.received += n
+        throttle(self, n)
+        return n
+
+    # send all data
+    def sendall(self, data):
+        view = memoryview(data)
+        for start, length in sendPieces(self, len(view)):
+            throttle(self, length)
+            self.sock.sendall(view[start:start + length])
+            self.sent += length
+
+    # send count bytes of file f starting at offset, zero-copy
+    def sendfile(self, f, offset=0, count=None):
+        if count is None: count = os.fstat(f.fileno()).st_size - offset
+        n = 0
+        for start, length in sendPieces(self, count):
+            throttle(self, length)
+            sent = self.sock.sendfile(f, offset + start, length)
+            n += sent
+            self.sent += sent
+            # the file got shorter than announced
+            if sent < length: break
+        return n
+
+    # set a socket option
+    def setsockopt(self, level, option, value):
+        self.sock.setsockopt(level, option, value)
+
+    # close the buffer and the socket
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+# one stream of a v2 connection, a socket-like object the response functions read requests from and
+# write responses to, as if it was a connection of its own
+class MuxStream:
+
+    # Arguments:
+    #  - mux: connection the stream belongs to, MuxConnection class
+    #  - streamId: ID of the stream, integer
+    def __init__(self, mux, streamId):
+        self.mux = mux
+        self.streamId = streamId
+        self.buffer = bytearray()   # data received and not read yet
+        self.eof = False            # the peer ended the stream, or the connection closed
+        self.closed = False         # this side ended the stream, data still arriving is dropped
+        self.cond = threading.Condition()
+        self.received = 0           # bytes read and sent, frame headers excluded, for METRICS
+        self.sent = 0
 
-            # use top 3 bits of byte1, opCode, to determine how server handles request and formulates response
-            match byte1 >> 5:
+    # add data received for the stream, called by the connection's reader
+    # waits while the stream is STREAM_BUFFER bytes ahead of its reader, so a slow upload can't fill memory
+    def feed(self, data):
+        with self.cond:
+            while len(self.buffer) >= STREAM_BUFFER and not self.closed:
+                self.cond.wait()
+            if not self.closed: self.buffer += data
+            self.cond.notify_all()
 
-                # opCode 0b000 means PUT request, create PUT response
-                case 0b000: response = putResponse(byte1, clientSocket)
+    # mark the end of the data of the stream, recv() returns empty bytes once the buffer is read
+    def finish(self):
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
 
-                # opCode 0b001 means GET request, create GET response
-                case 0b001: response = getResponse(byte1, clientSocket)
-                
-                # opCode 0b010 means CHANGE request, create CHANGE response
-                case 0b010: response = changeResponse(byte1, clientSocket)
+    # receive up to n bytes, empty bytes when the stream ended
+    def recv(self, n):
+        with self.cond:
+            while not self.buffer and not self.eof:
+                self.cond.wait()
+            data = bytes(self.buffer[:n])
+            del self.buffer[:n]
+            self.received += len(data)
+            self.cond.notify_all()
+            return data
 
-                # opCode 0b011 means HELP request, create HELP response
-                case 0b011: response = helpResponse(byte1, HELP_DATA)
-                
-                # opCode 0b100 means BYE request, break while loop
-                case 0b100: break
+    # receive up to nbytes bytes into buf, returns the number of bytes received
+    def recv_into(self, buf, nbytes=0):
+        data = self.recv(nbytes or len(buf))
+        buf[:len(data)] = data
+        return len(data)
 
-                # default is that server did not recognize the opCode, send 0b011 "ERROR-Unknown Request" response
-                case _: response = (0b011 << 5).to_bytes(1, 'big')
+    # send all data, as frames of at most FRAME_SIZE bytes so other streams can send in between
+    # no sendfile(), file data is read in chunks by sendFile() and sent through here
+    def sendall(self, data):
+        view = memoryview(data)
+        for start in range(0, len(view), FRAME_SIZE):
+            self.mux.sendFrame(self.streamId, 0, view[start:start + FRAME_SIZE])
+        self.sent += len(view)
 
-            # send the response created above
-            clientSocket.send(response)
+    # end this side of the stream
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.buffer.clear()
+            self.cond.notify_all()
+        self.mux.sendFrame(self.streamId, 0x01, b'')
 
-        # close connection to client and print IP address of closed client connection
-        clientSocket.close()
+# v2 connection, a writer thread sends the frames queued by the streams, taking one frame of each
+# stream in turn, so a stream sending a large file can't delay the others by more than a frame
+class MuxConnection:
+
+    # Arguments:
+    #  - sock: client socket, socket class, BufferedSocket or StreamSocket
+    def __init__(self, sock):
+        self.sock = sock
+        self.streams = {}   # stream ID -> MuxStream, of the streams being served
+        self.active = 0     # streams handling a request
+        self.lock = threading.Lock()    # held to read or change streams and active, stream threads end on their own
+        self.queues = OrderedDict()     # stream ID -> frames waiting to be sent, in the order streams take turns
+        self.cond = threading.Condition()
+        self.error = None   # error that stopped the writer, raised to the streams sending after it
+        self.stopped = False
+        self.writer = threading.Thread(target=self.writeFrames, daemon=True)
+        self.writer.start()
+
+    # queue one frame: stream ID (4 bytes), flags (1 byte), length (4 bytes), then payload
+    # waits while the stream already has 4 frames queued, a stream is never far ahead of the writer
+    def sendFrame(self, streamId, flags, payload):
+        frame = streamId.to_bytes(4, 'big') + flags.to_bytes(1, 'big') + len(payload).to_bytes(4, 'big') + bytes(payload)
+        with self.cond:
+            while len(self.queues.get(streamId, ())) >= 4 and self.error is None:
+                self.cond.wait()
+            if self.error is not None: raise self.error
+            self.queues.setdefault(streamId, []).append(frame)
+            self.cond.notify_all()
+
+    # writer thread, sends the first frame of the stream whose turn it is, until stop() and the queues are empty
+    def writeFrames(self):
+        while True:
+            with self.cond:
+                while not self.queues and not self.stopped:
+                    self.cond.wait()
+                if not self.queues: return
+                streamId, frames = self.queues.popitem(last=False)
+                frame = frames.pop(0)
+                # the stream goes to the back of the line if it has more to send
+                if frames: self.queues[streamId] = frames
+                self.cond.notify_all()
+            try:
+                self.sock.sendall(frame)
+            except OSError as e:
+                with self.cond:
+                    self.error = e
+                    self.queues.clear()
+                    self.cond.notify_all()
+                return
+
+    # send what is queued then stop the writer thread
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.writer.join()
+
+# serve the requests of one stream of a v2 connection, in its own thread, until it ends or sends BYE
+# Arguments:
+#  - mux: connection of the stream, MuxConnection class
+#  - stream: stream to serve, MuxStream class
+def serveStream(mux, stream):
+
+    global BUSY
+    METRICS.add('streams', 1)
+    try:
+        while True:
+            byte1 = stream.recv(1)
+            # the client ended the stream
+            if not byte1: break
+            byte1 = int.from_bytes(byte1, 'big')
+            # BYE ends the stream only, the connection stays open
+            if byte1 >> 5 == 0b100: break
+
+            # count the streams handling a request, a shutdown waits for them
+            with mux.lock:
+                mux.active += 1
+                BUSY = True
+            try:
+                response = handleRequest(byte1, stream)
+                if response: stream.sendall(response)
+            finally:
+                with mux.lock:
+                    mux.active -= 1
+                    BUSY = mux.active > 0
+
+            # worker is shutting down, end the stream between requests
+            if SHUTDOWN: break
+
+    # the stream ended in the middle of a request, or the connection was lost
+    except OSError:
+        pass
+
+    finally:
+        METRICS.add('streams', -1)
+        with mux.lock:
+            del mux.streams[stream.streamId]
+        try:
+            stream.close()
+            # the last request of a shutting down worker is done, ask the client to close the connection
+            if SHUTDOWN and mux.active == 0: mux.sendFrame(0, 0x01, b'')
+        except OSError:
+            pass
+
+# server calls serveMux() when a client sends a hello (opCode 0b110), the version asked for is answered
+# with the version used, for v2 every request from then on arrives in frames of a stream and each
+# stream is served in its own thread, so a long transfer doesn't hold up the requests of other streams
+# Arguments:
+#  - clientSocket: client socket, socket class, BufferedSocket or StreamSocket
+#  - addr: address of the client, (IP, PORT) tuple
+#  - byte1: hello byte received from client, integer value
+# Return:
+#  - True once a v2 session has ended and the connection must be closed,
+#    False if the client stays on v1
+def serveMux(clientSocket, addr, byte1):
+
+    version = min(byte1 & 0x1F, MUX_VERSION)
+    clientSocket.sendall(((0b110 << 5) + version).to_bytes(1, 'big'))
+    print(f'Protocol v{version}: ' + addr[0])
+    if version < 2:
+        return False
+
+    # keep little unsent data in the kernel, so frames of a new stream aren't queued behind megabytes of a large transfer
+    if TCP_NOTSENT_LOWAT is not None:
+        clientSocket.setsockopt(IPPROTO_TCP, TCP_NOTSENT_LOWAT, 128 * 1024)
+
+    mux = MuxConnection(clientSocket)
+    threads = []
+    # streams ended right away because MUX_STREAMS were being served, their frames are dropped until the client ends them
+    refused = set()
+    try:
+        while True:
+            # read the next frame header then its payload
+            header = recvExact(clientSocket, 9)
+            streamId = int.from_bytes(header[:4], 'big')
+            flags = header[4]
+            length = int.from_bytes(header[5:], 'big')
+            payload = recvExact(clientSocket, length) if length else b''
+
+            # FIN on stream 0, the client closes the connection
+            if streamId == 0: break
+
+            if streamId in refused:
+                if flags & 0x01: refused.discard(streamId)
+                continue
+
+            # streams are only added by this thread, they may end in theirs at any time
+            with mux.lock:
+                stream = mux.streams.get(streamId)
+                served = len(mux.streams)
+            if stream is None:
+                # FIN of a stream the server already ended
+                if not payload: continue
+                # too many streams, each takes a thread, this one is ended without an answer
+                if served >= MUX_STREAMS:
+                    print(f'Stream {streamId} refused, {MUX_STREAMS} streams already served: ' + addr[0])
+                    if not flags & 0x01: refused.add(streamId)
+                    mux.sendFrame(streamId, 0x01, b'')
+                    continue
+                # first frame of a new stream, served in its own thread
+                stream = MuxStream(mux, streamId)
+                with mux.lock:
+                    mux.streams[streamId] = stream
+                threads = [t for t in threads if t.is_alive()]
+                threads.append(threading.Thread(target=serveStream, args=(mux, stream), daemon=True))
+                threads[-1].start()
+
+            if payload: stream.feed(payload)
+            if flags & 0x01: stream.finish()
+
+    except ConnectionError:
+        print('Connection lost: ' + addr[0])
+
+    # the streams still being served see the end of their data, then end
+    finally:
+        with mux.lock:
+            streams = list(mux.streams.values())
+        for stream in streams:
+            stream.finish()
+        for t in threads:
+            t.join()
+        mux.stop()
+
+    return True
+
+# blocking engine, serves one client at a time until it sends BYE
+# Arguments:
+#  - serverSocket: bound and listening server socket, socket class
+def runBlockingServer(serverSocket):
+
+    # loop forever listening for clients, or until a worker is told to shut down
+    while not SHUTDOWN:
+        # block and wait for client connection to accept
+        clientSocket, addr = serverSocket.accept()
+        # send small responses right away, a GET header and its data are separate sends
+        # and Nagle's algorithm would hold the data until the header is acknowledged
+        clientSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        # requests are read through a buffer, pipelined requests are read ahead
+        serveClient(BufferedSocket(clientSocket), addr)
+
+# socket-like wrapper around asyncio streams, lets the blocking response functions run
+# unchanged in a worker thread while the event loop does the actual non-blocking I/O
+class StreamSocket:
+
+    # Arguments:
+    #  - reader: asyncio.StreamReader of the connection
+    #  - writer: asyncio.StreamWriter of the connection
+    #  - loop: event loop owning the streams
+    def __init__(self, reader, writer, loop):
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.received = 0   # bytes read and sent, for METRICS
+        self.sent = 0
+        self.bucket = connectionBucket()
+
+    # run a coroutine on the event loop and wait for its result from the worker thread
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    # receive up to n bytes, empty bytes when the client closed the connection
+    def recv(self, n):
+        data = self._run(self.reader.read(n))
+        self.received += len(data)
+        throttle(self, len(data))
+        return data
+
+    # receive up to nbytes bytes into buf, returns the number of bytes received
+    def recv_into(self, buf, nbytes=0):
+        data = self._run(self.reader.read(nbytes or len(buf)))
+        buf[:len(data)] = data
+        self.received += len(data)
+        throttle(self, len(data))
+        return len(data)
+
+    # send all data, waiting until the stream's write buffer has drained
+    def sendall(self, data):
+        async def write(piece):
+            self.writer.write(piece)
+            await self.writer.drain()
+        view = memoryview(data)
+        for start, length in sendPieces(self, len(view)):
+            throttle(self, length)
+            self._run(write(bytes(view[start:start + length])))
+            self.sent += length
+
+    # send count bytes of file f starting at offset, zero-copy when the event loop supports it
+    def sendfile(self, f, offset=0, count=None):
+        if count is None: count = os.fstat(f.fileno()).st_size - offset
+        n = 0
+        for start, length in sendPieces(self, count):
+            throttle(self, length)
+            sent = self._run(self.loop.sendfile(self.writer.transport, f, offset + start, length))
+            n += sent
+            self.sent += sent
+            # the file got shorter than announced
+            if sent < length: break
+        return n
+
+    # set a socket option
+    def setsockopt(self, level, option, value):
+        self.writer.get_extra_info('socket').setsockopt(level, option, value)
+
+# run a function in a new thread of its own and wait for its result without blocking the event loop
+# Arguments:
+#  - loop: running event loop
+#  - fn: function to run, then its arguments
+# Return:
+#  - what fn returned, or raises what it raised
+async def runInThread(loop, fn, *args):
+    future = loop.create_future()
+    # the future may have been cancelled with the connection's task
+    def settle(error, result):
+        if future.done(): return
+        if error is not None: future.set_exception(error)
+        else: future.set_result(result)
+    def run():
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(settle, e, None)
+        else:
+            loop.call_soon_threadsafe(settle, None, result)
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+# asyncio engine, called once per connection to respond to its requests until it sends BYE
+# waiting for the next request costs no thread, each request is handled in the executor pool. Its body is
+# read and its response sent by the same blocking functions as the blocking engine, through StreamSocket,
+# so a request holds a thread until its transfer is done: at most THREADS transfers run at once, the
+# requests of the other connections wait for a free thread
+# Arguments:
+#  - reader: asyncio.StreamReader of the connection
+#  - writer: asyncio.StreamWriter of the connection
+async def asyncServeClient(reader, writer):
+
+    loop = asyncio.get_running_loop()
+    addr = writer.get_extra_info('peername')
+    clientSocket = StreamSocket(reader, writer, loop)
+    # asyncio only sets TCP_NODELAY when the accepted socket reports IPPROTO_TCP, set it as the blocking engine does
+    clientSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+    # register the connection, idle ones are closed right away on shutdown
+    CONNECTIONS[writer] = False
+
+    # print IP address of new connection
+    print('New connection: ' + addr[0])
+    METRICS.add('connections', 1)
+
+    try:
+        # loop until client send 'bye' command
+        while True:
+            # wait for the first byte of the next request without blocking other connections
+            byte1 = await reader.read(1)
+            # no byte means the client closed the connection without sending 'bye'
+            if not byte1: break
+            byte1 = int.from_bytes(byte1, 'big')
+
+            # opCode 0b100 means BYE request, break while loop
+            if byte1 >> 5 == 0b100: break
+
+            # opCode 0b110 means hello, a v2 session reads its frames in a thread of its own until the connection is
+            # closed, outside the executor pool, so idle v2 connections don't take the threads of v1 requests
+            if byte1 >> 5 == 0b110:
+                CONNECTIONS[writer] = True
+                if await runInThread(loop, serveMux, clientSocket, addr, byte1): break
+                CONNECTIONS[writer] = False
+                continue
+
+            # create the response in a worker thread, with the same functions as the blocking engine
+            CONNECTIONS[writer] = True
+            response = await loop.run_in_executor(None, handleRequest, byte1, clientSocket)
+
+            # send the response created above, GET responses with data are already sent and empty here
+            if response:
+                writer.write(response)
+                await writer.drain()
+            CONNECTIONS[writer] = False
+
+            # worker is shutting down, end the session between requests
+            if SHUTDOWN: break
+
+    except ConnectionError:
+        print('Connection lost: ' + addr[0])
+
+    # a request that failed in an unexpected way ends its connection, the others keep being served
+    except Exception as e:
+        print(f'ERROR: {type(e).__name__}: {e}, closing connection: ' + addr[0])
+
+    # close connection to client and print IP address of closed client connection
+    finally:
+        del CONNECTIONS[writer]
+        METRICS.add('connections', -1)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
         print('Closed Connection: ' + addr[0])
 
+# asyncio engine, serves any number of clients at the same time
+# Arguments:
+#  - serverSocket: bound and listening server socket, socket class
+async def runAsyncioServer(serverSocket):
+
+    loop = asyncio.get_running_loop()
+    # pool of threads running the response functions, bounds how many requests are active at once
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=THREADS))
+
+    server = await asyncio.start_server(asyncServeClient, sock=serverSocket)
+
+    # stop accepting on SIGTERM, close idle connections and let active requests finish
+    stopped = asyncio.Event()
+    def stop():
+        global SHUTDOWN
+        SHUTDOWN = True
+        server.close()
+        for writer, busy in CONNECTIONS.items():
+            if not busy: writer.close()
+        stopped.set()
+    if hasattr(signal, 'SIGTERM') and os.name == 'posix':
+        loop.add_signal_handler(signal.SIGTERM, stop)
+
+    async with server:
+        await stopped.wait()
+
+    # drain: wait for the remaining connections to end their current request
+    deadline = loop.time() + DRAIN_TIMEOUT
+    while CONNECTIONS and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+
+# create the server socket, bound to PORT on all interfaces
+# Arguments:
+#  - port: port number to listen on, integer
+#  - backlog: max connections waiting to be accepted, integer
+#  - reusePort: allow several processes to bind the same port, the kernel spreads new connections between them
+# Return:
+#  - listening server socket, socket class
+def createServerSocket(port, backlog, reusePort=False):
+
+    # create server TCP socket
+    serverSocket = socket(AF_INET, SOCK_STREAM)
+    if reusePort:
+        from socket import SO_REUSEPORT
+        serverSocket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    # bind socket to IP and PORT, blank IP means use this computer's address
+    serverSocket.bind(('', port))
+    serverSocket.listen(backlog)
+    return serverSocket
+
+# SIGTERM handler of a blocking worker: an idle worker exits right away,
+# a busy one finishes its current request first, see serveClient()
+def stopWorker(signum, frame):
+    global SHUTDOWN
+    SHUTDOWN = True
+    if not BUSY: raise SystemExit(0)
+
+# run one server process with the chosen engine
+# Arguments:
+#  - engine: 'blocking' or 'asyncio', string
+#  - port: port number to listen on, integer
+#  - reusePort: True when the port is shared with other worker processes
+def runServer(engine, port, reusePort=False):
+
+    # print the cache counters on demand, ex: 'kill -USR1 <pid>'
+    if hasattr(signal, 'SIGUSR1'): signal.signal(signal.SIGUSR1, printCacheStats)
+    # a forked worker reports its own uptime, not the supervisor's
+    METRICS.start = time.time()
+
+    if engine == 'asyncio':
+        # many connections are served at once, let them queue while the event loop accepts
+        serverSocket = createServerSocket(port, 1024, reusePort)
+        asyncio.run(runAsyncioServer(serverSocket))
+    else:
+        # start listening, max 1 connection at a time, workers sharing the port queue more so
+        # connections spread to a busy worker wait instead of being refused
+        serverSocket = createServerSocket(port, 128 if reusePort else 1, reusePort)
+        if reusePort: signal.signal(signal.SIGTERM, stopWorker)
+        runBlockingServer(serverSocket)
+
+# start one worker process, the child never returns from this function
+# Arguments:
+#  - engine: 'blocking' or 'asyncio', string
+#  - port: port number to listen on, integer
+# Return:
+#  - pid of the worker process, integer
+def forkWorker(engine, port):
+
+    # flush before forking so buffered output isn't printed twice
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # worker: Ctrl+C in the terminal is handled by the supervisor, which sends SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    code = 0
+    try:
+        runServer(engine, port, reusePort=True)
+    except SystemExit as e:
+        code = e.code or 0
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        code = 1
+    os._exit(code)
+
+# supervisor of the prefork server: starts N workers sharing PORT with SO_REUSEPORT,
+# restarts any worker that dies, and on SIGINT/SIGTERM drains them and waits for them to exit
+# Arguments:
+#  - engine: 'blocking' or 'asyncio', string
+#  - port: port number to listen on, integer
+#  - nWorkers: number of worker processes, integer
+def runSupervisor(engine, port, nWorkers):
+
+    workers = {}    # pid -> time the worker was started
+    stopping = False
+
+    # forward shutdown to every worker, they finish their current requests and exit
+    def stop(signum, frame):
+        nonlocal stopping
+        if not stopping: print('Shutting down workers...')
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # every worker has its own cache, forward the request for their counters
+    def forward(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGUSR1, forward)
+
+    # every worker starts from the index built at startup, and replays what the others changed since
+    INDEX.share(INDEX_LOG)
+
+    for _ in range(nWorkers):
+        workers[forkWorker(engine, port)] = time.monotonic()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+
+        # worker died on its own, replace it, waiting a bit if it keeps crashing at startup
+        print(f'Worker {pid} exited with status {status}, restarting')
+        if time.monotonic() - started < 1:
+            time.sleep(1)
+        if not stopping:
+            workers[forkWorker(engine, port)] = time.monotonic()
+
+    print('server exit')
+
+############################## MAIN CODE ##############################
+
+# if this script was called directly, and not as module by another script
+if __name__ == '__main__':
+
+    # accept arguments when calling script
+    parser = argparse.ArgumentParser(description='Backend for FTP socket server', epilog='Requires Python 3.10 or higher to run')
+    parser.add_argument('port', type=int, help='Port number on which the server is listening')
+    parser.add_argument('-d', '--debug', action='store_const', const=1, default=0, help='Debug: print the header fields of requests and responses, sampled by --trace-rate')
+    parser.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE, help=f'Size in bytes of the buffer used to stream file data (default {CHUNK_SIZE})')
+    parser.add_argument('-e', '--engine', choices=['blocking', 'asyncio'], default='blocking', help='blocking: one client at a time, asyncio: many clients at the same time, at most --threads requests in progress')
+    parser.add_argument('-t', '--threads', type=int, default=THREADS, help=f'asyncio engine: max requests handled at the same time (default {THREADS})')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='Fork this many worker processes sharing the port with SO_REUSEPORT, restarted if they crash (default 0: single process)')
+    parser.add_argument('-u', '--dedupe', action='store_true', help='Store identical file contents once, clients can skip uploading content the server already has')
+    parser.add_argument('--layout', choices=list(LAYOUTS), default=STORAGE.layout, help="flat: files stored in the server directory by name, sharded: spread over hashed sub-directories, for millions of files (default flat)")
+    parser.add_argument('--cluster', metavar='NODES', help="Comma-separated 'host:port' of every server of the cluster, this one included, files are spread over them by consistent hashing (needs '-e asyncio' or '-w')")
+    parser.add_argument('--node', help="'host:port' of this server in --cluster (default: the one with this port)")
+    parser.add_argument('--replicas', type=int, default=REPLICAS, help=f'Cluster: number of servers storing each file (default {REPLICAS})')
+    parser.add_argument('--cache-size', type=float, default=CACHE_SIZE / 1024 / 1024, help=f'MB of small file bodies kept in memory for GETs, 0 to disable (default {CACHE_SIZE // 1024 // 1024})')
+    parser.add_argument('--cache-max-file', type=int, default=CACHE_MAX_FILE, help=f'Files bigger than this many bytes are never cached (default {CACHE_MAX_FILE})')
+    parser.add_argument('--durability', choices=['none', 'fsync', 'group'], default=DURABILITY, help="none: the OS writes uploads when it wants, fsync: each upload is on disk before it is answered, group: as fsync, concurrent uploads share directory flushes (default none)")
+    parser.add_argument('--group-commit-ms', type=float, default=GROUP_COMMIT_DELAY * 1000, help=f'group durability: milliseconds a directory flush waits for other uploads to join it (default {GROUP_COMMIT_DELAY * 1000:g})')
+    parser.add_argument('--trace-rate', type=int, default=TRACE_RATE, help=f'Debug: max requests traced per second, 0 traces every request (default {TRACE_RATE})')
+    parser.add_argument('--conn-rate', type=float, default=0, help='Max MB/s sent and received on each connection, 0 for no limit (default 0)')
+    parser.add_argument('--total-rate', type=float, default=0, help='Max MB/s sent and received on all connections together, shared fairly between them, 0 for no limit (default 0)')
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT, help=f'Seconds workers wait for active requests on shutdown (default {DRAIN_TIMEOUT})')
+    sysArgs = parser.parse_args()
+
+    # define input, constants
+    SERVER_PORT = sysArgs.port
+    DEBUG = sysArgs.debug
+    TRACE_RATE = max(0, sysArgs.trace_rate)
+    CHUNK_SIZE = max(1, sysArgs.chunk_size)
+    THREADS = max(1, sysArgs.threads)
+    DRAIN_TIMEOUT = sysArgs.drain_timeout
+    DEDUPE = sysArgs.dedupe
+    STORAGE = LAYOUTS[sysArgs.layout]()
+    CACHE_SIZE = max(0, int(sysArgs.cache_size * 1024 * 1024))
+    CACHE_MAX_FILE = max(0, sysArgs.cache_max_file)
+    CACHE = FileCache(CACHE_SIZE, CACHE_MAX_FILE)
+    DURABILITY = sysArgs.durability
+    GROUP_COMMIT_DELAY = max(0, sysArgs.group_commit_ms / 1000)
+    COMMITTER = GroupCommitter(GROUP_COMMIT_DELAY)
+    # rate limits, in bytes per second, workers each get an equal share of the total
+    CONN_RATE = max(0, sysArgs.conn_rate * 1024 * 1024)
+    TOTAL_RATE = max(0, sysArgs.total_rate * 1024 * 1024) / max(1, sysArgs.workers)
+    if TOTAL_RATE > 0: SCHEDULER = FairScheduler(TOTAL_RATE, max(CHUNK_SIZE, TOTAL_RATE * RATE_BURST))
+
+    # cluster mode, nodes replicate to each other while serving their own clients, one client at a time would deadlock
+    if sysArgs.cluster is not None:
+        nodes = [node.strip() for node in sysArgs.cluster.split(',') if node.strip()]
+        NODE = sysArgs.node or next((node for node in nodes if node.rpartition(':')[2] == str(SERVER_PORT)), None)
+        if NODE not in nodes:
+            parser.error("--node must be one of the --cluster nodes, 'host:port'")
+        if sysArgs.engine == 'blocking' and sysArgs.workers == 0:
+            parser.error("--cluster needs a server serving several clients at once, '-e asyncio' or '-w N'")
+        REPLICAS = max(1, min(sysArgs.replicas, len(nodes)))
+        CLUSTER = HashRing(nodes, VNODES)
+        print(f'Cluster: node {NODE} of {len(nodes)}, {REPLICAS} replicas of each file')
+
+    # files stored with the other layout would not be found, they are moved over by migrate.py
+    if STORAGE.foreign():
+        parser.error(f'the server directory holds files of another layout, run: python3 migrate.py . {STORAGE.layout}')
+
+    # blobs no name links to anymore are left behind when names are overwritten, clean them at startup
+    if DEDUPE:
+        print(f'Dedupe store: {collectBlobs()} unused blobs deleted')
+
+    # index the stored files once, LIST and STAT are answered from memory
+    start = time.perf_counter()
+    print(f'Index: {INDEX.build()} files ({time.perf_counter() - start:.2f} s)')
+
+    # prefork needs os.fork and SO_REUSEPORT
+    if sysArgs.workers > 0 and not hasattr(os, 'fork'):
+        parser.error('--workers is only supported on POSIX systems')
+
+    # several worker processes, each running the chosen engine on the same port
+    if sysArgs.workers > 0:
+        print(f'Server listening on {gethostbyname(gethostname())}:{SERVER_PORT} ({sysArgs.workers} {sysArgs.engine} workers)')
+        runSupervisor(sysArgs.engine, SERVER_PORT, sysArgs.workers)
+
+    # single process
+    else:
+        print(f'Server listening on {gethostbyname(gethostname())}:{SERVER_PORT}' + (' (asyncio engine)' if sysArgs.engine == 'asyncio' else ''))
+        runServer(sysArgs.engine, SERVER_PORT)
+
     # close server socket :
-    ### the server is always listening to accept new connections and doesnt
+    ### a single server process is always listening to accept new connections and doesnt
     ### accept user input for quitting, so the code execution never reaches this point.
     ### Therefore the following two lines are unnecessary and have been commented out.
     #server.close()
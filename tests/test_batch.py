@@ -0,0 +1,50 @@
+################################################################################
+#   Filename:       test_batch.py
+#
+#   Description:    Round trips of batch mode, '-b FILE', several requests
+#                   sent before their responses are read.
+#                   - PUTs, GETs and CHANGEs of many files, with a window of
+#                     one request and of many, on both server engines
+#                   - Commands batch mode can't run are skipped, not sent
+#
+################################################################################
+import os, unittest
+
+from testutil import ServerTestCase, writeRandom, readFile
+
+FILES = 30
+
+class BatchTest(ServerTestCase):
+
+    # write the commands to a batch file, run it with some client arguments
+    def batch(self, commands, *args):
+        with open(os.path.join(self.clientDir, 'batch.txt'), 'w') as f:
+            f.write('\n'.join(commands) + '\n')
+        return self.client(args=('-b', 'batch.txt', *args))
+
+    def testRoundTrip(self):
+        for window in ('1', '16'):
+            with self.subTest(window=window):
+                data = {f'f{i}': writeRandom(os.path.join(self.clientDir, f'f{i}'), 500 * i) for i in range(FILES)}
+                out = self.batch([f'put {name}' for name in data] + ['put -r f0', 'ls'], '-w', window)
+                self.assertEqual(out.count('uploaded successfully'), FILES, out)
+                self.assertIn("'put -r' is not supported in batch mode", out)
+                self.assertIn("'ls' is not supported in batch mode", out)
+                for name in data:
+                    self.assertEqual(readFile(os.path.join(self.serverDir, name)), data[name], name)
+
+                for name in data: os.remove(os.path.join(self.clientDir, name))
+                out = self.batch([f'get {name}' for name in data] + [f'change f{i} g{i}' for i in range(FILES)], '-w', window)
+                self.assertEqual(out.count('downloaded successfully'), FILES, out)
+                for name in data:
+                    self.assertEqual(readFile(os.path.join(self.clientDir, name)), data[name], name)
+                    self.assertFalse(os.path.exists(os.path.join(self.serverDir, name)), name)
+                    self.assertEqual(readFile(os.path.join(self.serverDir, 'g' + name[1:])), data[name], name)
+                for name in data: os.remove(os.path.join(self.serverDir, 'g' + name[1:]))
+
+class AsyncBatchTest(BatchTest):
+
+    serverArgs = ('-e', 'asyncio')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+################################################################################
+#   Filename:       test_cluster.py
+#
+#   Description:    Round trips through a cluster of 3 nodes storing each file
+#                   on 2 of them.
+#                   - PUTs from a cluster client, and from a plain client to a
+#                     node that forwards them, end up on exactly the owners
+#                   - Files are read from the other replica with a node down
+#                   - A CHANGE moves a file to the owners of its new name
+#
+################################################################################
+import os, sys, shutil, tempfile, unittest
+
+from testutil import ROOT, runClient, writeRandom, readFile, startServer, stopServer
+from benchutil import freePort
+
+sys.path.insert(0, os.path.join(ROOT, 'client'))
+from client import HashRing
+
+REPLICAS = 2
+
+class ClusterTest(unittest.TestCase):
+
+    def setUp(self):
+        ports = [freePort() for _ in range(3)]
+        self.ports = dict(zip([f'127.0.0.1:{port}' for port in ports], ports))
+        self.ring = HashRing(list(self.ports), 64)
+        self.dirs = {node: tempfile.mkdtemp() for node in self.ports}
+        self.procs = {}
+        for node, port in self.ports.items():
+            self.addCleanup(shutil.rmtree, self.dirs[node], True)
+            self.procs[node], _ = startServer(self.dirs[node], '-e', 'asyncio', '--cluster', ','.join(self.ports),
+                                              '--replicas', str(REPLICAS), port=port)
+        self.addCleanup(lambda: [stopServer(proc) for proc in self.procs.values()])
+        self.clientDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.clientDir, True)
+
+    # nodes whose directory holds a name, and check they hold data
+    def holders(self, name, data):
+        found = {node for node, directory in self.dirs.items() if os.path.isfile(os.path.join(directory, name))}
+        for node in found:
+            self.assertEqual(readFile(os.path.join(self.dirs[node], name)), data, f'{name} on {node}')
+        return found
+
+    def testPlacement(self):
+        data = {f'f{i}': writeRandom(os.path.join(self.clientDir, f'f{i}'), 1000 * i) for i in range(12)}
+        first = list(self.ports)[0]
+        # half through the cluster client, half through a plain client, forwarded by the node it is connected to
+        runClient(self.ports[first], [f'put f{i}' for i in range(6)], self.clientDir, '--cluster')
+        runClient(self.ports[first], [f'put f{i}' for i in range(6, 12)], self.clientDir)
+        for name in data:
+            self.assertEqual(self.holders(name, data[name]), set(self.ring.owners(name, REPLICAS)), name)
+
+        # with a node down, each file is read from its other replica
+        down = first
+        stopServer(self.procs.pop(down))
+        for name in data: os.remove(os.path.join(self.clientDir, name))
+        up = list(self.ports)[1]
+        runClient(self.ports[up], [f'get {name}' for name in data], self.clientDir, '--cluster')
+        for name in data:
+            self.assertEqual(readFile(os.path.join(self.clientDir, name)), data[name], name)
+
+    def testChange(self):
+        data = writeRandom(os.path.join(self.clientDir, 'old'), 5000)
+        port = list(self.ports.values())[0]
+        runClient(port, ['put old', 'change old moved/new'], self.clientDir, '--cluster')
+        self.assertEqual(self.holders('old', data), set())
+        self.assertEqual(self.holders('moved/new', data), set(self.ring.owners('moved/new', REPLICAS)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+################################################################################
+#   Filename:       test_delta.py
+#
+#   Description:    Round trips of delta uploads, 'put -d', the server
+#                   rebuilds the new version from its blocks and the data
+#                   sent.
+#                   - Bytes inserted, removed and overwritten in the middle,
+#                     blocks moved and repeated, the file cut short or emptied
+#                   - A file not yet on the server is sent whole
+#
+################################################################################
+import os, re, unittest
+
+from testutil import ServerTestCase, writeRandom, readFile
+
+SIZE = 1024 * 1024
+
+class DeltaTest(ServerTestCase):
+
+    # store old on the server, upload new with 'put -d', check what the server rebuilt
+    # Return:
+    #  - (reused, sent): bytes reused from the stored file and bytes of new data sent
+    def delta(self, old, new):
+        with open(os.path.join(self.serverDir, 'f.bin'), 'wb') as f:
+            f.write(old)
+        with open(os.path.join(self.clientDir, 'f.bin'), 'wb') as f:
+            f.write(new)
+        out = self.client('put -d f.bin')
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'f.bin')), new, out)
+        found = re.search(r'\((\d+) bytes reused, (\d+) bytes sent', out)
+        self.assertIsNotNone(found, out)
+        return int(found[1]), int(found[2])
+
+    def testInsert(self):
+        old = os.urandom(SIZE)
+        reused, sent = self.delta(old, old[:SIZE // 2] + b'inserted' + old[SIZE // 2:])
+        self.assertGreater(reused, SIZE * 9 // 10)
+        self.assertLess(sent, SIZE // 10)
+
+    def testRemoveAndOverwrite(self):
+        old = os.urandom(SIZE)
+        new = bytearray(old[:1000] + old[5000:])
+        new[SIZE // 3:SIZE // 3 + 100] = os.urandom(100)
+        reused, sent = self.delta(old, bytes(new))
+        self.assertGreater(reused, SIZE * 9 // 10)
+
+    def testMovedAndRepeatedBlocks(self):
+        old = os.urandom(SIZE)
+        self.delta(old, old[SIZE // 2:] + old[:SIZE // 2] + old[:SIZE // 4])
+
+    def testShorter(self):
+        old = os.urandom(SIZE)
+        self.delta(old, old[:12345])
+        self.delta(old, b'')
+
+    def testNotStored(self):
+        new = writeRandom(os.path.join(self.clientDir, 'g.bin'), 100000)
+        out = self.client('put -d g.bin')
+        self.assertIn('(0 bytes reused, 100000 bytes sent', out)
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'g.bin')), new)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+################################################################################
+#   Filename:       test_layout.py
+#
+#   Description:    Round trips through the storage layouts of server.py.
+#                   - Starts a sharded server in a fresh server directory
+#                     holding its scripts, like README Step 1
+#                   - Migrates a flat directory holding the scripts to the
+#                     sharded layout and back, files stay readable
+#
+################################################################################
+import os, sys, shutil, subprocess, tempfile, unittest
+
+from testutil import ROOT, runClient, writeRandom, readFile, startServer, stopServer
+
+SCRIPTS = ('server.py', 'migrate.py')
+
+# server directory set up like README Step 1, with the scripts copied into it
+# Arguments:
+#  - test: test the directory is deleted after, unittest.TestCase class
+# Return:
+#  - path of the directory, string
+def scriptDirectory(test):
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory, True)
+    for script in SCRIPTS:
+        shutil.copy(os.path.join(ROOT, 'server', script), directory)
+    return directory
+
+# run the migrate.py copied into a server directory
+# Arguments:
+#  - directory: server directory, string
+#  - layout: layout to move the files to, string
+# Return:
+#  - what migrate.py printed, string
+def migrate(directory, layout):
+    return subprocess.run([sys.executable, 'migrate.py', '.', layout], cwd=directory,
+                          capture_output=True, text=True, check=True, timeout=60).stdout
+
+class LayoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.serverDir = scriptDirectory(self)
+        self.clientDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.clientDir, True)
+
+    def testFreshShardedServer(self):
+        # the scripts next to an empty sharded store are not files of the flat layout
+        proc, port = startServer(self.serverDir, '--layout', 'sharded')
+        self.addCleanup(stopServer, proc)
+        data = writeRandom(os.path.join(self.clientDir, 'a.bin'), 100000)
+        runClient(port, ['put a.bin'], self.clientDir)
+        os.remove(os.path.join(self.clientDir, 'a.bin'))
+        out = runClient(port, ['get a.bin'], self.clientDir)
+        self.assertEqual(readFile(os.path.join(self.clientDir, 'a.bin')), data, out)
+        self.assertFalse(os.path.exists(os.path.join(self.serverDir, 'a.bin')))
+
+    def testMigrateWithScripts(self):
+        files = {'a.txt': 1000, 'd/b.bin': 200000, 'd/e/c': 0}
+        data = {name: writeRandom(os.path.join(self.serverDir, name), size) for name, size in files.items()}
+        # a cache of the scripts, like the one importing server.py from migrate.py leaves
+        os.makedirs(os.path.join(self.serverDir, '__pycache__'))
+
+        out = migrate(self.serverDir, 'sharded')
+        self.assertIn(f'{len(files)} files moved', out)
+        for name in SCRIPTS + ('__pycache__',):
+            self.assertTrue(os.path.exists(os.path.join(self.serverDir, name)), name)
+        self.assertEqual(sorted(n for n in os.listdir(self.serverDir) if not n.startswith('.')), sorted(SCRIPTS + ('__pycache__',)))
+        self.assertTrue(os.path.isdir(os.path.join(self.serverDir, '.shards')))
+
+        # the sharded server starts in the migrated directory and serves the moved files
+        proc, port = startServer(self.serverDir, '--layout', 'sharded')
+        try:
+            runClient(port, [f'get {name}' for name in files], self.clientDir)
+        finally:
+            stopServer(proc)
+        for name in files:
+            self.assertEqual(readFile(os.path.join(self.clientDir, name)), data[name], name)
+
+        # and back, the scripts are still where they were
+        out = migrate(self.serverDir, 'flat')
+        self.assertIn(f'{len(files)} files moved', out)
+        for name in files:
+            self.assertEqual(readFile(os.path.join(self.serverDir, name)), data[name], name)
+        for name in SCRIPTS:
+            self.assertEqual(readFile(os.path.join(self.serverDir, name)), readFile(os.path.join(ROOT, 'server', name)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+################################################################################
+#   Filename:       test_mux.py
+#
+#   Description:    Round trips of protocol v2, requests multiplexed on the
+#                   streams of one connection.
+#                   - Frames written by hand: hello, a request split over two
+#                     frames, FIN of a stream and of the connection
+#                   - Many streams of the client's MuxConnection sending GETs
+#                     and PUTs at the same time
+#                   - On the blocking and the asyncio engine
+#
+################################################################################
+import os, sys, threading, unittest
+from socket import create_connection
+
+from testutil import ROOT, ServerTestCase, writeRandom, readFile
+
+sys.path.insert(0, os.path.join(ROOT, 'client'))
+import client
+
+# frame: stream ID (4 bytes), flags (1 byte), length (4 bytes), then payload
+# Arguments:
+#  - streamId: ID of the stream, integer
+#  - flags: 0x01 for FIN, integer
+#  - payload: data of the frame, bytes
+# Return:
+#  - the frame, bytes
+def frame(streamId, flags, payload=b''):
+    return streamId.to_bytes(4, 'big') + flags.to_bytes(1, 'big') + len(payload).to_bytes(4, 'big') + payload
+
+# GET request of a name, as client.py sends it
+# Arguments:
+#  - name: filename, string
+# Return:
+#  - the request, bytes
+def getRequest(name):
+    return ((0b001 << 5) + len(name)).to_bytes(1, 'big') + name.encode()
+
+class MuxTest(ServerTestCase):
+
+    def testFrames(self):
+        data = writeRandom(os.path.join(self.serverDir, 'f.bin'), 100000)
+        with create_connection(('127.0.0.1', self.port), timeout=30) as sock:
+            # hello for v2, answered with the version used
+            sock.sendall(((0b110 << 5) + 2).to_bytes(1, 'big'))
+            self.assertEqual(client.recvExact(sock, 1)[0], (0b110 << 5) + 2)
+
+            # a GET whose request is split over two frames of stream 5
+            request = getRequest('f.bin')
+            sock.sendall(frame(5, 0, request[:3]) + frame(5, 0, request[3:]))
+            expected = ((0b001 << 5) + 5).to_bytes(1, 'big') + b'f.bin' + len(data).to_bytes(4, 'big') + data
+            received = b''
+            while len(received) < len(expected):
+                header = client.recvExact(sock, 9)
+                self.assertEqual(int.from_bytes(header[:4], 'big'), 5)
+                self.assertEqual(header[4], 0)
+                received += client.recvExact(sock, int.from_bytes(header[5:], 'big'))
+            self.assertEqual(received, expected)
+
+            # FIN of the stream is answered with FIN, then FIN of stream 0 closes the connection
+            sock.sendall(frame(5, 0x01))
+            self.assertEqual(client.recvExact(sock, 9), frame(5, 0x01))
+            sock.sendall(frame(0, 0x01))
+            self.assertEqual(sock.recv(1), b'')
+
+    def testStreams(self):
+        count = 20
+        data = [writeRandom(os.path.join(self.serverDir, f'g{i}'), 1000 * i) for i in range(count)]
+        uploads = [os.urandom(3000 * i) for i in range(count)]
+        results = {}
+
+        with create_connection(('127.0.0.1', self.port), timeout=30) as sock:
+            self.assertEqual(client.helloRequest(sock), 2)
+            mux = client.MuxConnection(sock)
+
+            # each stream gets a file then puts another one, all streams at the same time
+            def run(i):
+                stream = mux.open()
+                stream.sendall(getRequest(f'g{i}'))
+                byte1 = client.recvExact(stream, 1)[0]
+                client.recvExact(stream, byte1 & 0x1F)
+                got = client.recvExact(stream, int.from_bytes(client.recvExact(stream, 4), 'big'))
+                stream.sendall(((0b000 << 5) + len(f'p{i}')).to_bytes(1, 'big') + f'p{i}'.encode()
+                               + len(uploads[i]).to_bytes(4, 'big') + uploads[i])
+                results[i] = (got, client.recvExact(stream, 1)[0] >> 5)
+                stream.close()
+
+            threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+            for t in threads: t.start()
+            for t in threads: t.join(60)
+            mux.close()
+
+        for i in range(count):
+            self.assertEqual(results[i], (data[i], 0b000), i)
+            self.assertEqual(readFile(os.path.join(self.serverDir, f'p{i}')), uploads[i], i)
+
+class AsyncMuxTest(MuxTest):
+
+    serverArgs = ('-e', 'asyncio')
+
+if __name__ == '__main__':
+    unittest.main()
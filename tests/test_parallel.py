@@ -0,0 +1,85 @@
+################################################################################
+#   Filename:       test_parallel.py
+#
+#   Description:    Round trips of the commands using parallel connections,
+#                   'put -r', 'get -r', 'put -n' and 'get -n'.
+#                   - With the asyncio engine, over several connections, large
+#                     files sent from disk and not printed in debug mode
+#                   - With the default engine serving one client at a time,
+#                     over the connection already open, without waiting for
+#                     the other connections to time out
+#
+################################################################################
+import os, sys, time, unittest
+from socket import create_connection
+
+from testutil import ROOT, ServerTestCase, writeRandom, readFile
+
+sys.path.insert(0, os.path.join(ROOT, 'client'))
+import client
+
+# files of a directory tree, small ones bundled and larger ones sent on their own
+TREE = {'tr/a': 100, 'tr/b': 0, 'tr/d/c': 70000, 'tr/d/e/f': 5000}
+
+class ParallelTest(ServerTestCase):
+
+    serverArgs = ('-e', 'asyncio')
+
+    def testTree(self):
+        data = {name: writeRandom(os.path.join(self.clientDir, name), size) for name, size in TREE.items()}
+        out = self.client('put -r tr')
+        self.assertIn(f'{len(TREE)} files uploaded, 0 failed', out)
+        for name in TREE:
+            self.assertEqual(readFile(os.path.join(self.serverDir, name)), data[name], name)
+
+        for name in TREE: os.remove(os.path.join(self.clientDir, name))
+        out = self.client('get -r tr')
+        self.assertIn(f'{len(TREE)} files downloaded, 0 failed', out)
+        for name in TREE:
+            self.assertEqual(readFile(os.path.join(self.clientDir, name)), data[name], name)
+
+    def testLargeFile(self):
+        # sent from the file, and not printed, in debug mode
+        data = writeRandom(os.path.join(self.clientDir, 'big', 'f.bin'), 20 * 1024 * 1024)
+        out = self.client('put -r big', args=('-d',))
+        self.assertIn('1 files uploaded, 0 failed', out)
+        self.assertLess(len(out), 10000)
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'big', 'f.bin')), data)
+
+    def testGrownBundleFile(self):
+        # listed small, bigger than a bundled file by the time the bundle is sent
+        small = writeRandom(os.path.join(self.clientDir, 'a'), 100)
+        grown = writeRandom(os.path.join(self.clientDir, 'b'), 5 * client.BUNDLE_MAX_FILE)
+        cwd = os.getcwd()
+        os.chdir(self.clientDir)
+        try:
+            with create_connection(('127.0.0.1', self.port)) as sock:
+                self.assertEqual(client.putBundle(sock, [('a', 100), ('b', 100)]), [True, True])
+                sock.sendall((0b100 << 5).to_bytes(1, 'big'))
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'a')), small)
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'b')), grown)
+
+    def testRanges(self):
+        data = writeRandom(os.path.join(self.clientDir, 'f.bin'), 3 * 1024 * 1024)
+        self.assertIn('uploaded successfully over 3 stream(s)', self.client('put -n 3 f.bin'))
+        os.remove(os.path.join(self.clientDir, 'f.bin'))
+        self.assertIn('downloaded successfully over 3 stream(s)', self.client('get -n 3 f.bin'))
+        self.assertEqual(readFile(os.path.join(self.clientDir, 'f.bin')), data)
+
+# the same commands against a server serving one client at a time
+class OneClientTest(ParallelTest):
+
+    serverArgs = ()
+
+    def client(self, *commands, args=()):
+        start = time.monotonic()
+        out = super().client(*commands, args=args)
+        # well before TIMEOUT, the parallel connections are not waited for
+        self.assertLess(time.monotonic() - start, 15, out)
+        self.assertIn('Server serves one client at a time', out)
+        return out
+
+if __name__ == '__main__':
+    unittest.main()
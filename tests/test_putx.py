@@ -0,0 +1,66 @@
+################################################################################
+#   Filename:       test_putx.py
+#
+#   Description:    Round trips of compressed and checked transfers, PUTX and
+#                   GETX chunk streams ('-z' and '-s' of client.py).
+#                   - Each codec and digest, on compressible and random data
+#                   - A PUTX whose digest doesn't match its data is refused
+#                     and the stored file is kept
+#
+################################################################################
+import os, sys, zlib, unittest
+from socket import create_connection
+
+from testutil import ROOT, ServerTestCase, writeRandom, readFile
+
+sys.path.insert(0, os.path.join(ROOT, 'client'))
+import client
+
+# compressible data, a few hundred KB of repeated text
+TEXT = b''.join(b'line %d of a compressible file\n' % (i % 500) for i in range(20000))
+
+class PutxTest(ServerTestCase):
+
+    # put then get a file with some client arguments, check both copies
+    def roundTrip(self, data, args):
+        with open(os.path.join(self.clientDir, 'f.bin'), 'wb') as f:
+            f.write(data)
+        out = self.client('put f.bin', args=args)
+        self.assertIn('uploaded successfully', out)
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'f.bin')), data, out)
+        os.remove(os.path.join(self.clientDir, 'f.bin'))
+        out = self.client('get f.bin', args=args)
+        self.assertIn('downloaded successfully', out)
+        self.assertEqual(readFile(os.path.join(self.clientDir, 'f.bin')), data, out)
+        return out
+
+    def testCodecs(self):
+        for codec in client.CODECS.values():
+            if codec == 'none': continue
+            with self.subTest(codec=codec):
+                self.roundTrip(TEXT, ('-z', codec))
+                self.roundTrip(os.urandom(200000), ('-z', codec))
+                self.roundTrip(b'', ('-z', codec))
+
+    def testDigests(self):
+        for digest in client.DIGESTS.values():
+            if digest == 'none': continue
+            with self.subTest(digest=digest):
+                out = self.roundTrip(TEXT, ('-z', 'zlib', '-s', digest))
+                self.assertIn(f'{digest} checked', out)
+                self.roundTrip(os.urandom(200000), ('-s', digest))
+
+    def testDigestMismatch(self):
+        stored = writeRandom(os.path.join(self.serverDir, 'f.bin'), 1000)
+        data = os.urandom(5000)
+        with create_connection(('127.0.0.1', self.port)) as sock:
+            # PUTX of f.bin, uncompressed with a crc32 digest of other data
+            sock.sendall(((0b101 << 5) + 0b01001).to_bytes(1, 'big') + b'\x05f.bin' + len(data).to_bytes(8, 'big')
+                         + ((1 << 4) + 0).to_bytes(1, 'big') + len(data).to_bytes(4, 'big') + data
+                         + b'\x00\x00\x00\x00' + (zlib.crc32(data) ^ 1).to_bytes(4, 'big'))
+            self.assertEqual(client.recvExact(sock, 1)[0] >> 5, 0b100)
+            sock.sendall((0b100 << 5).to_bytes(1, 'big'))
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'f.bin')), stored)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+################################################################################
+#   Filename:       test_ranges.py
+#
+#   Description:    Round trips of ranged transfers, 'put -n' and 'get -n'.
+#                   - Uploads and downloads a file over several streams,
+#                     replacing a different local or stored file
+#                   - A download with a failing range leaves the local file
+#                     as it was, and no part file
+#
+################################################################################
+import os, sys, io, contextlib, unittest
+from socket import create_connection
+
+from testutil import ROOT, ServerTestCase, writeRandom, readFile
+from benchutil import freePort
+
+sys.path.insert(0, os.path.join(ROOT, 'client'))
+import client
+
+SIZE = 5 * 1024 * 1024 + 123    # several MIN_SEGMENT ranges, the last one shorter
+
+class RangeTest(ServerTestCase):
+
+    serverArgs = ('-e', 'asyncio')
+
+    def testPutMulti(self):
+        writeRandom(os.path.join(self.serverDir, 'f.bin'), 1000)
+        data = writeRandom(os.path.join(self.clientDir, 'f.bin'), SIZE)
+        out = self.client('put -n 4 f.bin')
+        self.assertIn('uploaded successfully over 4 stream(s)', out)
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'f.bin')), data)
+
+    def testGetMulti(self):
+        data = writeRandom(os.path.join(self.serverDir, 'f.bin'), SIZE)
+        writeRandom(os.path.join(self.clientDir, 'f.bin'), SIZE + 1000)
+        out = self.client('get -n 3 f.bin')
+        self.assertIn('downloaded successfully over 3 stream(s)', out)
+        self.assertEqual(readFile(os.path.join(self.clientDir, 'f.bin')), data)
+        self.assertFalse(os.path.exists(os.path.join(self.clientDir, 'f.bin.part')))
+
+    def testGetMultiFailedRange(self):
+        writeRandom(os.path.join(self.serverDir, 'f.bin'), SIZE)
+        local = writeRandom(os.path.join(self.clientDir, 'f.bin'), 1000)
+
+        # the size is asked on a working connection, the ranges go to a port nothing listens on, taken
+        # for a server serving several clients so they are not sent over the working connection
+        dead = ('127.0.0.1', freePort())
+        client._concurrent[dead] = True
+        cwd = os.getcwd()
+        os.chdir(self.clientDir)
+        try:
+            with create_connection(('127.0.0.1', self.port)) as sock, contextlib.redirect_stdout(io.StringIO()) as out:
+                client.getMulti('f.bin', sock, dead, 4)
+        finally:
+            os.chdir(cwd)
+
+        self.assertIn('Command was unsuccessful', out.getvalue())
+        self.assertEqual(readFile(os.path.join(self.clientDir, 'f.bin')), local)
+        self.assertFalse(os.path.exists(os.path.join(self.clientDir, 'f.bin.part')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+################################################################################
+#   Filename:       test_resume.py
+#
+#   Description:    Round trips of interrupted transfers, 'put -c' and 'get -c'.
+#                   - An upload resumes onto the bytes the server kept, or
+#                     starts over when the local file changed since
+#                   - A download continues its part file, or starts over when
+#                     the file changed on the server since
+#
+################################################################################
+import os, sys, json, unittest
+from socket import create_connection
+
+from testutil import ROOT, ServerTestCase, writeRandom, readFile
+
+sys.path.insert(0, os.path.join(ROOT, 'client'))
+import client
+
+SIZE = 300000
+
+class ResumeTest(ServerTestCase):
+
+    # send the first half of some data as a RANGE PUT, like an upload interrupted half way
+    def putHalf(self, name, data):
+        with create_connection(('127.0.0.1', self.port)) as sock:
+            sock.sendall(client.rangePutRequest(name, len(data), 0, len(data) // 2) + data[:len(data) // 2])
+            self.assertEqual(client.recvExact(sock, 1)[0] >> 5, 0b000)
+            sock.sendall((0b100 << 5).to_bytes(1, 'big'))
+
+    # the size and mtime of a file on the server, as 'get -c' records them
+    def version(self, name):
+        with create_connection(('127.0.0.1', self.port)) as sock:
+            resCode, size, mtime, _ = client.statQuery(name, sock)
+            sock.sendall((0b100 << 5).to_bytes(1, 'big'))
+        return {'size': size, 'mtime': mtime}
+
+    # a part file holding the first half of data, with the version it was downloaded from
+    def writePart(self, name, data, version):
+        with open(os.path.join(self.clientDir, name + '.part'), 'wb') as f:
+            f.write(data[:len(data) // 2])
+        if version is not None:
+            with open(os.path.join(self.clientDir, name + '.part.meta'), 'w') as f:
+                json.dump(version, f)
+
+    def testPutResume(self):
+        data = writeRandom(os.path.join(self.clientDir, 'f.bin'), SIZE)
+        self.putHalf('f.bin', data)
+        out = self.client('put -c f.bin')
+        self.assertIn(f'({SIZE // 2} bytes resumed, {SIZE - SIZE // 2} bytes sent)', out)
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'f.bin')), data)
+
+    def testPutResumeEdited(self):
+        old = os.urandom(SIZE)
+        self.putHalf('f.bin', old)
+        # same size, other content
+        data = writeRandom(os.path.join(self.clientDir, 'f.bin'), SIZE)
+        out = self.client('put -c f.bin')
+        self.assertIn('changed since the interrupted upload', out)
+        self.assertIn(f'(0 bytes resumed, {SIZE} bytes sent)', out)
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'f.bin')), data)
+
+    def testGetResume(self):
+        data = writeRandom(os.path.join(self.serverDir, 'f.bin'), SIZE)
+        self.writePart('f.bin', data, self.version('f.bin'))
+        out = self.client('get -c f.bin')
+        self.assertIn(f'({SIZE // 2} bytes resumed, {SIZE - SIZE // 2} bytes received)', out)
+        self.assertEqual(readFile(os.path.join(self.clientDir, 'f.bin')), data)
+        self.assertFalse(os.path.exists(os.path.join(self.clientDir, 'f.bin.part.meta')))
+
+    def testGetResumeChanged(self):
+        old = writeRandom(os.path.join(self.serverDir, 'f.bin'), SIZE)
+        self.writePart('f.bin', old, self.version('f.bin'))
+        # a new version of the same size is uploaded in between
+        data = writeRandom(os.path.join(self.clientDir, 'f.bin'), SIZE)
+        self.client('put f.bin')
+        os.remove(os.path.join(self.clientDir, 'f.bin'))
+        out = self.client('get -c f.bin')
+        self.assertIn('downloading it again', out)
+        self.assertIn(f'(0 bytes resumed, {SIZE} bytes received)', out)
+        self.assertEqual(readFile(os.path.join(self.clientDir, 'f.bin')), data)
+
+    def testGetResumeUnknownPart(self):
+        data = writeRandom(os.path.join(self.serverDir, 'f.bin'), SIZE)
+        self.writePart('f.bin', os.urandom(SIZE), None)
+        out = self.client('get -c f.bin')
+        self.assertIn('(0 bytes resumed', out)
+        self.assertEqual(readFile(os.path.join(self.clientDir, 'f.bin')), data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+################################################################################
+#   Filename:       test_sync.py
+#
+#   Description:    Round trips of 'sync', uploading what changed in a
+#                   directory since its last sync.
+#                   - A first sync uploads every file, large ones included,
+#                     a second one finds nothing to do
+#                   - Edited files are uploaded again, renamed ones are
+#                     renamed on the server without sending their data
+#
+################################################################################
+import os, unittest
+
+from testutil import ServerTestCase, writeRandom, readFile
+
+class SyncTest(ServerTestCase):
+
+    serverArgs = ('-e', 'asyncio')
+
+    def testSync(self):
+        files = {'tr/a': 100, 'tr/d/b': 70000, 'tr/big': 10 * 1024 * 1024}
+        data = {name: writeRandom(os.path.join(self.clientDir, name), size) for name, size in files.items()}
+
+        out = self.client('sync tr')
+        self.assertIn(f'{len(files)} files uploaded, 0 failed', out)
+        for name in files:
+            self.assertEqual(readFile(os.path.join(self.serverDir, name)), data[name], name)
+        self.assertIn('tr is up to date.', self.client('sync tr'))
+
+        # an edit and a rename
+        data['tr/a'] = writeRandom(os.path.join(self.clientDir, 'tr/a'), 200)
+        os.rename(os.path.join(self.clientDir, 'tr/big'), os.path.join(self.clientDir, 'tr/moved'))
+        out = self.client('sync tr')
+        self.assertIn('tr/big has been renamed to tr/moved.', out)
+        self.assertIn('1 files uploaded, 0 failed', out)
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'tr/a')), data['tr/a'])
+        self.assertEqual(readFile(os.path.join(self.serverDir, 'tr/moved')), data['tr/big'])
+        self.assertFalse(os.path.exists(os.path.join(self.serverDir, 'tr/big')))
+
+if __name__ == '__main__':
+    unittest.main()
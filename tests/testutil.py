@@ -0,0 +1,70 @@
+################################################################################
+#   Filename:       testutil.py
+#
+#   Description:    Helpers shared by the round-trip tests in this directory.
+#                   - Starts server.py in a temporary directory with the
+#                     helpers of bench/benchutil.py
+#                   - Runs commands in an interactive client.py and returns
+#                     what it printed
+#
+#                   > py -m pytest -q tests
+#                   > py -m unittest discover tests
+#
+################################################################################
+import os, sys, shutil, subprocess, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench'))
+from benchutil import ROOT, CLIENT_PY, startServer, stopServer
+
+############################## FUNCTIONS ##############################
+
+# run commands in an interactive client.py, then say bye
+# Arguments:
+#  - port: port to connect to, integer
+#  - commands: commands to type, one per line, strings
+#  - directory: working directory of the client, string
+#  - args: extra input arguments for client.py, strings
+# Return:
+#  - what the client printed, string
+def runClient(port, commands, directory, *args):
+    return subprocess.run([sys.executable, CLIENT_PY, '127.0.0.1', str(port), *args], cwd=directory,
+                          input='\n'.join(commands) + '\nbye\n', capture_output=True, text=True, timeout=120).stdout
+
+# write a file of random bytes, creating its directories
+# Arguments:
+#  - path: path of the file, string
+#  - size: size in bytes, integer
+# Return:
+#  - content of the file, bytes
+def writeRandom(path, size):
+    if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = os.urandom(size)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+# read a whole file
+# Arguments:
+#  - path: path of the file, string
+# Return:
+#  - content of the file, bytes
+def readFile(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+# test case with a server directory and a client directory, and a server started in the first one for each test
+class ServerTestCase(unittest.TestCase):
+
+    serverArgs = ()     # extra input arguments of the server started by setUp()
+
+    def setUp(self):
+        self.serverDir = tempfile.mkdtemp()
+        self.clientDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.serverDir, True)
+        self.addCleanup(shutil.rmtree, self.clientDir, True)
+        self.proc, self.port = startServer(self.serverDir, *self.serverArgs)
+        self.addCleanup(stopServer, self.proc)
+
+    # run commands in a client connected to the server of the test, see runClient()
+    def client(self, *commands, args=()):
+        return runClient(self.port, commands, self.clientDir, *args)